@@ -1,9 +1,14 @@
 from fastapi import Request, HTTPException, status
 from fastapi.security.api_key import APIKeyHeader
+from utils import metrics
 from utils.config import appsettings
+from utils.logger import get_logger
+import math
 import time
 import redis.asyncio as redis
 
+logger = get_logger("auth")
+
 api_key_header = APIKeyHeader(name="X-API-KEY", auto_error=False)
 
 _redis_client = None
@@ -26,65 +31,100 @@ async def close_redis():
     if _redis_client:
         await _redis_client.close()
 
+# Token bucket, refilled continuously at `limit` tokens per `window` seconds.
+# Refill, consume and expire happen in one atomic script call, so concurrent
+# requests for the same key can't both spend the last token.
+# KEYS[1] bucket; ARGV limit, window, now, ttl -> {allowed, retry_after}
+TOKEN_BUCKET_LUA = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or limit
+local last = tonumber(bucket[2]) or now
+if now > last then
+    tokens = math.min(limit, tokens + (now - last) * limit / window)
+    last = now
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) * window / limit
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'last', tostring(last))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {allowed, tostring(retry_after)}
+"""
+
+RATE_WINDOW = 3600.0
+BUCKET_TTL = 7200  # idle buckets go away after 2 hours
+
+_bucket_script = None
+# api key -> monotonic time its bucket has a token again (local pre-check)
+_blocked_until: dict[str, float] = {}
+
+
+def _token_bucket():
+    """The registered script; redis-py sends EVALSHA and reloads on NOSCRIPT."""
+    global _bucket_script
+    if _bucket_script is None or _bucket_script.registered_client is not _redis_client:
+        _bucket_script = _redis_client.register_script(TOKEN_BUCKET_LUA)
+    return _bucket_script
+
+
+async def take_token(api_key: str) -> tuple[bool, float]:
+    """Spend one token of `api_key`'s bucket; returns (allowed, retry_after)."""
+    allowed, retry_after = await _token_bucket()(
+        keys=[f"rate_limit:{api_key}"],
+        args=[appsettings.RATE_LIMIT_PER_HOUR, RATE_WINDOW, time.time(), BUCKET_TTL])
+    return bool(int(allowed)), float(retry_after)
+
+
+def _too_many(retry_after: float) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         detail="Rate limit exceeded",
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
 async def check_api_key(request: Request):
+    start = time.perf_counter()
+    code = status.HTTP_200_OK
+    try:
+        return await _authorize(request)
+    except HTTPException as e:
+        code = e.status_code
+        raise
+    finally:
+        metrics.AUTH_SECONDS.observe(time.perf_counter() - start, status=code)
+
+
+async def _authorize(request: Request) -> str:
     api_key = request.headers.get("X-API-KEY")
     if not api_key or api_key not in appsettings.API_KEYS:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
             detail="Invalid API Key"
         )
-    
-    # Rate limit using Redis
-    limit = appsettings.RATE_LIMIT_PER_HOUR
-    now = time.time()
-    bucket_key = f"rate_limit:{api_key}"
-    
-    # Use Redis pipeline for atomic operations
-    pipe = _redis_client.pipeline()
-    
+
+    precheck = appsettings.RATE_LIMIT_PRECHECK
+    if precheck:
+        # the bucket was empty last time and can't have refilled yet
+        wait = _blocked_until.get(api_key, 0.0) - time.monotonic()
+        if wait > 0:
+            raise _too_many(wait)
+
     try:
-        # Get current bucket state
-        bucket_data = await _redis_client.hgetall(bucket_key)
-        
-        if not bucket_data:
-            # Initialize new bucket
-            bucket = {"tokens": str(limit), "last": str(now)}
-            await _redis_client.hset(bucket_key, mapping=bucket)
-            await _redis_client.expire(bucket_key, 7200)  # Expire after 2 hours of inactivity
-        else:
-            tokens = float(bucket_data.get("tokens", limit))
-            last = float(bucket_data.get("last", now))
-            
-            # Refill tokens proportional to time elapsed
-            elapsed = now - last
-            refill = (elapsed / 3600.0) * limit
-            
-            if refill > 0:
-                tokens = min(limit, tokens + refill)
-                last = now
-            
-            # Check if tokens available
-            if tokens < 1:
-                raise HTTPException(
-                    status_code=429, 
-                    detail="Rate limit exceeded"
-                )
-            
-            # Consume one token
-            tokens -= 1
-            
-            # Update bucket in Redis
-            await _redis_client.hset(
-                bucket_key,
-                mapping={"tokens": str(tokens), "last": str(last)}
-            )
-            await _redis_client.expire(bucket_key, 7200)
-    
-    except HTTPException:
-        raise
+        allowed, retry_after = await take_token(api_key)
     except Exception as e:
-        # Log error but don't fail the request if Redis is down
-        print(f"Redis error in rate limiting: {e}")
+        logger.error("Redis error in rate limiting: %s", e)
         raise HTTPException(status_code=503, detail="Rate limiting service unavailable")
-    
-    return api_key
\ No newline at end of file
+
+    if not allowed:
+        if precheck:
+            _blocked_until[api_key] = time.monotonic() + retry_after
+        raise _too_many(retry_after)
+    _blocked_until.pop(api_key, None)
+    return api_key
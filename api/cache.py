@@ -0,0 +1,92 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from bson import ObjectId
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from utils import cache
+from utils.config import appsettings
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the json module
+    orjson = None
+
+_backend = None
+
+
+def get_backend():
+    """The response cache picked by RESPONSE_CACHE_BACKEND, or None."""
+    global _backend
+    if _backend is None:
+        kind = appsettings.RESPONSE_CACHE_BACKEND
+        if kind == "memory":
+            _backend = cache.LRUCache(appsettings.RESPONSE_CACHE_SIZE,
+                                      appsettings.RESPONSE_CACHE_TTL)
+        elif kind == "redis":
+            _backend = cache.RedisCache(appsettings.RESPONSE_CACHE_TTL)
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+def cache_key(endpoint: str, params: dict, generation: int) -> str:
+    """Stable key for `params`: unset values dropped, order irrelevant."""
+    normalized = {k: v for k, v in sorted(params.items()) if v is not None}
+    raw = json.dumps([endpoint, normalized, generation], separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    return jsonable_encoder(value)
+
+
+def dumps(payload) -> str:
+    """Compact JSON for a response payload.
+
+    Plain dicts and lists are serialized directly; only values JSON can't
+    represent (datetimes, ObjectIds, models) go through `_default`.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(payload, default=_default, separators=(",", ":"))
+
+
+def _respond(request: Request, entry: dict) -> Response:
+    headers = {**entry["headers"], "ETag": entry["etag"]}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+async def cached_response(request: Request, endpoint: str, params: dict,
+                          build: Callable[[], Awaitable[tuple[object, Optional[dict]]]]) -> Response:
+    """Read-through cache around `build`, with ETag / 304 support.
+
+    `build` returns the payload and any extra response headers. Entries are
+    keyed on the current crawl generation, so a crawl that writes books
+    invalidates everything cached before it.
+    """
+    backend = get_backend()
+    key = cache_key(endpoint, params, await cache.current_generation())
+    entry = await backend.get(key) if backend else None
+    if entry is None:
+        payload, headers = await build()
+        body = dumps(payload)
+        entry = {"body": body,
+                 "etag": '"%s"' % hashlib.sha1(body.encode()).hexdigest(),
+                 "headers": headers or {}}
+        if backend:
+            await backend.set(key, entry)
+    return _respond(request, entry)
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Iterable
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _plain(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _row(doc: dict, fields: Iterable[str]) -> dict:
+    """`doc` with `_id` renamed to `id`, restricted to `fields` in order."""
+    doc["id"] = doc.pop("_id", None)
+    return {f: doc.get(f) for f in fields}
+
+
+def _csv_cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_plain, separators=(",", ":"))
+    if isinstance(value, (ObjectId, datetime)):
+        return _plain(value)
+    return value
+
+
+async def _ndjson(cursor, fields: list[str], chunk_rows: int) -> AsyncIterator[str]:
+    lines = []
+    async for doc in cursor:
+        lines.append(json.dumps(_row(doc, fields), default=_plain))
+        if len(lines) >= chunk_rows:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def _csv(cursor, fields: list[str], chunk_rows: int) -> AsyncIterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(fields)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow([_csv_cell(v) for v in _row(doc, fields).values()])
+        rows += 1
+        if rows >= chunk_rows:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            rows = 0
+    yield buf.getvalue()
+
+
+def stream_export(cursor, fields: list[str], fmt: str, name: str,
+                  chunk_rows: int) -> StreamingResponse:
+    """Stream `cursor` out as NDJSON or CSV, `chunk_rows` documents per chunk.
+
+    Only one chunk is held at a time, so memory doesn't grow with the size
+    of the export.
+    """
+    body = (_csv if fmt == "csv" else _ndjson)(cursor, fields, chunk_rows)
+    return StreamingResponse(body, media_type=FORMATS[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{name}.{fmt}"'})
@@ -1,24 +1,90 @@
+import asyncio
+import time
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from api.routes import router as api_router
 from scheduler.jobs import start_scheduler
+from db import mongo, search, stats
 from db.mongo import ensure_indexes
+from utils import cache, events, metrics
 from utils.logger import get_logger
+from api import auth
 from api.auth import init_redis, close_redis
+from crawler.client import close_client
 
 logger = get_logger("api")
 
+# feeds this worker's /changes/stream subscribers from redis
+_event_listener = None
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, labelled by route template, not raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_and_record(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                            route=route, status=status_code)
+
+
 app = FastAPI(title="Books Crawler API")
+app.add_middleware(MetricsMiddleware)
 app.include_router(api_router)
 
+
+async def _rebuild_search(run_id: str):
+    # crawls run in their own process; this one only hears they finished
+    await search.rebuild(mongo.books_col)
+
+
+events.on_crawl_finished(_rebuild_search)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape target; left outside the API key like a health check."""
+    return PlainTextResponse(await metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.on_event("startup")
 async def startup_event():
     await ensure_indexes()
+    # /stats of a database that predates the summary
+    await stats.seed(mongo.books_col, mongo.stats_col)
     start_scheduler()
     await init_redis()
+    # the crawl-driven cache generation lives in redis so that every API
+    # worker (and a crawler in another process) agrees on it
+    cache.configure(auth._redis_client)
+    # change events, metrics and the end of crawls from crawl processes
+    global _event_listener
+    events.configure(auth._redis_client)
+    metrics.configure(auth._redis_client)
+    _event_listener = asyncio.create_task(events.listen(auth._redis_client))
 
     logger.info("App startup complete")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    await close_redis()
\ No newline at end of file
+    if _event_listener:
+        _event_listener.cancel()
+    await close_redis()
+    await close_client()
\ No newline at end of file
@@ -0,0 +1,71 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from utils.hashing import sha256_text
+
+
+def cursor_scope(sort: str, filters: dict) -> str:
+    """The query a cursor belongs to: its sort field and a digest of its filters."""
+    digest = sha256_text(json.dumps(filters, sort_keys=True, default=str))[:12]
+    return f"{sort}:{digest}"
+
+
+def encode_cursor(key: Any, _id: ObjectId, scope: Optional[str] = None) -> str:
+    """Opaque token for the position right after (`key`, `_id`) in the query
+    `scope` (see `cursor_scope`) describes."""
+    payload = {"k": key, "id": str(_id)}
+    if isinstance(key, datetime):
+        payload = {"k": key.isoformat(), "t": "dt", "id": str(_id)}
+    if scope is not None:
+        payload["s"] = scope
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str, scope: Optional[str] = None) -> tuple[Any, ObjectId]:
+    """(key, _id) of a cursor; 400 if it's malformed or from another query."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        key = payload["k"]
+        if payload.get("t") == "dt":
+            key = datetime.fromisoformat(key)
+        position = key, ObjectId(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # a key from another sort would silently land on the wrong page
+    if payload.get("s") != scope:
+        raise HTTPException(status_code=400,
+                            detail="Cursor belongs to a different sort or filter")
+    return position
+
+
+def keyset_filter(field: str, direction: int, key: Any, _id: ObjectId) -> dict:
+    """Documents strictly after (`key`, `_id`) in a (field, _id) sort.
+
+    Missing/null values sort before everything else in Mongo, so they come
+    first in ascending order and last in descending order.
+    """
+    op = "$gt" if direction == 1 else "$lt"
+    if key is None:
+        after_nulls = [{field: None, "_id": {op: _id}}]
+        if direction == 1:
+            after_nulls.append({field: {"$ne": None}})
+        return {"$or": after_nulls}
+    after = [{field: {op: key}}, {field: key, "_id": {op: _id}}]
+    if direction == -1:
+        after.append({field: None})
+    return {"$or": after}
+
+
+def and_query(query: dict, extra: Optional[dict]) -> dict:
+    if not extra:
+        return query
+    if not query:
+        return extra
+    return {"$and": [query, extra]}
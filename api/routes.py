@@ -1,13 +1,40 @@
-from fastapi import APIRouter, Depends, Query
+import asyncio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 from api.auth import check_api_key
-from db.mongo import books_col, changes_col
+from api.cache import cached_response, dumps
+from api.export import stream_export
+from api.pagination import and_query, cursor_scope, decode_cursor, encode_cursor, keyset_filter
+from db.mongo import books_col, changes_col, crawl_runs_col, history_col, snapshots_col, stats_col
+from db import history, search
+from db.snapshots import get_snapshot_store
 from pydantic import BaseModel
 from typing import List, Optional
 from bson import ObjectId
-from datetime import datetime
-from scheduler.jobs import run_crawl_job
+from datetime import datetime, timezone
+from crawler import runs
+from scheduler.jobs import CrawlBusy, runner
+from utils import events
+from utils.config import appsettings
+from utils.dates import as_utc
 
 router = APIRouter(dependencies=[Depends(check_api_key)])
+snapshot_store = get_snapshot_store(snapshots_col)
+
+# sort_by -> direction; every sort is tie-broken on _id in the same
+# direction, matching the compound indexes in ensure_indexes
+BOOK_SORTS = {"name": 1, "rating": -1, "price_excl_vat": -1, "num_reviews": -1}
+
+# columns of /export/books and /export/changes, in output order
+EXPORT_BOOK_FIELDS = ["id", "name", "category", "price_excl_vat", "price_incl_vat",
+                      "availability", "num_reviews", "rating", "source_url",
+                      "crawl_timestamp"]
+EXPORT_BOOK_PROJECTION = {f: 1 for f in EXPORT_BOOK_FIELDS if f != "id"}
+EXPORT_CHANGE_FIELDS = ["id", "book_id", "source_url", "change_type", "when", "details"]
+EXPORT_CHANGE_PROJECTION = {f: 1 for f in EXPORT_CHANGE_FIELDS if f != "id"}
+
+# how long an SSE client waits before reconnecting
+RETRY_MS = 3000
 
 class BookOut(BaseModel):
     id: str
@@ -17,16 +44,53 @@ class BookOut(BaseModel):
     price_incl_vat: Optional[float]
     rating: Optional[int]
 
-@router.get("/books", response_model=List[BookOut])
-async def get_books(
-    category: Optional[str] = Query(None),
-    min_price: Optional[float] = Query(None),
-    max_price: Optional[float] = Query(None),
-    rating: Optional[int] = Query(None),
-    sort_by: Optional[str] = Query("name"),
-    page: int = Query(1, ge=1),
-    page_size: int = Query(20, ge=1, le=200),
-):
+class HistoryPoint(BaseModel):
+    when: datetime
+    price_incl_vat: Optional[float]
+    price_excl_vat: Optional[float]
+    availability: Optional[str]
+    num_reviews: Optional[int]
+
+class BookHistory(BaseModel):
+    book_id: str
+    points: List[HistoryPoint]
+
+class SearchHit(BookOut):
+    score: float
+
+class BookBatch(BaseModel):
+    ids: List[str] = []
+    source_urls: List[str] = []
+
+BOOK_OUT_FIELDS = [f for f in BookOut.model_fields if f != "id"]
+BOOK_OUT_PROJECTION = {f: 1 for f in BOOK_OUT_FIELDS}
+# what `fields=` may ask for; raw_html and crawl bookkeeping stay internal
+BOOK_FIELDS = ["name", "description", "category", "price_excl_vat", "price_incl_vat",
+               "availability", "num_reviews", "rating", "image_url", "source_url",
+               "crawl_timestamp", "last_seen"]
+FIELDS_QUERY = Query(None, description="comma-separated fields to return, e.g. name,price_incl_vat")
+
+def parse_fields(fields: Optional[str], default: List[str]) -> List[str]:
+    """The `fields=` list, validated; `id` always comes back anyway."""
+    if not fields:
+        return default
+    names = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip() and f.strip() != "id"))
+    unknown = [f for f in names if f not in BOOK_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown fields: {', '.join(unknown)}")
+    return names
+
+def book_out(doc: dict, fields: List[str]) -> dict:
+    """A book as the list endpoints return it; plain dicts serialize far
+    faster than a model per row."""
+    out = {"id": str(doc["_id"])}
+    for f in fields:
+        out[f] = doc.get(f)
+    return out
+
+def book_query(category: Optional[str] = None, min_price: Optional[float] = None,
+               max_price: Optional[float] = None, rating: Optional[int] = None) -> dict:
+    """Mongo filter for the /books (and /export/books) query parameters."""
     query = {}
     if category:
         query["category"] = category
@@ -38,45 +102,397 @@ async def get_books(
             query["price_excl_vat"]["$gte"] = min_price
         if max_price is not None:
             query["price_excl_vat"]["$lte"] = max_price
-    skip = (page - 1) * page_size
-    sort_field = sort_by if sort_by in ("rating","price_excl_vat","num_reviews","name") else "name"
-    cursor = books_col.find(query).sort(sort_field, -1 if sort_field != "name" else 1).skip(skip).limit(page_size)
-    docs = []
-    async for d in cursor:
-        docs.append(BookOut(
-            id=str(d["_id"]),
-            name=d["name"],
-            category=d.get("category"),
-            price_excl_vat=d.get("price_excl_vat"),
-            price_incl_vat=d.get("price_incl_vat"),
-            rating=d.get("rating"),
-            # availability=d.get("availability"),
-            # reviews=d.get("num_reviews"),
-
-        ))
-    return docs
+    return query
+
+@router.get("/books", response_model=List[BookOut])
+async def get_books(
+    request: Request,
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    rating: Optional[int] = Query(None),
+    sort_by: Optional[str] = Query("name"),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page; replaces page"),
+    fields: Optional[str] = FIELDS_QUERY,
+):
+    sort_field = sort_by if sort_by in BOOK_SORTS else "name"
+    out_fields = parse_fields(fields, BOOK_OUT_FIELDS)
+    params = {"category": category, "min_price": min_price, "max_price": max_price,
+              "rating": rating or None, "sort_by": sort_field, "page_size": page_size,
+              "page": None if cursor else page, "cursor": cursor,
+              "fields": None if out_fields is BOOK_OUT_FIELDS else ",".join(out_fields)}
+
+    scope = cursor_scope(sort_field, {"category": category, "min_price": min_price,
+                                      "max_price": max_price, "rating": rating or None})
+
+    async def build():
+        query = book_query(category, min_price, max_price, rating)
+        direction = BOOK_SORTS[sort_field]
+        if cursor:
+            query = and_query(query, keyset_filter(sort_field, direction,
+                                                   *decode_cursor(cursor, scope)))
+            skip = 0
+        else:
+            skip = (page - 1) * page_size
+        # one extra row tells us whether there is a next page
+        # the sort key is fetched even when not returned: the cursor needs it
+        projection = {f: 1 for f in (*out_fields, sort_field)}
+        found = books_col.find(query, projection) \
+            .sort([(sort_field, direction), ("_id", direction)]).skip(skip).limit(page_size + 1)
+        rows = [d async for d in found]
+        headers = {}
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            headers["X-Next-Cursor"] = encode_cursor(last.get(sort_field), last["_id"], scope)
+        return [book_out(d, out_fields) for d in rows], headers
+
+    return await cached_response(request, "books", params, build)
+
+# declared before /books/{book_id}, which would otherwise swallow "search"
+@router.get("/books/search", response_model=List[SearchHit])
+async def search_books(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    fields: Optional[str] = FIELDS_QUERY,
+):
+    """Books matching any word of `q` in name or description, most relevant first."""
+    out_fields = parse_fields(fields, BOOK_OUT_FIELDS)
+    scope = cursor_scope("score", {"q": q})
+
+    async def build():
+        after = decode_cursor(cursor, scope) if cursor else None
+        hits = await search.search(books_col, q, page_size + 1,
+                                   {"_id": 1, **{f: 1 for f in out_fields}}, after)
+        headers = {}
+        if len(hits) > page_size:
+            hits = hits[:page_size]
+            score, last = hits[-1]
+            headers["X-Next-Cursor"] = encode_cursor(score, last["_id"], scope)
+        docs = [{**book_out(d, out_fields), "score": score} for score, d in hits]
+        return docs, headers
+
+    params = {"q": q, "page_size": page_size, "cursor": cursor,
+              "fields": None if out_fields is BOOK_OUT_FIELDS else ",".join(out_fields)}
+    return await cached_response(request, "search", params, build)
+
+@router.post("/books/batch")
+async def get_books_batch(body: BookBatch, fields: Optional[str] = FIELDS_QUERY):
+    """Up to BOOKS_BATCH_MAX books by id and/or source_url in one query.
+
+    Books come back in request order; what wasn't found is listed under
+    `missing`.
+    """
+    out_fields = parse_fields(fields, BOOK_OUT_FIELDS)
+    ids = list(dict.fromkeys(body.ids))
+    urls = list(dict.fromkeys(body.source_urls))
+    if len(ids) + len(urls) > appsettings.BOOKS_BATCH_MAX:
+        raise HTTPException(status_code=400,
+                            detail=f"at most {appsettings.BOOKS_BATCH_MAX} ids and source_urls")
+    invalid = [i for i in ids if not ObjectId.is_valid(i)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"invalid ids: {', '.join(invalid)}")
+    wanted = []
+    if ids:
+        wanted.append({"_id": {"$in": [ObjectId(i) for i in ids]}})
+    if urls:
+        wanted.append({"source_url": {"$in": urls}})
+    by_id, by_url = {}, {}
+    if wanted:
+        query = wanted[0] if len(wanted) == 1 else {"$or": wanted}
+        projection = {f: 1 for f in (*out_fields, "source_url")}
+        async for doc in books_col.find(query, projection):
+            by_id[str(doc["_id"])] = by_url[doc.get("source_url")] = doc
+    books, missing = [], []
+    for key, found in [*((i, by_id) for i in ids), *((u, by_url) for u in urls)]:
+        doc = found.get(key)
+        if doc is None:
+            missing.append(key)
+        else:
+            books.append(book_out(doc, out_fields))
+    return Response(content=dumps({"books": books, "missing": missing}),
+                    media_type="application/json")
 
 @router.get("/books/{book_id}")
-async def get_book(book_id: str):
-    doc = await books_col.find_one({"_id": ObjectId(book_id)})
+async def get_book(request: Request, book_id: str, fields: Optional[str] = FIELDS_QUERY):
+    if not ObjectId.is_valid(book_id):
+        raise HTTPException(status_code=404, detail="not found")
+    out_fields = parse_fields(fields, None)
+    # the page snapshot is only served by /books/{book_id}/snapshot
+    # `fields=id` is an empty list, not the default
+    if out_fields is None:
+        projection = {"raw_html": 0}
+    else:
+        projection = {"_id": 1, **{f: 1 for f in out_fields}}
+
+    async def build():
+        doc = await books_col.find_one({"_id": ObjectId(book_id)}, projection)
+        if not doc:
+            return {"error": "not found"}, None
+        doc["_id"] = str(doc["_id"])  # Convert _id to string directly
+        return doc, None
+
+    params = {"id": book_id, "fields": None if out_fields is None else ",".join(out_fields)}
+    return await cached_response(request, "book", params, build)
+
+@router.get("/books/{book_id}/snapshot", response_class=HTMLResponse)
+async def get_book_snapshot(book_id: str):
+    if not ObjectId.is_valid(book_id):
+        raise HTTPException(status_code=404, detail="not found")
+    doc = await books_col.find_one({"_id": ObjectId(book_id)},
+                                   {"content_hash": 1, "raw_html": 1})
     if not doc:
-        return {"error": "not found"}
-    doc["_id"] = str(doc["_id"])  # Convert _id to string directly
-    doc["crawl_timestamp"] = doc["crawl_timestamp"].isoformat()
-    return doc
+        raise HTTPException(status_code=404, detail="not found")
+    html = None
+    if snapshot_store and doc.get("content_hash"):
+        html = await snapshot_store.get(doc["content_hash"])
+    # books not recrawled since the snapshot store came in still carry
+    # their html inline
+    if html is None:
+        html = doc.get("raw_html")
+    if html is None:
+        raise HTTPException(status_code=404, detail="snapshot not found")
+    return HTMLResponse(html)
+
+@router.get("/books/{book_id}/history", response_model=BookHistory)
+async def get_book_history(
+    request: Request,
+    book_id: str,
+    start: Optional[datetime] = Query(None, alias="from", description="oldest point to include"),
+    end: Optional[datetime] = Query(None, alias="to", description="newest point to include"),
+):
+    """Prices, availability and review count each time they changed, oldest first."""
+    if not ObjectId.is_valid(book_id):
+        raise HTTPException(status_code=404, detail="not found")
+    if start and end and as_utc(start) > as_utc(end):
+        raise HTTPException(status_code=400, detail="from is after to")
+
+    async def build():
+        points = await history.read(history_col, ObjectId(book_id), start, end)
+        return {"book_id": book_id, "points": points}, None
+
+    params = {"id": book_id, "from": start and start.isoformat(), "to": end and end.isoformat()}
+    return await cached_response(request, "history", params, build)
 
 @router.get("/changes")
-async def get_changes(limit: int = 50):
-    cur = changes_col.find().sort("when", -1).limit(limit)
+async def get_changes(
+    response: Response,
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor: page further back in time"),
+    since: Optional[str] = Query(None, description="X-Since-Cursor: only changes newer than it, oldest first"),
+):
+    """Latest changes first; `cursor` pages backwards, `since` polls forwards.
+
+    X-Since-Cursor always points at the newest change the caller has seen,
+    so pollers can keep passing it back as `since`.
+    """
+    if since:
+        key, _id = decode_cursor(since)
+        direction = 1
+        query = keyset_filter("when", 1, key, _id)
+    else:
+        direction = -1
+        query = keyset_filter("when", -1, *decode_cursor(cursor)) if cursor else {}
+    cur = changes_col.find(query).sort([("when", direction), ("_id", direction)]).limit(limit)
+    raw = [c async for c in cur]
+    if raw:
+        newest = raw[-1] if since else raw[0]
+        response.headers["X-Since-Cursor"] = encode_cursor(newest["when"], newest["_id"])
+        if not since and len(raw) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor(raw[-1]["when"], raw[-1]["_id"])
+    elif since:
+        response.headers["X-Since-Cursor"] = since
     out = []
-    async for c in cur:
+    for c in raw:
         c["_id"] = str(c["_id"])  # Convert the document's _id
         c["book_id"] = str(c["book_id"])  # Convert the book_id reference
         c["when"] = c["when"].isoformat()
         out.append(c)
     return out
 
-@router.post("/run-crawl-sync")
+async def _replay(after: tuple[datetime, ObjectId], query: dict):
+    """Stored changes after `after`, oldest first, as (key, frame) items."""
+    batch = appsettings.CHANGE_STREAM_REPLAY_BATCH
+    while True:
+        cur = changes_col.find(and_query(keyset_filter("when", 1, *after), query))
+        page = [c async for c in cur.sort([("when", 1), ("_id", 1)]).limit(batch)]
+        for change in page:
+            event = events.to_event(change)
+            after = events.event_key(event)
+            yield after, events.frame(event)
+        if len(page) < batch:
+            return
+
+@router.get("/changes/stream")
+async def stream_changes(
+    category: Optional[List[str]] = Query(None, description="only these categories"),
+    change_type: Optional[List[str]] = Query(None, description="only these change types"),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Server-Sent Events: each change as the crawler writes it.
+
+    Reconnecting with Last-Event-ID first replays what was missed from the
+    changes collection, then continues live.
+    """
+    after = None
+    if last_event_id:
+        if not ObjectId.is_valid(last_event_id):
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+        seen = await changes_col.find_one({"_id": ObjectId(last_event_id)}, {"when": 1})
+        if seen:
+            after = (as_utc(seen["when"]), seen["_id"])
+    query = {}
+    if category:
+        query["category"] = {"$in": category}
+    if change_type:
+        query["change_type"] = {"$in": change_type}
+    # subscribe before replaying, so nothing falls between the two
+    sub = events.hub.subscribe(category, change_type)
+
+    async def frames():
+        nonlocal after
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            if after:
+                async for after, frame in _replay(after, query):
+                    yield frame
+            while True:
+                try:
+                    item = await asyncio.wait_for(sub.queue.get(),
+                                                  appsettings.CHANGE_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is events.OVERFLOW:
+                    return  # the client reconnects and replays from its last id
+                key, frame = item
+                if after and key <= after:
+                    continue  # already sent by the replay
+                yield frame
+        finally:
+            events.hub.unsubscribe(sub)
+
+    return StreamingResponse(frames(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/stats")
+async def get_stats(request: Request, category: Optional[str] = Query(None)):
+    """Per-category counts, price range/average and rating histogram.
+
+    Read from the summary the crawl maintains (see db/stats.py), not
+    aggregated over the books on each call.
+    """
+    async def build():
+        query = {"_id": category} if category else {}
+        categories = []
+        async for s in stats_col.find(query).sort("_id", 1):
+            price_count = s.get("price_count") or 0
+            categories.append({
+                "category": s["_id"],
+                "count": s["count"],
+                "price_min": s.get("price_min"),
+                "price_max": s.get("price_max"),
+                "price_avg": round(s["price_sum"] / price_count, 2) if price_count else None,
+                "ratings": {r: n for r, n in sorted((s.get("ratings") or {}).items()) if n},
+            })
+        return {"categories": categories,
+                "total": sum(c["count"] for c in categories)}, None
+
+    return await cached_response(request, "stats", {"category": category}, build)
+
+@router.get("/export/books")
+async def export_books(
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    rating: Optional[int] = Query(None),
+    since: Optional[datetime] = Query(None, description="only books (re)crawled at or after this time"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+):
+    """Every matching book, streamed in `_id` order."""
+    query = book_query(category, min_price, max_price, rating)
+    if since:
+        # an unchanged or 304 recrawl only moves last_seen
+        query["last_seen"] = {"$gte": since}
+    batch = appsettings.EXPORT_BATCH_SIZE
+    cursor = books_col.find(query, EXPORT_BOOK_PROJECTION).sort("_id", 1).batch_size(batch)
+    return stream_export(cursor, EXPORT_BOOK_FIELDS, format, "books", batch)
+
+@router.get("/export/changes")
+async def export_changes(
+    since: Optional[datetime] = Query(None, description="only changes at or after this time"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+):
+    """Every change (since `since`), oldest first."""
+    query = {"when": {"$gte": since}} if since else {}
+    batch = appsettings.EXPORT_BATCH_SIZE
+    cursor = changes_col.find(query, EXPORT_CHANGE_PROJECTION) \
+        .sort([("when", 1), ("_id", 1)]).batch_size(batch)
+    return stream_export(cursor, EXPORT_CHANGE_FIELDS, format, "changes", batch)
+
+class CrawlRequest(BaseModel):
+    mode: Optional[str] = None  # "full" or "incremental"; the scheduler's choice by default
+    resume: bool = True
+
+def _crawl_out(run: dict) -> dict:
+    out = {"id": str(run["_id"]), "cancel_requested": bool(run.get("cancel_requested"))}
+    for key in ("status", "mode", "started", "finished", "heartbeat", "progress", "urls", "error"):
+        if run.get(key) is not None:
+            out[key] = run[key]
+    beat = run.get("heartbeat") or run.get("started")
+    if out.get("status") == runs.RUNNING and beat:
+        # a crawl whose process died stops beating long before anyone fails it
+        age = (datetime.now(timezone.utc) - as_utc(beat)).total_seconds()
+        if age > appsettings.CRAWL_LOCK_TTL:
+            out["status"] = "stale"
+    return out
+
+@router.post("/crawls", status_code=202)
+async def start_crawl(body: Optional[CrawlRequest] = None):
+    """Start a crawl in the background; 409 while another one runs."""
+    body = body or CrawlRequest()
+    if body.mode not in (None, runs.FULL, runs.INCREMENTAL):
+        raise HTTPException(status_code=422, detail="mode must be full or incremental")
+    try:
+        run_id = await runner.start(resume=body.resume, mode=body.mode)
+    except CrawlBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"id": str(run_id), "status": runs.RUNNING}
+
+@router.get("/crawls/{run_id}")
+async def get_crawl(run_id: str):
+    """Status and live progress (pages, books, changes, errors, rate) of a crawl."""
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="not found")
+    run = await crawl_runs_col.find_one({"_id": ObjectId(run_id)})
+    if not run:
+        raise HTTPException(status_code=404, detail="not found")
+    return _crawl_out(run)
+
+@router.post("/crawls/{run_id}/cancel", status_code=202)
+async def cancel_crawl(run_id: str):
+    """Ask a running crawl to stop; it drains, checkpoints and ends as cancelled."""
+    if not ObjectId.is_valid(run_id):
+        raise HTTPException(status_code=404, detail="not found")
+    run = await crawl_runs_col.find_one_and_update(
+        {"_id": ObjectId(run_id), "status": runs.RUNNING},
+        {"$set": {"cancel_requested": True}})
+    if not run:
+        if await crawl_runs_col.count_documents({"_id": ObjectId(run_id)}):
+            raise HTTPException(status_code=409, detail="crawl is not running")
+        raise HTTPException(status_code=404, detail="not found")
+    return {"id": run_id, "cancel_requested": True}
+
+@router.post("/run-crawl-sync", deprecated=True)
 async def run_crawl_sync():
-    await run_crawl_job()   # awaits until crawler finishes
-    return {"message": "Crawl finished"}
+    """Start a crawl and hold the request until it ends; prefer POST /crawls."""
+    try:
+        run_id = await runner.start()
+    except CrawlBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    run = await runner.wait(run_id)
+    return {"message": f"Crawl {run['status']}", "id": str(run_id)}
@@ -0,0 +1,72 @@
+"""
+Per-request overhead of `check_api_key` against an in-process fakeredis.
+
+    python -m benchmarks.bench_auth [--requests 20000] [--concurrency 50]
+
+Two scenarios: "allowed" (the limit is never reached) and "over_limit"
+(the bucket is empty, with and without the local pre-check). Prints one
+JSON line each with p50/p99 latency in microseconds.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import fakeredis
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from api import auth
+from utils.config import appsettings
+
+KEY = appsettings.API_KEYS[0]
+REQUEST = Request({"type": "http", "headers": [(b"x-api-key", KEY.encode())]})
+
+
+async def bench(scenario: str, requests: int, concurrency: int, limit: int,
+                precheck: bool) -> dict:
+    auth._redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    auth._bucket_script = None
+    auth._blocked_until.clear()
+    appsettings.RATE_LIMIT_PER_HOUR = limit
+    appsettings.RATE_LIMIT_PRECHECK = precheck
+    latencies: list[float] = []
+    rejected = 0
+
+    async def client(n: int):
+        nonlocal rejected
+        for _ in range(n):
+            start = time.perf_counter()
+            try:
+                await auth.check_api_key(REQUEST)
+            except HTTPException:
+                rejected += 1
+            latencies.append(time.perf_counter() - start)
+
+    per_client = requests // concurrency
+    start = time.perf_counter()
+    await asyncio.gather(*(client(per_client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pct = statistics.quantiles(latencies, n=100)
+    return {"scenario": scenario, "precheck": precheck, "concurrency": concurrency,
+            "requests": len(latencies), "rejected": rejected,
+            "p50_us": round(pct[49] * 1e6, 1), "p99_us": round(pct[98] * 1e6, 1),
+            "requests_per_sec": round(len(latencies) / elapsed, 1)}
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--requests", type=int, default=20000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    args = ap.parse_args()
+
+    n, c = args.requests, args.concurrency
+    print(json.dumps(await bench("allowed", n, c, limit=n * 10, precheck=True)))
+    for precheck in (False, True):
+        print(json.dumps(await bench("over_limit", n, c, limit=1, precheck=precheck)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
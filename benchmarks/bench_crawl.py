@@ -0,0 +1,226 @@
+"""
+End-to-end `Crawler.crawl` against a synthetic books.toscrape catalogue.
+
+    python -m benchmarks.bench_crawl [--pages 50] [--latency 0.01]
+        [--error-rate 0.01] [--change-fraction 0.1] [--server asgi|http]
+        [--mongo-uri mongodb://localhost:27017]
+
+Crawls the site once from an empty database ("initial"), reprices
+--change-fraction of the books and crawls again ("recrawl"). Prints one
+JSON line per phase: throughput, p50/p99 fetch latency, peak RSS and
+database round trips per book. Without --mongo-uri it runs on mongomock.
+
+--server asgi serves the site in-process through httpx.ASGITransport;
+--server http puts it behind uvicorn on a local port and crawls it with
+the tuned shared client, connection pool and all.
+
+    python -m benchmarks.bench_crawl --workers 1,2,4 --mongo-uri mongodb://...
+
+measures multi-process scaling instead: for each worker count, a
+distributed run (crawler.distributed) crawls the catalogue from an empty
+database with that many worker processes, one JSON line per count with
+its throughput and speedup over the first. Worker processes need a real
+mongod and the site over http, so --workers implies --server http.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import threading
+import time
+from collections import Counter
+
+import httpx
+import mongomock_motor
+import uvicorn
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from crawler import crawler_manager, distributed
+from crawler.client import build_client
+from crawler.crawler_manager import Crawler
+from crawler.executor import MODES, ParseExecutor
+from db import mongo
+from tests import mongomock_compat  # noqa: F401
+from tests.catalogue import CatalogueSite
+
+DB_NAME = "bench_crawl"
+
+
+class CountingCollection:
+    """Collection proxy counting every method call, i.e. round trip."""
+
+    def __init__(self, collection, ops: Counter):
+        self._collection = collection
+        self._ops = ops
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._ops[f"{self._collection.name}.{name}"] += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+def use_database(db, ops: Counter):
+    """Point the crawler's collections at `db`, counting calls into `ops`."""
+    for module in (mongo, crawler_manager):
+        for name, value in list(vars(module).items()):
+            if name.endswith("_col"):
+                setattr(module, name, CountingCollection(db[value.name], ops))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_http(site: CatalogueSite) -> tuple[uvicorn.Server, str]:
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(site.asgi, host="127.0.0.1", port=port,
+                                           interface="asgi3", lifespan="off",
+                                           log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/catalogue"
+
+
+def peak_rss_mb() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def crawl_phase(phase: str, site: CatalogueSite, base_url: str, client,
+                      ops: Counter, args) -> dict:
+    ops.clear()
+    requests, errors = len(site.requests), site.errors
+    crawler = Crawler(base_url, concurrency=args.concurrency,
+                      executor=ParseExecutor(args.parse_mode))
+    try:
+        await crawler.crawl(f"{base_url}/page-1.html", client=client)
+    finally:
+        crawler.executor.close()
+    summary = crawler.run_stats.summary()
+    books = sum(n for k, n in summary["pages"].items() if k.startswith("book:"))
+    db_ops = sum(ops.values())
+    return {
+        "phase": phase,
+        "server": args.server,
+        "db": "mongod" if args.mongo_uri else "mongomock",
+        "listing_pages": site.pages,
+        "books": books,
+        "outcomes": summary["pages"],
+        "seconds": summary["duration"],
+        "books_per_sec": summary["books_per_sec"],
+        "fetch_p50": summary["fetch_p50"],
+        "fetch_p99": summary["fetch_p99"],
+        "parse_seconds": summary["parse_seconds"],
+        "db_seconds": summary["db_seconds"],
+        "requests": len(site.requests) - requests,
+        "injected_errors": site.errors - errors,
+        "db_ops": db_ops,
+        "db_ops_per_book": round(db_ops / books, 3) if books else None,
+        "db_ops_by_call": dict(ops.most_common()),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def distributed_phase(workers: int, site: CatalogueSite, base_url: str, client,
+                            db) -> dict:
+    for name in ("books", "changes", "category_stats", "price_history", "frontier"):
+        await db[name].delete_many({})
+    requests = len(site.requests)
+    start = time.perf_counter()
+    run_id = await distributed.coordinate(base_url, workers=workers, report_every=0.2,
+                                          client=client)
+    seconds = time.perf_counter() - start
+    run = await db["crawl_runs"].find_one({"_id": run_id})
+    books = await db["books"].count_documents({})
+    return {
+        "phase": "distributed",
+        "workers": workers,
+        "status": run["status"],
+        "listing_pages": site.pages,
+        "books": books,
+        "seconds": round(seconds, 3),
+        "books_per_sec": round(books / seconds, 1),
+        "requests": len(site.requests) - requests,
+        "done_by": run["progress"]["done_by"],
+    }
+
+
+async def bench_workers(counts: list[int], site: CatalogueSite, base_url: str, client,
+                        db, args):
+    # the worker processes read their settings from the environment
+    os.environ.update(MONGO_URI=args.mongo_uri, MONGO_DB=DB_NAME, BASE_URL=base_url)
+    if args.concurrency:
+        os.environ["CRAWL_CONCURRENCY"] = str(args.concurrency)
+    await mongo.ensure_indexes()
+    baseline = None
+    for workers in counts:
+        result = await distributed_phase(workers, site, base_url, client, db)
+        baseline = baseline or result["books_per_sec"]
+        result["speedup"] = round(result["books_per_sec"] / baseline, 2)
+        print(json.dumps(result))
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--pages", type=int, default=50, help="listing pages of 20 books")
+    ap.add_argument("--latency", type=float, default=0.01, help="seconds per response")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503s")
+    ap.add_argument("--change-fraction", type=float, default=0.1)
+    ap.add_argument("--concurrency", type=int, default=None)
+    ap.add_argument("--parse-mode", default="inline", choices=MODES)
+    ap.add_argument("--server", default="asgi", choices=("asgi", "http"))
+    ap.add_argument("--mongo-uri", default=None)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", default=None,
+                    help="comma-separated worker process counts: distributed scaling run")
+    args = ap.parse_args()
+    counts = [int(n) for n in args.workers.split(",")] if args.workers else None
+    if counts:
+        if not args.mongo_uri:
+            ap.error("--workers needs --mongo-uri: worker processes can't share mongomock")
+        args.server = "http"
+
+    site = CatalogueSite(pages=args.pages, per_page=20, latency=args.latency,
+                         error_rate=args.error_rate, seed=args.seed)
+    if args.mongo_uri:
+        mongo_client = AsyncIOMotorClient(args.mongo_uri)
+        await mongo_client.drop_database(DB_NAME)
+    else:
+        mongo_client = mongomock_motor.AsyncMongoMockClient()
+    ops: Counter = Counter()
+    use_database(mongo_client[DB_NAME], ops)
+
+    server = None
+    if args.server == "http":
+        server, base_url = serve_http(site)
+        client = build_client()
+    else:
+        base_url = "http://catalogue.local/catalogue"
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=site.asgi))
+    try:
+        async with client:
+            if counts:
+                await bench_workers(counts, site, base_url, client, mongo_client[DB_NAME], args)
+                return
+            print(json.dumps(await crawl_phase("initial", site, base_url, client, ops, args)))
+            changed = site.mutate(args.change_fraction)
+            result = await crawl_phase("recrawl", site, base_url, client, ops, args)
+            print(json.dumps({**result, "changed_books": changed}))
+    finally:
+        if server:
+            server.should_exit = True
+        if args.mongo_uri:
+            await mongo_client.drop_database(DB_NAME)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Pages/sec of parse + hash work for each ParseExecutor mode.
+
+    python -m benchmarks.bench_parse [--pages 2000] [--corpus tests/fixtures]
+
+The corpus is every saved book page (*.html containing a product_main
+block) under --corpus, cycled up to --pages documents.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+from crawler.executor import MODES, ParseExecutor, process_book
+
+BASE_URL = "https://books.toscrape.com/catalogue"
+
+
+def load_corpus(path: str, pages: int) -> list[str]:
+    saved = []
+    for name in sorted(glob.glob(os.path.join(path, "*.html"))):
+        with open(name, encoding="utf-8") as f:
+            html = f.read()
+        if "product_main" in html:
+            saved.append(html)
+    if not saved:
+        raise SystemExit(f"no saved book pages under {path}")
+    # a trailing comment keeps every document's hash distinct
+    return [f"{saved[i % len(saved)]}<!-- {i} -->" for i in range(pages)]
+
+
+async def bench_mode(mode: str, corpus: list[str], workers: int) -> dict:
+    executor = ParseExecutor(mode, workers=workers)
+    try:
+        # warm the pool so worker start-up isn't measured
+        await asyncio.gather(*(executor.run(process_book, corpus[0], BASE_URL)
+                               for _ in range(workers)))
+        limit = asyncio.Semaphore(workers * 4)
+
+        async def one(html):
+            async with limit:
+                await executor.run(process_book, html, BASE_URL)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(html) for html in corpus))
+        elapsed = time.perf_counter() - start
+    finally:
+        executor.close()
+    return {"mode": mode, "workers": workers, "pages": len(corpus),
+            "seconds": round(elapsed, 3), "pages_per_sec": round(len(corpus) / elapsed, 1)}
+
+
+async def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--pages", type=int, default=2000)
+    ap.add_argument("--corpus", default="tests/fixtures")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus, args.pages)
+    for mode in args.modes:
+        print(json.dumps(await bench_mode(mode, corpus, args.workers)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Books/sec and memory churn of `parse_book` alone, no hashing or executor.
+
+    python -m benchmarks.bench_parse_book [--rounds 2000] [--corpus tests/fixtures/golden]
+        [--fail-under 2000]
+
+The corpus is every book page under --corpus that parses (the golden
+pages recorded as errors are skipped). Prints one JSON line per page plus
+an "all" line: books/sec (best of --repeat), and the tracemalloc peak per
+parse, i.e. how much Python-level memory one page allocates at once.
+With --fail-under the run exits non-zero when the overall rate is below
+it, so a CI job can catch a parser regression.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+from crawler.parser import parse_book
+
+BASE_URL = "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html"
+
+
+def load_corpus(path: str) -> dict[str, str]:
+    pages = {}
+    for name in sorted(glob.glob(os.path.join(path, "*.html"))):
+        with open(name, encoding="utf-8") as f:
+            html = f.read()
+        try:
+            parse_book(html, BASE_URL)
+        except Exception:
+            continue
+        pages[os.path.basename(name)[:-len(".html")]] = html
+    if not pages:
+        raise SystemExit(f"no parseable book pages under {path}")
+    return pages
+
+
+def books_per_sec(htmls: list[str], rounds: int, repeat: int) -> float:
+    def run():
+        for html in htmls:
+            parse_book(html, BASE_URL)
+    best = min(timeit.repeat(run, number=max(1, rounds // len(htmls)), repeat=repeat))
+    return max(1, rounds // len(htmls)) * len(htmls) / best
+
+
+def peak_kib(html: str) -> float:
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        parse_book(html, BASE_URL)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round((peak - start) / 1024, 1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--corpus", default="tests/fixtures/golden")
+    ap.add_argument("--rounds", type=int, default=2000, help="parses per measurement")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--fail-under", type=float, default=None, help="minimum overall books/sec")
+    args = ap.parse_args()
+
+    pages = load_corpus(args.corpus)
+    for name, html in pages.items():
+        print(json.dumps({"page": name, "bytes": len(html.encode()),
+                          "books_per_sec": round(books_per_sec([html], args.rounds, args.repeat), 1),
+                          "alloc_peak_kib": peak_kib(html)}))
+    rate = books_per_sec(list(pages.values()), args.rounds, args.repeat)
+    peaks = [peak_kib(html) for html in pages.values()]
+    print(json.dumps({"page": "all", "pages": len(pages), "books_per_sec": round(rate, 1),
+                      "alloc_peak_kib": round(sum(peaks) / len(peaks), 1)}))
+    if args.fail_under is not None and rate < args.fail_under:
+        sys.exit(f"parse_book ran at {rate:.0f} books/sec, under --fail-under {args.fail_under:g}")
+
+
+if __name__ == "__main__":
+    main()
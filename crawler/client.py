@@ -1,21 +1,156 @@
 import asyncio
+import time
+from typing import Optional
 import httpx
+from crawler.ratelimit import HostLimiters, backoff_delay, parse_retry_after
+from utils import metrics
 from utils.config import appsettings
 from utils.logger import get_logger
 
 
 logger = get_logger("client")
 
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+except ImportError:
+    h2 = None
 
-async def fetch_html(url: str, client: httpx.AsyncClient,
-                     retries: int = None) -> str:
+_shared_client: Optional[httpx.AsyncClient] = None
+_shared_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def build_client(http2: Optional[bool] = None, **kwargs) -> httpx.AsyncClient:
+    """An AsyncClient with the crawler's pool limits and timeouts."""
+    http2 = appsettings.HTTP2_ENABLED if http2 is None else http2
+    if http2 and h2 is None:
+        logger.warning("HTTP2_ENABLED but the h2 package isn't installed; using HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(
+        max_connections=appsettings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=appsettings.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=appsettings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=appsettings.CRAWL_CONNECT_TIMEOUT,
+        read=appsettings.CRAWL_READ_TIMEOUT or appsettings.CRAWL_TIMEOUT,
+        write=appsettings.CRAWL_WRITE_TIMEOUT,
+        pool=appsettings.CRAWL_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2, **kwargs)
+
+
+def get_client() -> httpx.AsyncClient:
+    """The process-wide crawl client, so repeated crawls reuse warm connections.
+
+    A client is tied to the event loop it first ran on, so a new loop gets
+    a new one.
+    """
+    global _shared_client, _shared_loop
+    loop = asyncio.get_running_loop()
+    if _shared_client is None or _shared_client.is_closed or _shared_loop is not loop:
+        _shared_client = build_client()
+        _shared_loop = loop
+    return _shared_client
+
+
+async def close_client():
+    global _shared_client, _shared_loop
+    if _shared_client is not None:
+        await _shared_client.aclose()
+    _shared_client = _shared_loop = None
+
+
+def pool_stats(client: Optional[httpx.AsyncClient] = None) -> dict:
+    """Connection pool occupancy of `client` (default: the shared one)."""
+    client = client or _shared_client
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return {"connections": 0, "active": 0, "idle": 0, "http2": 0, "queued": 0}
+    connections = list(pool.connections)
+    idle = sum(1 for c in connections if c.is_idle())
+    return {
+        "connections": len(connections),
+        "active": len(connections) - idle,
+        "idle": idle,
+        "http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+        "queued": len(getattr(pool, "_requests", ())),
+    }
+
+
+# statuses that mean "slow down" rather than "this url is broken"
+THROTTLE_STATUSES = (429, 503)
+
+# shared so what is learnt about a host carries over between crawls
+host_limiters = HostLimiters()
+
+
+async def fetch(url: str, client: httpx.AsyncClient, headers: dict = None,
+                retries: int = None, limiters: HostLimiters = None) -> httpx.Response:
+    """GET `url` with retries. A `304 Not Modified` is returned as-is.
+
+    Requests go through the per-host adaptive limiter; 429/503 responses
+    and network errors shrink it and are retried after `Retry-After` or a
+    jittered exponential backoff. Other 4xx responses are not retried.
+    """
     retries = retries or appsettings.CRAWL_RETRY
+    host = (limiters or host_limiters).get(url)
     for attempt in range(1, retries + 1):
+        await host.acquire()
+        start = time.monotonic()
+        # None: no verdict on the host, e.g. the fetch was cancelled
+        healthy = None
         try:
-            response = await client.get(url, timeout=appsettings.CRAWL_TIMEOUT)
-            response.raise_for_status()
-            return response.text
+            response = await client.get(url, headers=headers)
         except Exception as th:
+            healthy = False
+            metrics.FETCH_SECONDS.observe(time.monotonic() - start, status="error")
+            reason = "error"
             logger.warning(f"fetch_html failed {url} attempt {attempt}: {th}")
-            await asyncio.sleep(1 * attempt)
-    raise RuntimeError(f"Failed to getch {url} after {retries} attempts")
+            delay = backoff_delay(attempt)
+        else:
+            latency = time.monotonic() - start
+            metrics.FETCH_SECONDS.observe(latency, status=response.status_code)
+            if response.status_code in THROTTLE_STATUSES:
+                healthy = False
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                if retry_after is not None:
+                    await host.pause(retry_after)
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                reason = "throttled"
+                logger.warning(f"fetch_html throttled {url} attempt {attempt}: "
+                               f"{response.status_code}, retrying in {delay:.1f}s")
+            else:
+                healthy = response.status_code < 500
+                if response.status_code == 304:
+                    return response
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    return response
+                logger.warning(f"fetch_html failed {url} attempt {attempt}: "
+                               f"{response.status_code}")
+                delay = backoff_delay(attempt)
+                reason = "server_error"
+        finally:
+            # the slot goes back even when the fetch is cancelled
+            await host.release(time.monotonic() - start, ok=healthy)
+        if attempt < retries:
+            metrics.FETCH_RETRIES.inc(reason=reason)
+            await asyncio.sleep(delay)
+    metrics.FETCH_FAILURES.inc()
+    raise RuntimeError(f"Failed to fetch {url} after {retries} attempts")
+
+
+async def fetch_html(url: str, client: httpx.AsyncClient,
+                     retries: int = None) -> str:
+    response = await fetch(url, client, retries=retries)
+    return response.text
+
+
+def conditional_headers(etag: str = None, last_modified: str = None) -> dict:
+    """Revalidation headers for a previously seen page."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
@@ -1,94 +1,375 @@
 import asyncio
+import time
 import httpx
-from typing import Set
+from contextlib import asynccontextmanager
+from typing import Optional
 from utils.config import appsettings
-from crawler.client import fetch_html
-from crawler.parser import parse_page, parse_book
-from db.mongo import books_col, changes_col
-from utils.hashing import sha256_text
+from crawler.client import fetch, fetch_html, conditional_headers, get_client
+from crawler.parser import parse_listing
+from crawler.executor import ParseExecutor, process_book
+from db.mongo import books_col, changes_col, snapshots_col, listings_col, stats_col, history_col
+from db.history import PriceHistory
+from db import stats
+from db.stats import STATS_FIELDS, CategoryStats
+from db.snapshots import SnapshotStore, get_snapshot_store
+from crawler.writer import BookWriter
+from crawler.frontier import BOOK, DONE, FAILED, LISTING, CrawlFrontier
+from crawler.hash_index import HashIndex
+from crawler.incremental import ListingFingerprints
+from crawler.runs import RunStats
 from datetime import datetime, timezone
+from utils import metrics
 from utils.logger import get_logger
 
 logger = get_logger("crawl_manager")
 
+# put on the book queue to tell a worker to exit
+_STOP = object()
+
+# fields whose change gets recorded in changes_col
+IMPORTANT_KEYS = [
+    "price_incl_vat",
+    "price_excl_vat",
+    "availability",
+    "num_reviews",
+    "name"
+]
+
+# what diffing and the category summary need from the stored version
+# of a changed book
+EXISTING_PROJECTION = {k: 1 for k in (*IMPORTANT_KEYS, *STATS_FIELDS)}
+
 
 class Crawler:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, concurrency: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 snapshots: Optional[SnapshotStore] = None,
+                 executor: Optional[ParseExecutor] = None,
+                 incremental: bool = False):
         self.base_url = base_url
-        self.semaphore = asyncio.Semaphore(appsettings.CRAWL_CONCURRENCY)
-        self.visited: Set[str] = set()
+        # only fetch books from listing pages that changed since the last crawl
+        self.incremental = incremental
+        self.executor = executor
+        self.snapshots = snapshots or get_snapshot_store(snapshots_col)
+        self.concurrency = concurrency or appsettings.CRAWL_CONCURRENCY
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.frontier = CrawlFrontier()
+        # bounded so the listing producer can't run away from the book workers
+        self.queue: asyncio.Queue = asyncio.Queue(
+            maxsize=queue_size or appsettings.CRAWL_QUEUE_SIZE)
+        self._stopping = asyncio.Event()
+        # books a worker has taken off the queue and not finished yet
+        self._in_progress = 0
+        self._worker_free = asyncio.Event()
+        self.writer: Optional[BookWriter] = None
+        self.index = HashIndex()
+        self.fingerprints = ListingFingerprints(listings_col)
+        self._listing_links: dict[str, list[str]] = {}
+        self.run_stats = RunStats()
+
+    def _count(self, kind: str, outcome: str):
+        metrics.PAGES.inc(kind=kind, outcome=outcome)
+        self.run_stats.pages[f"{kind}:{outcome}"] += 1
+
+    @asynccontextmanager
+    async def _slot(self):
+        """A crawl concurrency slot; the time spent holding it is the fetch time."""
+        metrics.SEMAPHORE_WAITING.inc()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            metrics.SEMAPHORE_WAITING.dec()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+            self.run_stats.fetch_latencies.append(time.perf_counter() - start)
+
+    async def _parse(self, kind: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return await self.executor.run(fn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.PARSE_SECONDS.observe(elapsed, kind=kind)
+            self.run_stats.parse_seconds += elapsed
 
     async def _fetch_parse_book(self, client: httpx.AsyncClient, url: str):
-        async with self.semaphore:
-            markup_text = await fetch_html(url, client)
-        parsed = parse_book(markup_text, self.base_url)
-        content_hash = sha256_text(markup_text)
+        entry = self.index.get(url)
+        headers = conditional_headers(*self.index.validators(url)) if entry else None
+        async with self._slot():
+            response = await fetch(url, client, headers=headers)
+        if response.status_code == 304:
+            # origin says nothing changed: no parse, no hash, no rewrite
+            await self.writer.touch(entry.book_id)
+            self._count(BOOK, "not_modified")
+            return
+        markup_text = response.text
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        result = await self._parse(BOOK, process_book, markup_text, self.base_url,
+                                   entry.digest if entry else None)
+        digest, parsed = result["digest"], result["parsed"]
+        if parsed is None:
+            # same bytes as last time: skip parsing, diffing and the rewrite
+            if (etag, last_modified) == self.index.validators(url):
+                await self.writer.touch(entry.book_id)
+            else:
+                await self.writer.update(entry.book_id, {
+                    "last_seen": datetime.now(timezone.utc),
+                    "etag": etag,
+                    "last_modified": last_modified,
+                })
+            self._count(BOOK, "unchanged")
+            return
         now = datetime.now(timezone.utc)
-        # check if existing
-        existing = await books_col.find_one({"source_url": url})
         doc = {
             **parsed,
             "source_url": url,
             "crawl_timestamp": now,
-            "content_hash": content_hash,
-            "raw_html": markup_text,
+            "last_seen": now,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": digest.hex(),
             "status": "ok"
         }
-        if not existing:
-            response = await books_col.insert_one(doc)
-            await changes_col.insert_one({
-                "book_id": response.inserted_id,
+        if self.snapshots:
+            # the page itself lives in the snapshot store, keyed by content_hash
+            self.writer.snapshot(doc["content_hash"], markup_text)
+        else:
+            doc["raw_html"] = markup_text
+        if not entry:
+            await self.writer.insert(doc, {
                 "source_url": url,
+                "category": parsed.get("category"),
                 "change_type": "new",
                 "when": now,
                 "details": {"name": parsed['name']}
             })
             logger.info(f"inserted new book: {parsed['name']}")
-        else:
-            if existing.get("content_hash") != content_hash:
-                # check diff
-                diffs = {}
-                important_keys = [
-                    "price_incl_vat",
-                    "price_excl_vat",
-                    "availability",
-                    "nuw_reviews",
-                    "name"
-                ]
-                for key in important_keys:
-                    if existing.get(key) != parsed.get(key):
-                        diffs[key] = {"old": existing.get(key),
-                                      "new": parsed.get(key)}
-                        await books_col.update_one({"_id": existing['_id']}, {'$set': doc})
-                        await changes_col.insert_one({
-                            "book_id": existing["_id"],
-                            "source_url": url,
-                            "change_type": "updated",
-                            "when": now,
-                            "details": diffs
-                        })
-                        logger.info(f"Updated book {parsed["name"]} diffs={diffs}")
-    
-    async def crawl(self, start_url: str):
-        async with httpx.AsyncClient() as client:
-            to_visit = [start_url]
-            while to_visit:
-                url = to_visit.pop(0)
-                if url in self.visited: 
-                    continue
-                self.visited.add(url)
-                try:
+            self.run_stats.changes += 1
+            self._count(BOOK, "new")
+            return
+        # changed page: only now is the stored version worth a round trip
+        start = time.perf_counter()
+        existing = await books_col.find_one({"_id": entry.book_id}, EXISTING_PROJECTION) or {}
+        elapsed = time.perf_counter() - start
+        metrics.DB_SECONDS.observe(elapsed, op="find_one")
+        self.run_stats.db_seconds += elapsed
+        diffs = {}
+        for key in IMPORTANT_KEYS:
+            if existing.get(key) != parsed.get(key):
+                diffs[key] = {"old": existing.get(key),
+                              "new": parsed.get(key)}
+        change = None
+        if diffs:
+            change = {
+                "source_url": url,
+                "category": parsed.get("category"),
+                "change_type": "updated",
+                "when": now,
+                "details": diffs
+            }
+            logger.info(f"Updated book {parsed['name']} diffs={diffs}")
+            self.run_stats.changes += 1
+        await self.writer.update(entry.book_id, doc, change, old=existing)
+        self._count(BOOK, "updated")
+
+    async def _produce_listings(self, client: httpx.AsyncClient):
+        """Walk the listing pages and feed book urls into the work queue.
+
+        Runs ahead of the book workers; `queue.put` blocks once the queue is
+        full, which is what keeps memory bounded on big catalogues.
+        """
+        listings = self.frontier.listings
+        while listings and not self._stopping.is_set():
+            url = listings.popleft()
+            try:
+                async with self._slot():
                     html = await fetch_html(url, client)
-                except Exception as e:
-                    logger.warning("Failed to fetch listing %s: %s", url, e)
-                    continue
-                links, next_url = parse_page(html, self.base_url)
-                # normalize book urls (some are relative)
-                tasks = []
-                for link in links:
-                    if link not in self.visited:
-                        tasks.append(self._fetch_parse_book(client, link))
-                # run tasks concurrently
-                await asyncio.gather(*tasks)
-                if next_url:
-                    to_visit.append(next_url)
\ No newline at end of file
+            except Exception as e:
+                logger.warning("Failed to fetch listing %s: %s", url, e)
+                await self.frontier.mark([url], FAILED)
+                self._count(LISTING, "failed")
+                continue
+            self._count(LISTING, "ok")
+            entries, next_url = await self._parse(LISTING, parse_listing, html, self.base_url)
+            if self.incremental:
+                links = self.fingerprints.changed_links(url, entries)
+            else:
+                links = [link for link, _ in entries]
+                self.fingerprints.record(url, entries)
+            self._listing_links[url] = links
+            books = await self.frontier.add(links, BOOK)
+            if next_url:
+                await self.frontier.add([next_url], LISTING)
+            await self.frontier.mark([url], DONE)
+            for link in books:
+                if self._stopping.is_set():
+                    break
+                await self.queue.put(link)
+                metrics.QUEUE_DEPTH.set(self.queue.qsize())
+
+    async def _book_worker(self, client: httpx.AsyncClient):
+        while True:
+            url = await self.queue.get()
+            metrics.QUEUE_DEPTH.set(self.queue.qsize())
+            self._in_progress += 1
+            try:
+                if url is _STOP:
+                    return
+                if self._stopping.is_set():
+                    continue  # draining: drop queued work
+                await self._fetch_parse_book(client, url)
+                self.writer.ack(url)
+            except Exception as e:
+                logger.warning("Failed to process book %s: %s", url, e)
+                await self.frontier.mark([url], FAILED)
+                self._count(BOOK, "failed")
+            finally:
+                self._in_progress -= 1
+                self._worker_free.set()
+                self.queue.task_done()
+
+    async def stop(self):
+        """Stop discovering new work and drop whatever is still queued.
+
+        In-flight books are allowed to finish; `crawl` returns once the
+        workers have exited.
+        """
+        self._stopping.set()
+
+    async def crawl(self, start_url: str, client: Optional[httpx.AsyncClient] = None,
+                    frontier: Optional[CrawlFrontier] = None):
+        """Crawl from `start_url`, or pick up where `frontier`'s run stopped."""
+        self.frontier = frontier or CrawlFrontier()
+        books = await self.frontier.load()
+        if not self.frontier.states:
+            await self.frontier.add([start_url], LISTING)
+        # the shared client outlives the crawl so the next one reuses its pool
+        return await self._run(client or get_client(), books)
+
+    @asynccontextmanager
+    async def _session(self):
+        """Per-crawl state: hash index, fingerprints, executor and run stats."""
+        self.run_stats = RunStats()
+        # deltas on an empty summary would drop every book stored before it
+        await stats.seed(books_col, stats_col)
+        self.index = await HashIndex.load(books_col)
+        logger.info("loaded hash index for %d books", len(self.index))
+        self.fingerprints = ListingFingerprints(listings_col)
+        self._listing_links = {}
+        if self.incremental:
+            await self.fingerprints.load()
+        owns_executor = self.executor is None
+        if owns_executor:
+            self.executor = ParseExecutor()
+        try:
+            yield
+        finally:
+            if owns_executor:
+                self.executor.close()
+                self.executor = None
+
+    @asynccontextmanager
+    async def _book_workers(self, client: httpx.AsyncClient):
+        """A BookWriter plus `concurrency` workers draining the queue.
+
+        On exit the workers are told to stop and the writer is flushed.
+        """
+        async def commit(urls):
+            await self.frontier.mark(urls, DONE)
+
+        async with BookWriter(books_col, changes_col, snapshots=self.snapshots,
+                              stats=CategoryStats(stats_col),
+                              history=PriceHistory(history_col),
+                              on_commit=commit) as self.writer:
+            workers = [asyncio.create_task(self._book_worker(client))
+                       for _ in range(self.concurrency)]
+            try:
+                yield
+                for _ in workers:
+                    await self.queue.put(_STOP)
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()
+        self.run_stats.db_seconds += self.writer.db_seconds
+
+    async def _run(self, client: httpx.AsyncClient, books: list[str]):
+        async with self._session():
+            await self._run_workers(client, books)
+
+    async def crawl_leased(self, frontier, client: Optional[httpx.AsyncClient] = None,
+                           poll: Optional[float] = None):
+        """Work a distributed run: lease books from a shared `LeasedFrontier`
+        and process them until the run has nothing left to hand out.
+
+        Listing pages are walked by the coordinator, not here. Only as many
+        urls are leased as there are idle workers, so none sits in the queue
+        while its lease runs out, and the leases held are renewed until
+        their books are committed.
+        """
+        self.frontier = frontier
+        client = client or get_client()
+        poll = poll or appsettings.CRAWL_LEASE_POLL
+        heartbeat = asyncio.create_task(self._renew_leases(frontier))
+        try:
+            async with self._session(), self._book_workers(client):
+                await self._lease_books(frontier, poll)
+        finally:
+            heartbeat.cancel()
+
+    async def _renew_leases(self, frontier):
+        while True:
+            await asyncio.sleep(frontier.lease_seconds / 3)
+            try:
+                await frontier.renew()
+            except Exception as e:
+                logger.warning("could not renew leases of %s: %s", frontier.owner, e)
+
+    async def _lease_books(self, frontier, poll: float):
+        while not self._stopping.is_set():
+            free = self.concurrency - self.queue.qsize() - self._in_progress
+            if free <= 0:
+                self._worker_free.clear()
+                await self._worker_free.wait()
+                continue
+            urls = await frontier.lease(BOOK, min(free, appsettings.CRAWL_LEASE_BATCH))
+            for url in urls:
+                await self.queue.put(url)
+            if urls:
+                continue
+            # idle: let our own leases commit before asking if the run is over
+            await self.queue.join()
+            await self.writer.flush()
+            if await frontier.exhausted():
+                break
+            await asyncio.sleep(poll)
+
+    async def _run_workers(self, client: httpx.AsyncClient, books: list[str]):
+        async with self._book_workers(client):
+            for attempt in range(appsettings.CRAWL_RETRY_PASSES + 1):
+                if attempt:
+                    # a later pass over whatever failed the first time
+                    books = await self.frontier.requeue_failed()
+                    if not books and not self.frontier.listings:
+                        break
+                    logger.info("retry pass %d: %d listing pages, %d books",
+                                attempt, len(self.frontier.listings), len(books))
+                for url in books:
+                    if self._stopping.is_set():
+                        break
+                    await self.queue.put(url)
+                await self._produce_listings(client)
+                # drain: wait for every queued book
+                await self.queue.join()
+                if self._stopping.is_set():
+                    break
+        # a listing's fingerprint only moves once all of its books made it,
+        # otherwise the next incremental crawl would skip what failed
+        states = self.frontier.states
+        incomplete = {url for url, links in self._listing_links.items()
+                      if any(states.get(link) != DONE for link in links)}
+        await self.fingerprints.save(skip=incomplete)
@@ -0,0 +1,246 @@
+"""
+Distributed crawling: one coordinator, any number of worker processes.
+
+The run's frontier collection doubles as the work queue. The coordinator
+walks the listing pages (they chain through "next" links, so that part is
+sequential anyway) and publishes every book url as a pending frontier
+entry. Workers, on this machine or others pointed at the same Mongo,
+lease batches of pending books, crawl them with the usual Crawler
+pipeline and mark them done once their writes are committed. A lease that
+isn't completed within CRAWL_LEASE_SECONDS (a worker died) is handed out
+again. Workers only lease as many urls as they have idle book workers and
+renew their leases every third of CRAWL_LEASE_SECONDS, so a live worker
+keeps its urls. A url processed twice anyway still ends up as one book,
+counted once: book writes upsert on `source_url`, and the BookWriter only
+treats a book as new when its upsert created it.
+
+    python -m crawler.distributed coordinator [--workers 4]
+    python -m crawler.distributed worker --run-id <id>
+    python -m crawler.distributed progress --run-id <id>
+
+Per-host rate limits are per process: N workers may hit one origin with
+up to N times CRAWL_CONCURRENCY.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson import ObjectId
+from crawler import runs
+from crawler.client import fetch_html, get_client
+from crawler.crawler_manager import Crawler
+from crawler.frontier import BOOK, DONE, FAILED, LISTING, PENDING, CrawlFrontier
+from crawler.parser import parse_listing
+from db import mongo
+from db.mongo import ensure_indexes
+from utils.config import appsettings
+from utils.logger import get_logger
+
+logger = get_logger("distributed")
+
+
+def _leasable(kind: str, now: datetime) -> dict:
+    return {"$and": [
+        {"kind": kind},
+        {"$or": [{"state": PENDING},
+                 # failed urls get CRAWL_RETRY_PASSES more goes
+                 {"state": FAILED, "attempts": {"$lte": appsettings.CRAWL_RETRY_PASSES}}]},
+        {"$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+    ]}
+
+
+class LeasedFrontier(CrawlFrontier):
+    """A run's frontier shared between processes through leases.
+
+    `lease` claims up to `limit` urls for `owner` until `lease_seconds`
+    from now; marking a url done or failed drops the lease.
+    """
+
+    def __init__(self, run_id: str, collection, owner: Optional[str] = None,
+                 lease_seconds: Optional[float] = None):
+        super().__init__(run_id, collection)
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = lease_seconds or appsettings.CRAWL_LEASE_SECONDS
+
+    async def lease(self, kind: str, limit: int) -> list[str]:
+        now = datetime.now(timezone.utc)
+        query = {"run_id": self.run_id, **_leasable(kind, now)}
+        candidates = [d["_id"] async for d in
+                      self.collection.find(query, {"_id": 1}).limit(limit)]
+        if not candidates:
+            return []
+        # another worker may win some of these between the find and here;
+        # the token tells us which ones we actually got
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"_id": {"$in": candidates}, **query},
+            {"$set": {"lease_owner": self.owner, "lease_token": token,
+                      "lease_until": now + timedelta(seconds=self.lease_seconds)}})
+        urls = [d["url"] async for d in
+                self.collection.find({"run_id": self.run_id, "lease_token": token}, {"url": 1})]
+        for url in urls:
+            self.states[url], self.kinds[url] = PENDING, kind
+        return urls
+
+    async def renew(self) -> int:
+        """Extend this owner's leases that are still ours; returns how many."""
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_many(
+            {"run_id": self.run_id, "lease_owner": self.owner, "lease_until": {"$ne": None}},
+            {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds)}})
+        return result.modified_count
+
+    def _state_update(self, state: str) -> dict:
+        update = super()._state_update(state)
+        update["$set"].update(lease_owner=None, lease_token=None, lease_until=None)
+        if state == DONE:
+            update["$set"]["done_by"] = self.owner
+        return update
+
+    async def exhausted(self) -> bool:
+        """Nothing left to walk or hand out, leased-but-unfinished included."""
+        open_work = {"run_id": self.run_id, "$or": [
+            {"state": PENDING},
+            {"kind": BOOK, "state": FAILED,
+             "attempts": {"$lte": appsettings.CRAWL_RETRY_PASSES}},
+        ]}
+        return await self.collection.count_documents(open_work, limit=1) == 0
+
+
+async def progress(run_id: str, collection) -> dict:
+    """Merged view of a run across every worker: url states per kind,
+    books done per worker and urls currently leased per worker."""
+    now = datetime.now(timezone.utc)
+    states = {LISTING: {}, BOOK: {}}
+    async for g in collection.aggregate([
+            {"$match": {"run_id": run_id}},
+            {"$group": {"_id": {"kind": "$kind", "state": "$state"}, "n": {"$sum": 1}}}]):
+        states.setdefault(g["_id"]["kind"], {})[g["_id"]["state"]] = g["n"]
+    done_by = {g["_id"]: g["n"] async for g in collection.aggregate([
+        {"$match": {"run_id": run_id, "kind": BOOK, "state": DONE}},
+        {"$group": {"_id": "$done_by", "n": {"$sum": 1}}}])}
+    leased = {g["_id"]: g["n"] async for g in collection.aggregate([
+        {"$match": {"run_id": run_id, "lease_until": {"$gt": now}}},
+        {"$group": {"_id": "$lease_owner", "n": {"$sum": 1}}}])}
+    total = sum(states[BOOK].values())
+    return {"run_id": run_id, "listings": states[LISTING], "books": states[BOOK],
+            "books_done_pct": round(100 * states[BOOK].get(DONE, 0) / total, 1) if total else 0.0,
+            "done_by": done_by, "leased": leased}
+
+
+async def publish_listings(frontier: CrawlFrontier, base_url: str, client) -> int:
+    """Walk the listing pages, publishing their books; returns how many."""
+    published = 0
+    for attempt in range(appsettings.CRAWL_RETRY_PASSES + 1):
+        if attempt:
+            await frontier.requeue_failed()
+        while frontier.listings:
+            url = frontier.listings.popleft()
+            try:
+                html = await fetch_html(url, client)
+            except Exception as e:
+                logger.warning("Failed to fetch listing %s: %s", url, e)
+                await frontier.mark([url], FAILED)
+                continue
+            entries, next_url = parse_listing(html, base_url)
+            published += len(await frontier.add([link for link, _ in entries], BOOK))
+            if next_url:
+                await frontier.add([next_url], LISTING)
+            await frontier.mark([url], DONE)
+        if not any(s == FAILED for s in frontier.states.values()):
+            break
+    return published
+
+
+def spawn_workers(run_id: str, count: int) -> list[subprocess.Popen]:
+    cmd = [sys.executable, "-m", "crawler.distributed", "worker", "--run-id", run_id]
+    return [subprocess.Popen(cmd) for _ in range(count)]
+
+
+async def coordinate(base_url: str, workers: int = 0, report_every: float = 5.0,
+                     client=None) -> ObjectId:
+    """Start a distributed run, publish its urls and wait for it to drain.
+
+    `workers` local worker processes are started; more can join from
+    anywhere with `worker --run-id`. The merged progress is stored on the
+    run document every `report_every` seconds. The run fails if every local
+    worker exits while work is left.
+    """
+    start_url = f"{base_url}/page-1.html"
+    run_id = await runs.start_run(start_url, mode=runs.FULL, distributed=True)
+    frontier = LeasedFrontier(str(run_id), mongo.frontier_col)
+    await frontier.add([start_url], LISTING)
+    procs = spawn_workers(str(run_id), workers)
+    logger.info("distributed run %s: %d local workers", run_id, workers)
+    status, error = runs.FAILED, None
+    try:
+        published = await publish_listings(frontier, base_url, client or get_client())
+        logger.info("published %d books", published)
+        while not await frontier.exhausted():
+            if procs and all(proc.poll() is not None for proc in procs):
+                error = f"all {len(procs)} local workers exited with work left"
+                logger.error("distributed run %s: %s", run_id, error)
+                break
+            view = await progress(str(run_id), mongo.frontier_col)
+            await mongo.crawl_runs_col.update_one({"_id": run_id}, {"$set": {"progress": view}})
+            logger.info("progress: %s", view)
+            await asyncio.sleep(report_every)
+        else:
+            status = runs.FINISHED
+    finally:
+        for proc in procs:
+            if status != runs.FINISHED:
+                proc.terminate()
+            await asyncio.to_thread(proc.wait)
+        view = await progress(str(run_id), mongo.frontier_col)
+        summary = {"progress": view}
+        if error:
+            summary["error"] = error
+        await runs.finish_run(run_id, status, **summary)
+        if status == runs.FINISHED:
+            await frontier.discard()
+    return run_id
+
+
+async def work(run_id: str, base_url: str, client=None) -> dict:
+    """Lease and crawl books of `run_id` until it runs dry; returns run stats."""
+    frontier = LeasedFrontier(run_id, mongo.frontier_col)
+    crawler = Crawler(base_url)
+    await crawler.crawl_leased(frontier, client=client or get_client())
+    summary = crawler.run_stats.summary()
+    key = frontier.owner.replace(".", "_")
+    await mongo.crawl_runs_col.update_one({"_id": ObjectId(run_id)},
+                                          {"$set": {f"workers.{key}": summary}})
+    logger.info("worker %s finished: %s", frontier.owner, summary)
+    return summary
+
+
+async def main():
+    ap = argparse.ArgumentParser(description="Distributed crawl coordinator and workers.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    coord = sub.add_parser("coordinator", help="start a run and publish its urls")
+    coord.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                       help="local worker processes to start")
+    for name in ("worker", "progress"):
+        p = sub.add_parser(name)
+        p.add_argument("--run-id", required=True)
+    args = ap.parse_args()
+
+    if args.command == "coordinator":
+        await ensure_indexes()
+        run_id = await coordinate(appsettings.BASE_URL, workers=args.workers)
+        print(json.dumps(await progress(str(run_id), mongo.frontier_col)))
+    elif args.command == "worker":
+        print(json.dumps(await work(args.run_id, appsettings.BASE_URL)))
+    else:
+        print(json.dumps(await progress(args.run_id, mongo.frontier_col)))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from utils.config import appsettings
+from crawler.parser import parse_book
+from utils.hashing import sha256_digest
+
+MODES = ("inline", "thread", "process")
+
+
+def process_book(html: str, base_url: str, known_digest: Optional[bytes] = None) -> dict:
+    """Hash a book page and parse it unless the hash is `known_digest`.
+
+    Module-level and dict-in/dict-out so it can be shipped to a process pool.
+    `parsed` is None when the page hasn't changed.
+    """
+    digest = sha256_digest(html)
+    if digest == known_digest:
+        return {"digest": digest, "parsed": None}
+    return {"digest": digest, "parsed": parse_book(html, base_url)}
+
+
+class ParseExecutor:
+    """Where CPU-bound parse + hash work runs.
+
+    "inline" runs it on the event loop (cheapest for small crawls),
+    "thread" in a thread pool, "process" in a process pool so parsing
+    neither holds the GIL nor stalls API routes sharing the loop.
+    """
+
+    def __init__(self, mode: Optional[str] = None, workers: Optional[int] = None):
+        self.mode = mode or appsettings.PARSE_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"unknown parse mode {self.mode!r}, expected one of {MODES}")
+        self.workers = workers or appsettings.PARSE_WORKERS or os.cpu_count() or 1
+        self._pool: Optional[Executor] = None
+        if self.mode == "thread":
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="parse")
+        elif self.mode == "process":
+            self._pool = ProcessPoolExecutor(self.workers)
+
+    async def run(self, fn, *args):
+        if self._pool is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
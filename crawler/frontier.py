@@ -0,0 +1,107 @@
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+from pymongo import UpdateOne
+from utils.logger import get_logger
+
+logger = get_logger("frontier")
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+LISTING, BOOK = "listing", "book"
+
+
+class CrawlFrontier:
+    """Listing/book urls of one crawl run and where each of them stands.
+
+    In memory it's a `deque` of listing pages still to walk plus a
+    `url -> state` map. With a `collection` every state change is also
+    checkpointed there under `run_id`, so an interrupted run can be picked
+    up with `load()` instead of starting over from page 1.
+    """
+
+    def __init__(self, run_id: Optional[str] = None, collection=None):
+        self.run_id = run_id
+        self.collection = collection
+        self.listings: deque[str] = deque()
+        self.states: dict[str, str] = {}
+        self.kinds: dict[str, str] = {}
+
+    @property
+    def persistent(self) -> bool:
+        return self.collection is not None
+
+    async def load(self) -> list[str]:
+        """Restore a checkpointed run; returns the book urls still pending."""
+        books = []
+        if not self.persistent:
+            return books
+        cursor = self.collection.find({"run_id": self.run_id},
+                                      {"url": 1, "kind": 1, "state": 1})
+        async for d in cursor:
+            url, kind, state = d["url"], d["kind"], d["state"]
+            self.states[url], self.kinds[url] = state, kind
+            if state != DONE:
+                # failed urls get another go on resume
+                (self.listings.append if kind == LISTING else books.append)(url)
+        logger.info("resuming run %s: %d listing pages and %d books left",
+                    self.run_id, len(self.listings), len(books))
+        return books
+
+    def seen(self, url: str) -> bool:
+        return url in self.states
+
+    async def add(self, urls: Iterable[str], kind: str) -> list[str]:
+        """Record newly discovered urls as pending; returns the new ones."""
+        new = [u for u in dict.fromkeys(urls) if u not in self.states]
+        for url in new:
+            self.states[url], self.kinds[url] = PENDING, kind
+            if kind == LISTING:
+                self.listings.append(url)
+        if new and self.persistent:
+            now = datetime.now(timezone.utc)
+            await self.collection.bulk_write([
+                UpdateOne({"run_id": self.run_id, "url": url},
+                          {"$setOnInsert": {"kind": kind, "state": PENDING,
+                                            "attempts": 0, "updated": now}},
+                          upsert=True)
+                for url in new], ordered=False)
+        return new
+
+    async def mark(self, urls: Iterable[str], state: str):
+        urls = list(urls)
+        for url in urls:
+            self.states[url] = state
+        if urls and self.persistent:
+            await self.collection.update_many(
+                {"run_id": self.run_id, "url": {"$in": urls}}, self._state_update(state))
+
+    def _state_update(self, state: str) -> dict:
+        update = {"$set": {"state": state, "updated": datetime.now(timezone.utc)}}
+        if state == FAILED:
+            update["$inc"] = {"attempts": 1}
+        return update
+
+    async def requeue_failed(self) -> list[str]:
+        """Flip failed urls back to pending for another pass; returns the books."""
+        failed = [u for u, s in self.states.items() if s == FAILED]
+        await self.mark(failed, PENDING)
+        books = []
+        for url in failed:
+            if self.kinds.get(url) == LISTING:
+                self.listings.append(url)
+            else:
+                books.append(url)
+        return books
+
+    async def discard(self):
+        """Drop the run's checkpoint once nothing will resume it."""
+        if self.persistent:
+            result = await self.collection.delete_many({"run_id": self.run_id})
+            logger.info("dropped %d frontier entries of run %s",
+                        result.deleted_count, self.run_id)
+
+    def counts(self) -> dict:
+        out = {PENDING: 0, DONE: 0, FAILED: 0}
+        for state in self.states.values():
+            out[state] += 1
+        return out
@@ -0,0 +1,59 @@
+import sys
+from typing import NamedTuple, Optional
+from bson import ObjectId
+
+
+class IndexEntry(NamedTuple):
+    digest: bytes  # raw sha256 of the last stored page
+    book_id: ObjectId
+
+
+class HashIndex:
+    """In-memory `source_url -> content hash` map, loaded once per crawl.
+
+    Lets a worker decide that a fetched page is unchanged before parsing it
+    and without a Mongo round trip. Keys are interned and digests kept as
+    32 raw bytes rather than 64-char hex strings, so a 1M-book catalogue
+    costs on the order of 200MB rather than twice that. Validators are only
+    stored for books that have them, and the (usually repeating)
+    Last-Modified values are interned too.
+    """
+
+    PROJECTION = {"source_url": 1, "content_hash": 1, "etag": 1, "last_modified": 1}
+
+    def __init__(self):
+        self._entries: dict[str, IndexEntry] = {}
+        self._validators: dict[str, tuple[Optional[str], Optional[str]]] = {}
+
+    @classmethod
+    async def load(cls, books_col, batch_size: int = 5000) -> "HashIndex":
+        index = cls()
+        cursor = books_col.find({}, cls.PROJECTION).batch_size(batch_size)
+        async for d in cursor:
+            index.add(d["source_url"], d.get("content_hash"), d["_id"],
+                      d.get("etag"), d.get("last_modified"))
+        return index
+
+    def add(self, url: str, content_hash: Optional[str], book_id: ObjectId,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        url = sys.intern(url)
+        digest = bytes.fromhex(content_hash) if content_hash else b""
+        self._entries[url] = IndexEntry(digest, book_id)
+        if etag or last_modified:
+            if last_modified:
+                last_modified = sys.intern(last_modified)
+            self._validators[url] = (etag, last_modified)
+        else:
+            self._validators.pop(url, None)
+
+    def get(self, url: str) -> Optional[IndexEntry]:
+        return self._entries.get(url)
+
+    def validators(self, url: str) -> tuple[Optional[str], Optional[str]]:
+        return self._validators.get(url, (None, None))
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,57 @@
+import hashlib
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+
+
+def fingerprint(entries: list[tuple[str, str]]) -> str:
+    """Hash of a listing page's ordered (link, price) pairs."""
+    h = hashlib.sha256()
+    for link, price in entries:
+        h.update(f"{link}\t{price}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ListingFingerprints:
+    """What every listing page looked like at the end of the last crawl.
+
+    Loaded once per crawl (one small document per listing page). A page
+    whose fingerprint is unchanged needs none of its books fetched; on a
+    changed page only the new links and the ones whose price moved do.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._previous: dict[str, tuple[str, dict[str, str]]] = {}
+        self._pending: dict[str, tuple[str, list]] = {}
+
+    async def load(self) -> "ListingFingerprints":
+        async for d in self.collection.find({}, {"fingerprint": 1, "entries": 1}):
+            self._previous[d["_id"]] = (d["fingerprint"], dict(d["entries"]))
+        return self
+
+    def changed_links(self, url: str, entries: list[tuple[str, str]]) -> list[str]:
+        """Links on listing `url` that need fetching; remembers the new state."""
+        fp = fingerprint(entries)
+        self._pending[url] = (fp, entries)
+        previous = self._previous.get(url)
+        if previous is None:
+            return [link for link, _ in entries]
+        old_fp, old_entries = previous
+        if old_fp == fp:
+            return []
+        return [link for link, price in entries if old_entries.get(link) != price]
+
+    def record(self, url: str, entries: list[tuple[str, str]]):
+        """Remember a listing's state without asking what changed (full crawls)."""
+        self._pending[url] = (fingerprint(entries), entries)
+
+    async def save(self, skip: set[str] = frozenset()):
+        """Persist the fingerprints seen this crawl, except for listings in `skip`."""
+        now = datetime.now(timezone.utc)
+        ops = [UpdateOne({"_id": url},
+                         {"$set": {"fingerprint": fp, "entries": [list(e) for e in entries],
+                                   "updated": now}},
+                         upsert=True)
+               for url, (fp, entries) in self._pending.items() if url not in skip]
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
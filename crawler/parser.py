@@ -4,9 +4,14 @@ from typing import Tuple, Optional
 import re
 from utils.logger import get_logger
 
+logger = get_logger("parser")
+
+RATINGS = {"One": 1, "Two": 2, "Three": 3, "Four": 4, "Five": 5}
+RATING_CLASS = re.compile(r"star-rating\s+(\w+)")
+DESCRIPTION_ID = "product_description"
+
 
 def parse_page(html: str, base_url: str) -> Tuple[list[str], Optional[str]]:
-    logger = get_logger("parse_page")
     try:
         tree = HTMLParser(html)
         links = []
@@ -27,52 +32,146 @@ def parse_page(html: str, base_url: str) -> Tuple[list[str], Optional[str]]:
         return [], None
 
 
+def parse_listing(html: str, base_url: str) -> Tuple[list[tuple[str, str]], Optional[str]]:
+    """Like `parse_page`, but each link comes with the price shown next to it."""
+    try:
+        tree = HTMLParser(html)
+        entries = []
+        for pod in tree.css("article.product_pod"):
+            node = pod.css_first("h3 a")
+            href = node.attributes.get("href") if node else None
+            if href:
+                price = pod.css_first("p.price_color")
+                entries.append((urljoin(base_url, f"/catalogue/{href}"),
+                                price.text().strip() if price else ""))
+        next_node = tree.css_first("li.next a")
+        next_url = urljoin(base_url, f"/catalogue/{next_node.attributes.get('href')}") if next_node else None
+        return entries, next_url
+    except Exception as th:
+        logger.warning(f"parse_listing encountered an error: {th}")
+        return [], None
+
+
+def _has_class(node, name: str) -> bool:
+    return name in (node.attributes.get("class") or "").split()
+
+
+def _under(node, tag: str, cls: str) -> bool:
+    """Whether `node` has a `tag.cls` ancestor."""
+    node = node.parent
+    while node is not None:
+        if node.tag == tag and _has_class(node, cls):
+            return True
+        node = node.parent
+    return False
+
+
+def _follows_description(p) -> bool:
+    """`#product_description ~ p`: some earlier sibling is the description header."""
+    sibling = p.prev
+    while sibling is not None:
+        if sibling.id == DESCRIPTION_ID:
+            return True
+        sibling = sibling.prev
+    return False
+
+
+def _breadcrumb_links(tree) -> list:
+    """`ul.breadcrumb li a`, in document order."""
+    links = []
+    for a in tree.tags("a"):
+        in_li = False
+        node = a.parent
+        while node is not None:
+            tag = node.tag
+            if tag == "li":
+                in_li = True
+            elif in_li and tag == "ul" and _has_class(node, "breadcrumb"):
+                links.append(a)
+                break
+            node = node.parent
+    return links
+
+
+def _table_rows(tree) -> dict[str, str]:
+    """th -> td text of every `table.table tr`; later rows win."""
+    rows = {}
+    for row in tree.tags("tr"):
+        if not _under(row, "table", "table"):
+            continue
+        th = td = None
+        for node in row.traverse():
+            tag = node.tag
+            if tag == "th" and th is None:
+                th = node
+            elif tag == "td" and td is None:
+                td = node
+            if th is not None and td is not None:
+                break
+        rows[th.text().strip() if th else ""] = td.text().strip() if td else ""
+    return rows
+
+
+def _image(tree):
+    """First of `div.carousel-inner img`, `div.item img`, `img`."""
+    first = item = None
+    for img in tree.tags("img"):
+        if first is None:
+            first = img
+        parent = img.parent
+        while parent is not None:
+            if parent.tag == "div":
+                classes = (parent.attributes.get("class") or "").split()
+                if "carousel-inner" in classes:
+                    return img
+                if item is None and "item" in classes:
+                    item = img
+            parent = parent.parent
+    return item or first
+
+
 def parse_book(book_html: str, base_url: str) -> dict:
+    """Extract a book page's fields.
+
+    One parse, then only the few tags each field can come from
+    (`tree.tags`), instead of a full CSS query per field: the selectors
+    noted below are what each lookup implements, and the golden files
+    under tests/fixtures/golden pin the output.
+    """
     book_tree = HTMLParser(book_html)
-    book_title = book_tree.css_first("div.product_main h1").text()
-    # some books missing desc
-    desc_node = book_tree.css_first("#product_description ~ p")
+    # div.product_main h1
+    title = next((h1 for h1 in book_tree.tags("h1") if _under(h1, "div", "product_main")), None)
+    if title is None:
+        raise ValueError("book page has no title")
+    book_title = title.text()
+    # some books missing desc; p.star-rating is the first rated p
+    desc_node = rating_node = None
+    for p in book_tree.tags("p"):
+        if desc_node is None and _follows_description(p):
+            desc_node = p
+        if rating_node is None and _has_class(p, "star-rating"):
+            rating_node = p
+        if desc_node is not None and rating_node is not None:
+            break
     book_desc = desc_node.text().strip() if desc_node else None
     # category
-    categ_crumbs = book_tree.css("ul.breadcrumb li a")
-    if categ_crumbs and len(categ_crumbs) >= 3:
-        book_categ = categ_crumbs[-1].text()
-    else:
-        book_categ = None
-    # price
-    
-    # def find_text(selector):
-    #     n.text().strip() if (n := book_tree.css_first(selector)) else None
-    # price_excl = find_text("th:contains('Price (excl. tax)') + td")
-
-    # this is much safer
-    bk_table = {}
-    for book_row in book_tree.css("table.table tr"):
-        th = book_row.css_first("th")
-        td = book_row.css_first("td")
-        key = th.text().strip() if th else ""
-        value = td.text().strip() if td else ""
-        bk_table[key] = value
+    categ_crumbs = _breadcrumb_links(book_tree)
+    book_categ = categ_crumbs[-1].text() if len(categ_crumbs) >= 3 else None
+    # price, availability, reviews
+    bk_table = _table_rows(book_tree)
     price_excl = float(bk_table.get("Price (excl. tax)", "").lstrip("£") or 0)
     price_incl = float(bk_table.get("Price (incl. tax)", "").lstrip("£") or 0)
-    # availability
     book_availability = bk_table.get("Availability")
-    # num_reviews
     book_num_reviews = int(bk_table.get("Number of reviews", "0"))
     # image
-    book_img = book_tree.css_first("div.carousel-inner img") or book_tree.css_first("div.item img") or book_tree.css_first("img")
+    book_img = _image(book_tree)
     book_img_url = urljoin(base_url, book_img.attributes.get("src")) if book_img else None
     # rating
-    rating_node = book_tree.css_first("p.star-rating")  # Change: hyphen, not underscore
-    # rating = 0
-    if rating_node:
-        classes = rating_node.attributes.get("class", "")
-        m = re.search(r"star-rating\s+(\w+)", classes)
-        mapping = {"One": 1, "Two": 2, "Three": 3, "Four": 4, "Five": 5}
-        rating = mapping.get(str(m.group(1)), 0)
-       
-    
-    # dict
+    if rating_node is None:
+        raise ValueError("book page has no star rating")
+    m = RATING_CLASS.search(rating_node.attributes.get("class", ""))
+    rating = RATINGS.get(str(m.group(1)), 0)
+
     return {
         "name": book_title,
         "description": book_desc,
@@ -83,4 +182,4 @@ def parse_book(book_html: str, base_url: str) -> dict:
         "num_reviews": book_num_reviews,
         "image_url": book_img_url,
         "rating": rating
-    }
\ No newline at end of file
+    }
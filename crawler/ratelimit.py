@@ -0,0 +1,128 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlsplit
+from utils.config import appsettings
+
+
+class HostLimiter:
+    """Adaptive concurrency limit for a single origin (AIMD).
+
+    Every healthy response under the latency target that completes while
+    the limit is fully used grows it by `increase / limit` (so roughly
+    `increase` per window of `limit` requests); a limit the crawl isn't
+    reaching says nothing about the host, so it stays put. It starts at
+    CRAWL_HOST_INITIAL_CONCURRENCY, below the ceiling, and never exceeds
+    CRAWL_CONCURRENCY, the most requests the crawl makes at once.
+    An error, a 429/503 or a slow response multiplies it by `decrease`, at
+    most once per observed round trip so a burst of failures doesn't
+    collapse it to the floor. `pause` blocks new requests until a
+    `Retry-After` deadline has passed.
+    """
+
+    def __init__(self, initial: Optional[float] = None, minimum: Optional[float] = None,
+                 maximum: Optional[float] = None, increase: Optional[float] = None,
+                 decrease: Optional[float] = None, latency_target: Optional[float] = None):
+        self.minimum = minimum or appsettings.CRAWL_HOST_MIN_CONCURRENCY
+        self.maximum = max(self.minimum, min(maximum or appsettings.CRAWL_CONCURRENCY,
+                                             appsettings.CRAWL_CONCURRENCY))
+        self.limit = float(min(initial or appsettings.CRAWL_HOST_INITIAL_CONCURRENCY,
+                               self.maximum))
+        self.increase = increase or appsettings.CRAWL_AIMD_INCREASE
+        self.decrease = decrease or appsettings.CRAWL_AIMD_DECREASE
+        self.latency_target = latency_target or appsettings.CRAWL_LATENCY_TARGET
+        self.in_flight = 0
+        self.latency = 0.0  # EWMA of response time
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+        self.loop = asyncio.get_running_loop()
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                wait = self._blocked_until - time.monotonic()
+                if wait > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    break
+                await self._cond.wait()
+            self.in_flight += 1
+
+    async def release(self, latency: float, ok: Optional[bool]):
+        """Give a slot back; `ok` None (a cancelled request) leaves the limit be."""
+        async with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if ok is None:
+                self._cond.notify_all()
+                return
+            self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+            if ok and latency <= self.latency_target:
+                if saturated:
+                    self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= max(self.latency, 0.001):
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+    async def pause(self, seconds: float):
+        async with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class HostLimiters:
+    """One HostLimiter per `host:port`, created on first use."""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._hosts: dict[str, HostLimiter] = {}
+
+    def get(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        limiter = self._hosts.get(host)
+        if limiter is None or limiter.loop is not asyncio.get_running_loop():
+            # asyncio primitives are tied to one loop; a new loop (a new
+            # job process, a test) gets a fresh limiter that keeps what was
+            # learnt about the host
+            fresh = HostLimiter(**self._kwargs)
+            if limiter is not None:
+                fresh.limit, fresh.latency = limiter.limit, limiter.latency
+            limiter = self._hosts[host] = fresh
+        return limiter
+
+    def snapshot(self) -> dict:
+        return {host: {"limit": round(h.limit, 2), "in_flight": h.in_flight,
+                       "latency": round(h.latency, 4)}
+                for host, h in self._hosts.items()}
+
+
+def backoff_delay(attempt: int, base: Optional[float] = None,
+                  cap: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter."""
+    base = base or appsettings.CRAWL_BACKOFF_BASE
+    cap = cap or appsettings.CRAWL_BACKOFF_MAX
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
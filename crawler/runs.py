@@ -0,0 +1,117 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from db import mongo
+from utils.dates import as_utc
+
+RUNNING, FINISHED, FAILED, CANCELLED = "running", "finished", "failed", "cancelled"
+FULL, INCREMENTAL = "full", "incremental"
+
+
+class RunStats:
+    """What one crawl did, summarized into its crawl_runs document.
+
+    Kept next to the process-wide metrics so nightly runs can be compared
+    with each other after the fact.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.pages: Counter = Counter()  # "kind:outcome" -> n
+        self.fetch_latencies: list[float] = []
+        self.parse_seconds = 0.0
+        self.db_seconds = 0.0
+        self.changes = 0  # change records written
+
+    def summary(self) -> dict:
+        duration = time.monotonic() - self.started
+        books = sum(n for k, n in self.pages.items() if k.startswith("book:"))
+        errors = sum(n for k, n in self.pages.items() if k.endswith(":failed"))
+        latencies = sorted(self.fetch_latencies)
+
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 4) \
+                if latencies else None
+
+        return {
+            "duration": round(duration, 3),
+            "pages": dict(self.pages),
+            "books": books,
+            "changes": self.changes,
+            "errors": errors,
+            "books_per_sec": round(books / duration, 2) if duration else None,
+            "fetch_p50": pct(0.5),
+            "fetch_p99": pct(0.99),
+            "parse_seconds": round(self.parse_seconds, 3),
+            "db_seconds": round(self.db_seconds, 3),
+        }
+
+
+async def start_run(start_url: str, **fields) -> ObjectId:
+    result = await mongo.crawl_runs_col.insert_one({
+        "start_url": start_url,
+        "status": RUNNING,
+        "started": datetime.now(timezone.utc),
+        **fields,
+    })
+    return result.inserted_id
+
+
+async def finish_run(run_id: ObjectId, status: str, **summary):
+    await mongo.crawl_runs_col.update_one({"_id": run_id}, {"$set": {
+        "status": status,
+        "finished": datetime.now(timezone.utc),
+        **summary,
+    }})
+
+
+async def latest_unfinished_run() -> Optional[dict]:
+    """The most recent run, if it crashed or failed before finishing.
+
+    Distributed runs are left to their coordinator.
+    """
+    run = await mongo.crawl_runs_col.find_one({"distributed": {"$ne": True}},
+                                              sort=[("started", -1)])
+    if run and run["status"] not in (FINISHED, CANCELLED):
+        return run
+    return None
+
+
+# one crawl at a time, across API workers and processes
+CRAWL_LOCK = "crawl"
+
+
+async def acquire_lock(holder: str, ttl: float) -> bool:
+    """Take (or renew) the crawl lock for `holder` for `ttl` seconds.
+
+    An expired lock is up for grabs, so a crashed crawl only blocks the
+    next one until its last renewal runs out.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        await mongo.locks_col.update_one(
+            {"_id": CRAWL_LOCK, "$or": [{"holder": holder}, {"expires": {"$lt": now}}]},
+            {"$set": {"holder": holder, "expires": now + timedelta(seconds=ttl)}},
+            upsert=True)
+    except DuplicateKeyError:
+        return False  # held by someone else
+    return True
+
+
+async def release_lock(holder: str):
+    await mongo.locks_col.delete_one({"_id": CRAWL_LOCK, "holder": holder})
+
+
+async def choose_mode(full_every_days: int) -> str:
+    """Incremental, unless the last finished full crawl is too old (or missing)."""
+    last_full = await mongo.crawl_runs_col.find_one(
+        {"mode": FULL, "status": FINISHED}, sort=[("started", -1)])
+    if not last_full:
+        return FULL
+    started = as_utc(last_full["started"])
+    if datetime.now(timezone.utc) - started >= timedelta(days=full_every_days):
+        return FULL
+    return INCREMENTAL
@@ -0,0 +1,234 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db import history
+from utils import cache, events, metrics
+from utils.config import appsettings
+from utils.logger import get_logger
+
+logger = get_logger("writer")
+
+
+class BookWriter:
+    """Write-behind buffer for crawl results.
+
+    Book upserts are collected and sent as one ordered `bulk_write`, change
+    records as one `insert_many` (then published as live events), and books
+    that were merely seen again get a single `update_many` on `last_seen`.
+    A flush happens when `batch_size` ops are pending, when the oldest
+    pending op is `flush_interval` seconds old, and when the writer is
+    closed at the end of a crawl. With `stats` the category summary deltas
+    of a batch are written right after it, and with `history` its price
+    history points.
+
+    Whether an inserted book is new is only known once its upsert ran: a
+    url processed twice (a distributed lease that expired, say) finds the
+    book already stored. Its summary deltas, history point and "new" change
+    record are therefore held back until `bulk_write` reports the upsert,
+    and dropped for a book that was already there.
+
+    A batch that fails to write stays buffered, ahead of anything queued
+    since, and is retried by the next flush; its URLs are only acked once
+    it made it. A failed final flush raises.
+    """
+
+    def __init__(self, books_col, changes_col, batch_size: Optional[int] = None,
+                 flush_interval: Optional[float] = None, snapshots=None, stats=None,
+                 history=None,
+                 on_commit: Optional[Callable[[list[str]], Awaitable]] = None):
+        self.books_col = books_col
+        self.changes_col = changes_col
+        self.snapshots = snapshots
+        self.stats = stats
+        self.history = history
+        self.on_commit = on_commit
+        self.batch_size = batch_size or appsettings.CRAWL_WRITE_BATCH
+        self.flush_interval = flush_interval or appsettings.CRAWL_WRITE_INTERVAL
+        self._ops: list = []
+        self._changes: list[dict] = []
+        self._touched: list[ObjectId] = []
+        # book_id -> (doc, change) of inserts whose upsert hasn't run yet
+        self._inserts: dict[ObjectId, tuple[dict, dict]] = {}
+        self._pages: dict[str, str] = {}
+        self._acks: list[str] = []
+        self._oldest: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._ticker: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.db_seconds = 0.0
+
+    async def __aenter__(self):
+        self._ticker = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._ticker:
+            self._ticker.cancel()
+            self._ticker = None
+        await self.flush()
+
+    async def insert(self, doc: dict, change: dict) -> ObjectId:
+        """Upsert a new book on `source_url`; returns the id it gets if no
+        other process stored it first."""
+        book_id = ObjectId()
+        self._inserts[book_id] = (doc, change)
+        op = UpdateOne({"source_url": doc["source_url"]},
+                       {**self._set(doc), "$setOnInsert": {"_id": book_id}},
+                       upsert=True)
+        await self._add(op, None)
+        return book_id
+
+    def _settle(self, inserts: dict, upserted: Iterable[ObjectId], changes: list[dict]):
+        """Queue what goes with the inserts that really created a book."""
+        for book_id in upserted:
+            pending = inserts.pop(book_id, None)
+            if pending is None:
+                continue
+            doc, change = pending
+            if self.stats:
+                self.stats.add(doc)
+            if self.history:
+                self.history.record(book_id, doc["crawl_timestamp"], doc)
+            changes.append({**change, "book_id": book_id})
+
+    async def update(self, book_id: ObjectId, fields: dict, change: Optional[dict] = None,
+                     old: Optional[dict] = None):
+        """Set `fields` on a stored book; `old` is its previous version, if the
+        category summary and price history need to move with it."""
+        if self.stats and old is not None:
+            self.stats.change(old, fields)
+        if self.history and old is not None and history.changed(old, fields):
+            self.history.record(book_id, fields["crawl_timestamp"], fields)
+        op = UpdateOne({"_id": book_id}, self._set(fields))
+        await self._add(op, {**change, "book_id": book_id} if change else None)
+
+    def _set(self, fields: dict) -> dict:
+        update = {"$set": fields}
+        if self.snapshots and "content_hash" in fields:
+            # the new page went to the snapshot store; an inline copy from
+            # before it would be stale
+            update["$unset"] = {"raw_html": ""}
+        return update
+
+    def snapshot(self, content_hash: str, html: str):
+        """Queue a raw page for the snapshot store; flushed with the books."""
+        self._pages[content_hash] = html
+
+    def ack(self, url: str):
+        self._acks.append(url)
+
+    async def touch(self, book_id: ObjectId):
+        """Book was seen unchanged: only its `last_seen` moves."""
+        self._touched.append(book_id)
+        await self._mark_pending(len(self._touched))
+
+    async def _add(self, op, change: Optional[dict]):
+        self._ops.append(op)
+        if change:
+            self._changes.append(change)
+        await self._mark_pending(len(self._ops))
+
+    async def _mark_pending(self, pending: int):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if pending >= self.batch_size:
+            await self._try_flush("batch")
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.flush_interval / 2)
+            if self._oldest is not None and \
+                    time.monotonic() - self._oldest >= self.flush_interval:
+                await self._try_flush("timed")
+
+    async def _try_flush(self, reason: str):
+        # the batch stays buffered on failure, so there is nothing to lose here
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning("%s flush failed, keeping %d book ops for the next one: %s",
+                           reason, len(self._ops), e)
+
+    async def _timed(self, op: str, call):
+        start = time.perf_counter()
+        try:
+            return await call
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.DB_SECONDS.observe(elapsed, op=op)
+            self.db_seconds += elapsed
+
+    async def _insert_changes(self, changes: list[dict]):
+        try:
+            await self.changes_col.insert_many(changes, ordered=False)
+        except BulkWriteError as e:
+            # a retried batch: records that made it last time already have their _id
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+    async def flush(self):
+        async with self._lock:
+            ops, changes, touched = self._ops, self._changes, self._touched
+            pages, acks, inserts = self._pages, self._acks, self._inserts
+            self._ops, self._changes, self._touched = [], [], []
+            self._pages, self._acks, self._inserts = {}, [], {}
+            oldest, self._oldest = self._oldest, None
+            if not ops and not changes and not touched and not acks:
+                return
+            counts = [len(ops), 0, len(touched)]
+            # each step drops its part of the batch once it is written, so a
+            # failure puts back exactly what is left
+            try:
+                # books reference snapshots and changes reference books
+                if pages:
+                    await self._timed("snapshots", self.snapshots.put_many(pages))
+                    pages = {}
+                if ops:
+                    try:
+                        result = await self._timed("bulk_write",
+                                                   self.books_col.bulk_write(ops, ordered=True))
+                    except BulkWriteError as e:
+                        # the ops before the failing one did run
+                        self._settle(inserts, (u["_id"] for u in e.details.get("upserted", [])),
+                                     changes)
+                        raise
+                    self._settle(inserts, result.upserted_ids.values(), changes)
+                    if inserts:
+                        logger.info("%d inserted books were already stored, "
+                                    "not counted as new", len(inserts))
+                        inserts = {}
+                    ops = []
+                    if self.stats:
+                        await self._timed("stats", self.stats.flush(self.books_col))
+                    if self.history:
+                        await self._timed("history", self.history.flush())
+                    # cached API responses built before this are now stale
+                    await cache.bump_generation()
+                if changes:
+                    counts[1] = len(changes)
+                    await self._timed("insert_many", self._insert_changes(changes))
+                    written, changes = changes, []
+                    await self._timed("publish", events.publish(written))
+                if touched:
+                    await self._timed("update_many", self.books_col.update_many(
+                        {"_id": {"$in": touched}},
+                        {"$set": {"last_seen": datetime.now(timezone.utc)}}))
+                    touched = []
+                if acks and self.on_commit:
+                    await self.on_commit(acks)
+            except Exception:
+                self._ops[:0] = ops
+                self._changes[:0] = changes
+                self._touched[:0] = touched
+                self._pages = {**pages, **self._pages}
+                self._inserts = {**inserts, **self._inserts}
+                self._acks[:0] = acks
+                self._oldest = min(t for t in (oldest, self._oldest, time.monotonic())
+                                   if t is not None)
+                raise
+            self.flushes += 1
+            logger.info("flushed %d book ops, %d changes, %d unchanged", *counts)
@@ -0,0 +1,89 @@
+"""
+Per-book price and availability history in monthly buckets.
+
+One document per (book_id, month) holds parallel arrays: `t` with the
+crawl times and one array per HISTORY_FIELDS entry with the values seen
+then. A point is appended when a book is first crawled and whenever one of
+those fields changes, so a bucket stays small and a book's timeline for any
+range is a single read over the unique (book_id, month) index.
+
+Points are queued by `PriceHistory.record` and written with each
+BookWriter batch.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from utils.dates import as_utc
+
+HISTORY_FIELDS = ("price_incl_vat", "price_excl_vat", "availability", "num_reviews")
+
+
+def month_of(when: datetime) -> datetime:
+    """Start of `when`'s bucket."""
+    when = as_utc(when)
+    return datetime(when.year, when.month, 1, tzinfo=timezone.utc)
+
+
+def changed(old: dict, new: dict) -> bool:
+    return any(old.get(f) != new.get(f) for f in HISTORY_FIELDS)
+
+
+class PriceHistory:
+    """History points collected between two writer flushes."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        # (book_id, month) -> {"t": [...], field: [...]}
+        self._points: dict[tuple, dict[str, list]] = {}
+
+    def record(self, book_id: ObjectId, when: datetime, doc: dict):
+        key = (book_id, month_of(when))
+        arrays = self._points.get(key)
+        if arrays is None:
+            arrays = self._points[key] = defaultdict(list)
+        arrays["t"].append(when)
+        for field in HISTORY_FIELDS:
+            arrays[field].append(doc.get(field))
+
+    async def flush(self):
+        points, self._points = self._points, {}
+        if not points:
+            return
+        ops = [UpdateOne({"book_id": book_id, "month": month},
+                         {"$push": {f: {"$each": values} for f, values in arrays.items()},
+                          "$inc": {"count": len(arrays["t"])}},
+                         upsert=True)
+               for (book_id, month), arrays in points.items()]
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception:
+            # keep the points, ahead of any recorded since
+            for key, arrays in points.items():
+                newer = self._points.get(key)
+                if newer:
+                    for field, values in newer.items():
+                        arrays[field].extend(values)
+                self._points[key] = arrays
+            raise
+
+
+async def read(collection, book_id: ObjectId, start: Optional[datetime] = None,
+               end: Optional[datetime] = None) -> list[dict]:
+    """`book_id`'s points between `start` and `end` (inclusive), oldest first."""
+    query = {"book_id": book_id}
+    if start or end:
+        query["month"] = {}
+        if start:
+            query["month"]["$gte"] = month_of(start)
+        if end:
+            query["month"]["$lte"] = month_of(end)
+    points = []
+    async for bucket in collection.find(query).sort("month", 1):
+        for i, when in enumerate(bucket["t"]):
+            t = as_utc(when)
+            if (start and t < as_utc(start)) or (end and t > as_utc(end)):
+                continue
+            points.append({"when": when, **{f: bucket[f][i] for f in HISTORY_FIELDS}})
+    return points
@@ -6,9 +6,34 @@ db = client[appsettings.MONGO_DB]
 
 books_col = db["books"]
 changes_col = db["changes"]
+snapshots_col = db["snapshots"]
+frontier_col = db["frontier"]
+crawl_runs_col = db["crawl_runs"]
+listings_col = db["listings"]
+stats_col = db["category_stats"]
+locks_col = db["locks"]
+history_col = db["price_history"]
 
 
 async def ensure_indexes():
     await books_col.create_index("source_url", unique=True)
     await books_col.create_index([("category", 1), ("price_excl_vat", 1)])
-    await changes_col.create_index("books_id")
\ No newline at end of file
+    # keyset pagination: one (sort key, _id) index per /books sort
+    await books_col.create_index([("name", 1), ("_id", 1)])
+    for field in ("rating", "price_excl_vat", "num_reviews"):
+        await books_col.create_index([(field, -1), ("_id", -1)])
+    # /books/search; weights mirror db.search.FIELD_WEIGHTS
+    await books_col.create_index([("name", "text"), ("description", "text")],
+                                 weights={"name": 10, "description": 1},
+                                 name="books_text")
+    # an earlier version indexed "books_id", a field nothing writes
+    if "books_id_1" in await changes_col.index_information():
+        await changes_col.drop_index("books_id_1")
+    await changes_col.create_index("book_id")
+    await changes_col.create_index([("when", -1), ("_id", -1)])
+    await frontier_col.create_index([("run_id", 1), ("url", 1)], unique=True)
+    # distributed mode: leasing and finding what a lease got
+    await frontier_col.create_index([("run_id", 1), ("kind", 1), ("state", 1), ("lease_until", 1)])
+    await frontier_col.create_index([("run_id", 1), ("lease_token", 1)])
+    await crawl_runs_col.create_index([("started", -1)])
+    await history_col.create_index([("book_id", 1), ("month", 1)], unique=True)
\ No newline at end of file
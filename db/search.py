@@ -0,0 +1,132 @@
+"""
+Relevance-ranked book search for /books/search.
+
+The "mongo" backend runs `$text` against the `books_text` index from
+`ensure_indexes`. The "memory" backend answers from an in-process inverted
+index instead, for the mongomock setup where `$text` doesn't exist; it is
+built on first use and rebuilt after every crawl.
+
+Both return hits best first, ordered by (score, _id) descending, so a hit's
+(score, _id) is a keyset cursor for the next page.
+"""
+import heapq
+import math
+import re
+from array import array
+from typing import Optional
+from bson import ObjectId
+from utils.config import appsettings
+from utils.logger import get_logger
+
+logger = get_logger("search")
+
+# same weights as the books_text index
+FIELD_WEIGHTS = {"name": 10, "description": 1}
+TEXT_INDEX = "books_text"
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has he in is it its of on or she that the "
+    "their they this to was were will with".split())
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    if not text:
+        return []
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+class InvertedIndex:
+    """term -> (doc numbers, weights) postings over name and description.
+
+    A posting's weight is the term's field-weighted frequency, normalized by
+    field length; idf is applied at query time. Postings are flat arrays so
+    a 100k-book catalogue stays in the tens of megabytes.
+    """
+
+    def __init__(self):
+        self.ids: list[ObjectId] = []
+        self.postings: dict[str, tuple[array, array]] = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    async def build(cls, books_col) -> "InvertedIndex":
+        index = cls()
+        async for doc in books_col.find({}, {f: 1 for f in FIELD_WEIGHTS}):
+            index.add(doc)
+        return index
+
+    def add(self, doc: dict):
+        weights: dict[str, float] = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            tokens = tokenize(doc.get(field))
+            for token in tokens:
+                weights[token] = weights.get(token, 0.0) + field_weight / len(tokens)
+        if not weights:
+            return
+        number = len(self.ids)
+        self.ids.append(doc["_id"])
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array("I"), array("d"))
+            posting[0].append(number)
+            posting[1].append(weight)
+
+    def search(self, q: str, limit: int,
+               after: Optional[tuple[float, ObjectId]] = None) -> list[tuple[float, ObjectId]]:
+        """Top `limit` (score, _id) hits for any of `q`'s terms, after `after`."""
+        scores: dict[int, float] = {}
+        for term in set(tokenize(q)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            idf = math.log(1 + len(self.ids) / len(posting[0]))
+            for number, weight in zip(*posting):
+                scores[number] = scores.get(number, 0.0) + idf * weight
+        hits = ((score, self.ids[n]) for n, score in scores.items())
+        if after is not None:
+            hits = (h for h in hits if h < after)
+        return heapq.nlargest(limit, hits)
+
+
+_memory_index: Optional[InvertedIndex] = None
+
+
+async def rebuild(books_col) -> Optional[InvertedIndex]:
+    """Refresh the in-process index (memory backend only)."""
+    global _memory_index
+    if appsettings.SEARCH_BACKEND != "memory":
+        return None
+    _memory_index = await InvertedIndex.build(books_col)
+    logger.info("search index rebuilt: %d books, %d terms",
+                len(_memory_index), len(_memory_index.postings))
+    return _memory_index
+
+
+async def search(books_col, q: str, limit: int, projection: dict,
+                 after: Optional[tuple[float, ObjectId]] = None) -> list[tuple[float, dict]]:
+    """Up to `limit` (score, book) hits for `q`, best first."""
+    if appsettings.SEARCH_BACKEND == "memory":
+        index = _memory_index or await rebuild(books_col)
+        hits = index.search(q, limit, after)
+        found = {d["_id"]: d async for d in
+                 books_col.find({"_id": {"$in": [_id for _, _id in hits]}}, projection)}
+        return [(score, found[_id]) for score, _id in hits if _id in found]
+
+    pipeline = [
+        {"$match": {"$text": {"$search": q}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after is not None:
+        score, _id = after
+        pipeline.append({"$match": {"$or": [{"score": {"$lt": score}},
+                                            {"score": score, "_id": {"$lt": _id}}]}})
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$project": {**projection, "score": 1}},
+    ]
+    return [(d.pop("score"), d) async for d in books_col.aggregate(pipeline)]
@@ -0,0 +1,125 @@
+import asyncio
+import gzip
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+from bson import Binary
+from pymongo import UpdateOne
+from utils.config import appsettings
+
+try:
+    import zstandard
+except ImportError:  # optional: fall back to gzip
+    zstandard = None
+
+
+def compress(html: str, codec: str) -> bytes:
+    data = html.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(blob: bytes, codec: str) -> str:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(blob).decode("utf-8")
+    return gzip.decompress(blob).decode("utf-8")
+
+
+def default_codec() -> str:
+    if appsettings.SNAPSHOT_CODEC == "zstd" and zstandard is not None:
+        return "zstd"
+    return "gzip"
+
+
+class SnapshotStore(ABC):
+    """Compressed raw-HTML snapshots keyed by `content_hash`.
+
+    Identical pages hash the same, so each distinct page is stored once no
+    matter how many books or crawls point at it.
+    """
+
+    def __init__(self, codec: Optional[str] = None):
+        self.codec = codec or default_codec()
+
+    @abstractmethod
+    async def put_many(self, pages: dict[str, str]):
+        """Store each page under its hash; pages already stored are kept."""
+
+    @abstractmethod
+    async def get(self, content_hash: str) -> Optional[str]:
+        """The page stored under `content_hash`, or None."""
+
+
+class MongoSnapshotStore(SnapshotStore):
+    def __init__(self, collection, codec: Optional[str] = None):
+        super().__init__(codec)
+        self.collection = collection
+
+    async def put_many(self, pages: dict[str, str]):
+        if not pages:
+            return
+        ops = [UpdateOne({"_id": h},
+                         {"$setOnInsert": {"codec": self.codec,
+                                           "size": len(html),
+                                           "data": Binary(compress(html, self.codec))}},
+                         upsert=True)
+               for h, html in pages.items()]
+        await self.collection.bulk_write(ops, ordered=False)
+
+    async def get(self, content_hash: str) -> Optional[str]:
+        doc = await self.collection.find_one({"_id": content_hash})
+        if not doc:
+            return None
+        return decompress(bytes(doc["data"]), doc.get("codec", "gzip"))
+
+
+class FileSnapshotStore(SnapshotStore):
+    """Local-directory backend, handy for tests and single-box setups."""
+
+    def __init__(self, root: str, codec: Optional[str] = None):
+        super().__init__(codec)
+        self.root = root
+
+    def _path(self, content_hash: str, codec: str) -> str:
+        ext = "zst" if codec == "zstd" else "gz"
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}.{ext}")
+
+    def _write(self, pages: dict[str, str]):
+        for h, html in pages.items():
+            path = self._path(h, self.codec)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(compress(html, self.codec))
+            os.replace(tmp, path)
+
+    def _read(self, content_hash: str) -> Optional[str]:
+        for codec in ("zstd", "gzip"):
+            path = self._path(content_hash, codec)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return decompress(f.read(), codec)
+        return None
+
+    async def put_many(self, pages: dict[str, str]):
+        if pages:
+            await asyncio.to_thread(self._write, pages)
+
+    async def get(self, content_hash: str) -> Optional[str]:
+        return await asyncio.to_thread(self._read, content_hash)
+
+
+def get_snapshot_store(collection) -> Optional[SnapshotStore]:
+    """Store configured by SNAPSHOT_BACKEND; `collection` backs the mongo one.
+
+    None means snapshots stay inline in `raw_html` as they used to.
+    """
+    backend = appsettings.SNAPSHOT_BACKEND
+    if backend == "file":
+        return FileSnapshotStore(appsettings.SNAPSHOT_DIR)
+    if backend == "mongo":
+        return MongoSnapshotStore(collection)
+    return None
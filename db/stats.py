@@ -0,0 +1,218 @@
+"""
+Materialized per-category summary behind /stats.
+
+One document per category with running totals (`count`, `price_sum`,
+`price_count`, `price_min`, `price_max` and a `ratings` histogram). The
+crawl keeps it current through `CategoryStats` deltas flushed with each
+BookWriter batch. Deltas only make sense on top of a summary of the books
+already stored, so `seed` builds it first when it is missing (every crawl
+and API startup check); `rebuild` recomputes it from scratch:
+
+    python -m db.stats [--dry-run]
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from utils.logger import get_logger
+
+logger = get_logger("stats")
+
+# what a book contributes to the summary
+STATS_FIELDS = ("category", "price_excl_vat", "rating")
+STATS_PROJECTION = {f: 1 for f in STATS_FIELDS}
+# summary _id for books the parser found no category for
+UNCATEGORIZED = "Uncategorized"
+
+
+def _key(category: Optional[str]) -> str:
+    return category or UNCATEGORIZED
+
+
+def _category_filter(key: str) -> dict:
+    return {"category": None if key == UNCATEGORIZED else key}
+
+
+class CategoryStats:
+    """Summary deltas collected between two writer flushes."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._inc: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(int))
+        self._min: dict[str, float] = {}
+        self._max: dict[str, float] = {}
+        # categories that lost a price which may have been their min or max
+        self._stale: set[str] = set()
+
+    def _apply(self, doc: dict, sign: int):
+        key = _key(doc.get("category"))
+        inc = self._inc[key]
+        inc["count"] += sign
+        price = doc.get("price_excl_vat")
+        if price is not None:
+            inc["price_sum"] += sign * price
+            inc["price_count"] += sign
+            if sign > 0:
+                self._min[key] = min(self._min.get(key, price), price)
+                self._max[key] = max(self._max.get(key, price), price)
+            else:
+                self._stale.add(key)
+        if doc.get("rating") is not None:
+            inc[f"ratings.{doc['rating']}"] += sign
+
+    def add(self, doc: dict):
+        self._apply(doc, 1)
+
+    def change(self, old: dict, new: dict):
+        if all(old.get(f) == new.get(f) for f in STATS_FIELDS):
+            return
+        if old:
+            self._apply(old, -1)
+        self._apply(new, 1)
+
+    def _restore(self, inc, mins, maxs, stale):
+        # a failed flush's deltas go back under whatever was added since
+        for key, fields in inc.items():
+            for field, value in fields.items():
+                self._inc[key][field] += value
+        for key, price in mins.items():
+            self._min[key] = min(self._min.get(key, price), price)
+        for key, price in maxs.items():
+            self._max[key] = max(self._max.get(key, price), price)
+        self._stale |= stale
+
+    async def flush(self, books_col):
+        """Write the pending deltas; `books_col` must already hold the books."""
+        inc, mins, maxs, stale = self._inc, self._min, self._max, self._stale
+        self._inc, self._min, self._max = defaultdict(lambda: defaultdict(int)), {}, {}
+        self._stale = set()
+        if not inc:
+            return
+        now = datetime.now(timezone.utc)
+        ops = []
+        for key, fields in inc.items():
+            update = {"$inc": dict(fields), "$set": {"updated": now}}
+            if key in mins:
+                update["$min"] = {"price_min": mins[key]}
+                update["$max"] = {"price_max": maxs[key]}
+            ops.append(UpdateOne({"_id": key}, update, upsert=True))
+        try:
+            await self.collection.bulk_write(ops, ordered=False)
+        except Exception:
+            self._restore(inc, mins, maxs, stale)
+            raise
+        for key in stale:
+            await self._refresh_bounds(books_col, key)
+        await self.collection.delete_many({"count": {"$lte": 0}})
+
+    async def _refresh_bounds(self, books_col, key: str):
+        # both served by the (category, price_excl_vat) index
+        query = {**_category_filter(key), "price_excl_vat": {"$ne": None}}
+        bounds = {}
+        for name, direction in (("price_min", ASCENDING), ("price_max", DESCENDING)):
+            doc = await books_col.find_one(query, {"price_excl_vat": 1},
+                                           sort=[("price_excl_vat", direction)])
+            bounds[name] = doc["price_excl_vat"] if doc else None
+        await self.collection.update_one({"_id": key}, {"$set": bounds})
+
+
+async def compute(books_col) -> dict[str, dict]:
+    """The full summary, aggregated from the books themselves."""
+    pipeline = [
+        {"$group": {
+            "_id": {"category": "$category", "rating": "$rating"},
+            "count": {"$sum": 1},
+            "price_sum": {"$sum": "$price_excl_vat"},
+            "price_count": {"$sum": {"$cond": [
+                {"$eq": [{"$ifNull": ["$price_excl_vat", None]}, None]}, 0, 1]}},
+            "price_min": {"$min": "$price_excl_vat"},
+            "price_max": {"$max": "$price_excl_vat"},
+        }},
+    ]
+    out: dict[str, dict] = {}
+    async for g in books_col.aggregate(pipeline):
+        key = _key(g["_id"].get("category"))
+        s = out.setdefault(key, {"_id": key, "count": 0, "price_sum": 0.0, "price_count": 0,
+                                 "price_min": None, "price_max": None, "ratings": {}})
+        s["count"] += g["count"]
+        s["price_sum"] += g["price_sum"] or 0.0
+        s["price_count"] += g["price_count"]
+        for name, pick in (("price_min", min), ("price_max", max)):
+            if g[name] is not None:
+                s[name] = g[name] if s[name] is None else pick(s[name], g[name])
+        rating = g["_id"].get("rating")
+        if rating is not None:
+            s["ratings"][str(rating)] = g["count"]
+    return out
+
+
+def _drift(current: Optional[dict], fresh: dict) -> list[str]:
+    current = current or {}
+    drifted = [f for f in ("count", "price_count", "price_min", "price_max")
+               if current.get(f) != fresh[f]]
+    # deltas leave zero buckets behind in the histogram
+    ratings = {r: n for r, n in (current.get("ratings") or {}).items() if n}
+    if ratings != fresh["ratings"]:
+        drifted.append("ratings")
+    if abs(current.get("price_sum", 0.0) - fresh["price_sum"]) > 1e-6:
+        drifted.append("price_sum")
+    return drifted
+
+
+async def rebuild(books_col, stats_col, dry_run: bool = False) -> dict[str, list[str]]:
+    """Recompute the summary from scratch; returns category -> drifted fields.
+
+    With `dry_run` the stored summary is only compared, not replaced.
+    """
+    fresh = await compute(books_col)
+    current = {d["_id"]: d async for d in stats_col.find({})}
+    drift = {}
+    for key in fresh.keys() | current.keys():
+        if key not in fresh:
+            drift[key] = ["count"]
+            continue
+        fields = _drift(current.get(key), fresh[key])
+        if fields:
+            drift[key] = fields
+    if drift:
+        logger.warning("category stats drifted: %s", drift)
+    if not dry_run:
+        now = datetime.now(timezone.utc)
+        await stats_col.delete_many({})
+        if fresh:
+            await stats_col.insert_many([{**s, "updated": now} for s in fresh.values()])
+    return drift
+
+
+async def seed(books_col, stats_col) -> bool:
+    """Build the summary if it is empty but books exist; True if it did."""
+    if await stats_col.count_documents({}, limit=1) or \
+            not await books_col.count_documents({}, limit=1):
+        return False
+    logger.info("category stats are empty, building them from the stored books")
+    try:
+        await rebuild(books_col, stats_col)
+    except (BulkWriteError, DuplicateKeyError):
+        # another process seeded it at the same time
+        return False
+    return True
+
+
+async def main():
+    from db import mongo
+
+    ap = argparse.ArgumentParser(description="Rebuild the /stats category summary.")
+    ap.add_argument("--dry-run", action="store_true",
+                    help="only report categories whose stored summary drifted")
+    args = ap.parse_args()
+    drift = await rebuild(mongo.books_col, mongo.stats_col, dry_run=args.dry_run)
+    print(f"{len(drift)} categories drifted" + ("" if args.dry_run else ", rebuilt"))
+    for key, fields in sorted(drift.items()):
+        print(f"  {key}: {', '.join(fields)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
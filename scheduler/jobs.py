@@ -1,7 +1,21 @@
+import argparse
+import asyncio
+import subprocess
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bson import ObjectId
+from crawler.client import close_client, get_client, pool_stats
+from crawler import runs
 from crawler.crawler_manager import Crawler
+from crawler.frontier import CrawlFrontier
+from api import auth
+from utils import cache, events, metrics
 from utils.config import appsettings
 from utils.logger import get_logger
+from db import mongo
 from db.mongo import ensure_indexes
 
 logger = get_logger("scheduler")
@@ -9,19 +23,209 @@ logger = get_logger("scheduler")
 scheduler = AsyncIOScheduler()
 
 
-async def run_crawl_job():
-    logger.info("Starting scheduled crawl job")
+class CrawlBusy(Exception):
+    """Another crawl holds the crawl lock."""
+
+
+async def claim_run(resume: bool = True, mode: Optional[str] = None) -> ObjectId:
+    """Take the crawl lock and pick the run to do: the last run if it never
+    finished, otherwise a new one. Raises CrawlBusy if a crawl is going.
+
+    `mode` is "full" or "incremental"; by default it's incremental when
+    CRAWL_INCREMENTAL is on, with a full crawl every CRAWL_FULL_EVERY_DAYS.
+    """
+    # the lock first: while a crawl runs, its own run looks unfinished too
+    holder = uuid.uuid4().hex
+    if not await runs.acquire_lock(holder, appsettings.CRAWL_LOCK_TTL):
+        raise CrawlBusy("a crawl is already running")
+    run = await runs.latest_unfinished_run() if resume else None
+    if run:
+        await mongo.crawl_runs_col.update_one({"_id": run["_id"]}, {"$set": {
+            "status": runs.RUNNING, "cancel_requested": False, "lock": holder}})
+        logger.info("Resuming interrupted %s crawl run %s", run.get("mode", runs.FULL), run["_id"])
+        return run["_id"]
+    if mode is None:
+        mode = runs.FULL
+        if appsettings.CRAWL_INCREMENTAL:
+            mode = await runs.choose_mode(appsettings.CRAWL_FULL_EVERY_DAYS)
+    start_url = f"{appsettings.BASE_URL}/page-1.html"  # books.toscrape specific start
+    run_id = await runs.start_run(start_url, mode=mode, lock=holder)
+    logger.info("Starting %s crawl run %s", mode, run_id)
+    return run_id
+
+
+async def _report_progress(run_id: ObjectId, holder: str, crawler: Crawler):
+    """Publish live progress on the run, keep the lock and watch for cancel."""
+    while True:
+        await asyncio.sleep(appsettings.CRAWL_PROGRESS_INTERVAL)
+        try:
+            if not await runs.acquire_lock(holder, appsettings.CRAWL_LOCK_TTL):
+                logger.warning("crawl lock of run %s was taken over", run_id)
+            run = await mongo.crawl_runs_col.find_one_and_update(
+                {"_id": run_id},
+                {"$set": {"progress": crawler.run_stats.summary(),
+                          "heartbeat": datetime.now(timezone.utc)}},
+                projection={"cancel_requested": 1})
+        except Exception as e:
+            logger.warning("could not report progress of run %s: %s", run_id, e)
+            continue
+        await metrics.export_crawler()
+        if run and run.get("cancel_requested"):
+            logger.info("cancelling crawl run %s", run_id)
+            await crawler.stop()
+            return
+
+
+async def run_crawl_job(resume: bool = True, mode: Optional[str] = None,
+                        run_id: Optional[ObjectId] = None):
+    """Crawl the catalogue, resuming the last run if it never finished.
+
+    With `run_id` the run was already claimed (see `claim_run`), normally
+    by the API process that started this one.
+    """
+    logger.info("Starting crawl job")
     await ensure_indexes()
-    crawler = Crawler(appsettings.BASE_URL)
-    await crawler.crawl(f"{appsettings.BASE_URL}/page-1.html")  # books.toscrape specific start
-    logger.info("Crawl job finished")
+    if run_id is None:
+        run_id = await claim_run(resume, mode)
+    run = await mongo.crawl_runs_col.find_one({"_id": run_id})
+    mode = run.get("mode", runs.FULL)
+    start_url = run["start_url"]
+    frontier = CrawlFrontier(str(run_id), mongo.frontier_col)
+    crawler = Crawler(appsettings.BASE_URL, incremental=mode == runs.INCREMENTAL)
+    reporter = asyncio.create_task(_report_progress(run_id, run["lock"], crawler))
+    status = runs.FAILED
+    try:
+        await crawler.crawl(start_url, client=get_client(), frontier=frontier)
+        # the reporter only returns early when it cancelled the crawl
+        status = runs.CANCELLED if reporter.done() else runs.FINISHED
+    finally:
+        reporter.cancel()
+        summary = crawler.run_stats.summary()
+        await runs.finish_run(run_id, status, urls=frontier.counts(),
+                              progress=summary, metrics=summary)
+        # a failed run keeps its frontier for the next one to resume
+        if status != runs.FAILED:
+            await frontier.discard()
+        await runs.release_lock(run["lock"])
+        await metrics.export_crawler()
+    # API processes refresh their memory search index, see api.main
+    await events.crawl_finished(str(run_id))
+    logger.info("Crawl job %s: %s, pool: %s", status, summary, pool_stats())
+
+
+class CrawlRunner:
+    """Runs crawls in a child process, one at a time.
+
+    The API process only claims the run and starts `python -m
+    scheduler.jobs --run-id <id>`; the crawl itself never shares the
+    event loop that serves requests. Progress and cancellation go through
+    the run's crawl_runs document, so any API worker can report on or
+    cancel a crawl another one started.
+
+    What the crawl leaves behind in memory stays in the child, so it is
+    handed over through Redis: the cache generation and change events as
+    before, its crawler_* metrics for /metrics, and a crawl-finished
+    message on which the API rebuilds its memory search index. Without
+    Redis, none of these reach the API. The shared httpx client is reused
+    across retry passes and workers within a crawl, but every crawl starts
+    with a cold pool in its new process; crawls run hours apart, long
+    after idle keep-alive connections would have closed anyway.
+    """
+
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+        self.run_id: Optional[ObjectId] = None
+
+    def _spawn(self, run_id: ObjectId) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, "-m", "scheduler.jobs",
+                                 "--run-id", str(run_id)])
+
+    async def _reap(self):
+        """Fail the run of a child that died without finishing it."""
+        if self.proc is None or self.proc.poll() is None:
+            return
+        if self.proc.returncode != 0:
+            run = await mongo.crawl_runs_col.find_one({"_id": self.run_id},
+                                                      {"status": 1, "lock": 1})
+            if run and run["status"] == runs.RUNNING:
+                await runs.finish_run(self.run_id, runs.FAILED,
+                                      error=f"crawl process exited with {self.proc.returncode}")
+                await runs.release_lock(run["lock"])
+        self.proc = self.run_id = None
+
+    async def start(self, resume: bool = True, mode: Optional[str] = None) -> ObjectId:
+        """Claim a run and start it in the background; raises CrawlBusy."""
+        await self._reap()
+        run_id = await claim_run(resume, mode)
+        try:
+            self.proc = self._spawn(run_id)
+        except Exception as e:
+            run = await mongo.crawl_runs_col.find_one({"_id": run_id}, {"lock": 1})
+            await runs.finish_run(run_id, runs.FAILED, error=str(e))
+            await runs.release_lock(run["lock"])
+            raise
+        self.run_id = run_id
+        return run_id
+
+    async def wait(self, run_id: ObjectId, poll: float = 1.0) -> dict:
+        """Block until `run_id` stops running; returns its final document."""
+        while True:
+            await self._reap()
+            run = await mongo.crawl_runs_col.find_one({"_id": run_id})
+            if run is None or run["status"] != runs.RUNNING:
+                return run
+            await asyncio.sleep(poll)
+
+
+runner = CrawlRunner()
+
+
+async def scheduled_crawl():
+    try:
+        run_id = await runner.start()
+    except CrawlBusy:
+        logger.info("Skipping scheduled crawl: one is already running")
+        return
+    logger.info("Scheduled crawl run %s started", run_id)
 
 
 def start_scheduler():
     if not appsettings.SCHEDULER_ENABLED:
         logger.info("Scheduler disabled")
         return scheduler
-    scheduler.add_job(run_crawl_job, "cron", hour=0, minute=30, id="daily_crawl")
+    scheduler.add_job(scheduled_crawl, "cron", hour=0, minute=30, id="daily_crawl")
     scheduler.start()
     logger.info("Scheduler started")
     return scheduler
+
+
+async def _connect_redis():
+    """Reach the API workers: cache generation and live change events."""
+    try:
+        await auth.init_redis()
+    except Exception as e:
+        logger.warning("redis unavailable, API caches, change streams, search and "
+                       "metrics won't see this crawl: %s", e)
+        return
+    cache.configure(auth._redis_client)
+    events.configure(auth._redis_client)
+    metrics.configure(auth._redis_client)
+
+
+async def main():
+    ap = argparse.ArgumentParser(description="Run one crawl in this process.")
+    ap.add_argument("--run-id", help="a run already claimed by the API's CrawlRunner")
+    ap.add_argument("--mode", choices=(runs.FULL, runs.INCREMENTAL))
+    ap.add_argument("--no-resume", action="store_true")
+    args = ap.parse_args()
+    await _connect_redis()
+    try:
+        await run_crawl_job(resume=not args.no_resume, mode=args.mode,
+                            run_id=ObjectId(args.run_id) if args.run_id else None)
+    finally:
+        await close_client()
+        await auth.close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+"""
+A tiny books.toscrape-shaped catalogue used by the crawler tests.
+
+`CatalogueSite.handler` can be plugged into `httpx.MockTransport`, so the
+crawler runs end to end without touching the network. `CatalogueSite.asgi`
+serves the same site as an ASGI app (with ETag revalidation), for
+`httpx.ASGITransport` or a real server; the crawl benchmark uses both.
+"""
+import asyncio
+import hashlib
+import random
+import httpx
+
+BASE_URL = "https://books.toscrape.com/catalogue"
+
+_RATINGS = ["One", "Two", "Three", "Four", "Five"]
+
+
+def book_html(slug: str, name: str, price: float, rating: int = 3,
+              category: str = "Poetry", available: int = 5) -> str:
+    return f"""<html><body>
+<ul class="breadcrumb">
+  <li><a href="/index.html">Home</a></li>
+  <li><a href="/catalogue/category/books_1/index.html">Books</a></li>
+  <li><a href="/catalogue/category/books/{category.lower()}_1/index.html">{category}</a></li>
+  <li class="active">{name}</li>
+</ul>
+<div class="carousel-inner"><div class="item active"><img src="/media/{slug}.jpg"></div></div>
+<div class="col-sm-6 product_main">
+  <h1>{name}</h1>
+  <p class="price_color">&pound;{price:.2f}</p>
+  <p class="star-rating {_RATINGS[rating - 1]}"></p>
+</div>
+<div id="product_description" class="sub-header"><h2>Product Description</h2></div>
+<p>Description of {name}.</p>
+<table class="table table-striped">
+  <tr><th>UPC</th><td>{slug}</td></tr>
+  <tr><th>Price (excl. tax)</th><td>£{price:.2f}</td></tr>
+  <tr><th>Price (incl. tax)</th><td>£{price:.2f}</td></tr>
+  <tr><th>Availability</th><td>In stock ({available} available)</td></tr>
+  <tr><th>Number of reviews</th><td>0</td></tr>
+</table>
+</body></html>"""
+
+
+def listing_html(entries: list[tuple[str, float]], next_href: str = None) -> str:
+    pods = "\n".join(
+        f'<li><article class="product_pod"><h3><a href="{slug}/index.html">{slug}</a></h3>'
+        f'<div class="product_price"><p class="price_color">£{price:.2f}</p></div></article></li>'
+        for slug, price in entries
+    )
+    nxt = f'<li class="next"><a href="{next_href}">next</a></li>' if next_href else ""
+    return f"<html><body><ol class=\"row\">{pods}</ol><ul class=\"pager\">{nxt}</ul></body></html>"
+
+
+class CatalogueSite:
+    """`pages` listing pages with `per_page` books each, served from memory.
+
+    `error_rate` of the requests get a 503 instead, drawn from an RNG seeded
+    with `seed` so runs are repeatable.
+    """
+
+    def __init__(self, pages: int = 3, per_page: int = 20, latency: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.pages = pages
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self.prices: dict[str, float] = {}
+        for p in range(1, pages + 1):
+            for i in range(per_page):
+                self.prices[f"book-{p}-{i}_{p * 1000 + i}"] = 10.0 + i
+        self.slugs = list(self.prices)
+        self.errors = 0
+        self.requests: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def start_url(self) -> str:
+        return f"{BASE_URL}/page-1.html"
+
+    def book_url(self, slug: str) -> str:
+        return f"{BASE_URL}/{slug}/index.html"
+
+    def render(self, path: str):
+        name = path.rsplit("/catalogue/", 1)[-1]
+        if name.startswith("page-"):
+            page = int(name[len("page-"):-len(".html")])
+            if page > self.pages:
+                return None
+            slugs = self.slugs[(page - 1) * self.per_page:page * self.per_page]
+            next_href = f"page-{page + 1}.html" if page < self.pages else None
+            return listing_html([(s, self.prices[s]) for s in slugs], next_href)
+        slug = name.rsplit("/", 1)[0]
+        if slug not in self.prices:
+            return None
+        return book_html(slug, slug.replace("-", " ").title(), self.prices[slug])
+
+    def mutate(self, fraction: float) -> int:
+        """Reprice `fraction` of the books; returns how many changed."""
+        changed = self._rng.sample(self.slugs, round(len(self.slugs) * fraction))
+        for slug in changed:
+            self.prices[slug] += 1.0
+        return len(changed)
+
+    async def _serve(self, path: str, if_none_match: str = None,
+                     etags: bool = False) -> tuple[int, dict, str]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return 503, {}, "unavailable"
+            body = self.render(path)
+        finally:
+            self.in_flight -= 1
+        if body is None:
+            return 404, {}, "not found"
+        headers = {}
+        if etags:
+            headers["etag"] = '"%s"' % hashlib.sha1(body.encode()).hexdigest()
+            if if_none_match == headers["etag"]:
+                return 304, headers, ""
+        return 200, headers, body
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(str(request.url))
+        status, headers, body = await self._serve(request.url.path)
+        return httpx.Response(status, headers=headers, text=body)
+
+    async def asgi(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.requests.append(scope["path"])
+        request_headers = dict(scope["headers"])
+        if_none_match = request_headers.get(b"if-none-match", b"").decode() or None
+        status, headers, body = await self._serve(scope["path"], if_none_match, etags=True)
+        data = body.encode()
+        raw = [(k.encode(), v.encode()) for k, v in headers.items()]
+        raw += [(b"content-type", b"text/html; charset=utf-8"),
+                (b"content-length", str(len(data)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": raw})
+        await send({"type": "http.response.body", "body": data})
+
+    def client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
@@ -0,0 +1,69 @@
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import mongomock_motor
+from api import routes
+from crawler import crawler_manager
+from db import mongo
+from tests import mongomock_compat  # noqa: F401
+from tests.catalogue import CatalogueSite
+
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Point every collection the crawler and db layer use at mongomock."""
+    db = mongomock_motor.AsyncMongoMockClient()["testdb"]
+    for module in (mongo, crawler_manager, routes):
+        for name, value in list(vars(module).items()):
+            if name.endswith("_col"):
+                monkeypatch.setattr(module, name, db[value.name])
+    return db
+
+
+@pytest.fixture
+def stub_server():
+    """Serve a CatalogueSite over real HTTP, honouring If-None-Match."""
+    site = CatalogueSite(pages=2, per_page=5)
+    site.statuses = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like a real origin
+
+        def do_GET(self):
+            body = site.render(self.path)
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = '"%s"' % hashlib.sha1(body.encode()).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                site.statuses.append((self.path, 304))
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            data = body.encode()
+            site.statuses.append((self.path, 200))
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    site.base_url = f"http://127.0.0.1:{server.server_port}/catalogue"
+    yield site
+    server.shutdown()
+    server.server_close()
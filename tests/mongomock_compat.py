@@ -0,0 +1,20 @@
+"""
+Patches that let mongomock 4.3 stand in for Motor with current pymongo.
+
+Imported for its side effect by the test suite and the benchmarks.
+"""
+import functools
+from mongomock.collection import BulkOperationBuilder
+
+
+def _ignore_sort(method):
+    # pymongo >= 4.11 passes `sort=` to UpdateOne/ReplaceOne bulk ops, which
+    # mongomock 4.3 doesn't know about yet
+    @functools.wraps(method)
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+BulkOperationBuilder.add_update = _ignore_sort(BulkOperationBuilder.add_update)
+BulkOperationBuilder.add_replace = _ignore_sort(BulkOperationBuilder.add_replace)
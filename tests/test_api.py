@@ -0,0 +1,304 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from api import cache as api_cache, routes
+from api.auth import check_api_key
+from utils import cache
+
+
+@pytest.fixture
+def api(mock_db):
+    api_cache.reset_backend()
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[check_api_key] = lambda: "testkey"
+    return TestClient(app)
+
+
+def _insert_books(db, n):
+    books = [{"name": f"Book {i % 5}", "category": "Poetry" if i % 2 else "Travel",
+              "price_excl_vat": float(i % 7), "price_incl_vat": float(i % 7),
+              "rating": i % 5 + 1, "num_reviews": 0, "source_url": f"u{i}",
+              "crawl_timestamp": datetime(2025, 1, 1)}
+             for i in range(n)]
+    asyncio.run(db["books"].insert_many(books))
+
+
+def _walk(api, url):
+    seen, cursor = [], None
+    while True:
+        r = api.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert r.status_code == 200
+        seen += [b["id"] for b in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            return seen
+
+
+@pytest.mark.parametrize("sort_by", ["name", "price_excl_vat", "rating"])
+def test_books_cursor_walk_is_complete_and_stable(api, mock_db, sort_by):
+    _insert_books(mock_db, 53)
+    ids = _walk(api, f"/books?sort_by={sort_by}&page_size=10")
+    assert len(ids) == 53
+    assert len(set(ids)) == 53
+    # same order as one big page
+    assert ids == [b["id"] for b in api.get(f"/books?sort_by={sort_by}&page_size=200").json()]
+
+
+def test_books_cursor_respects_filters(api, mock_db):
+    _insert_books(mock_db, 40)
+    ids = _walk(api, "/books?category=Poetry&min_price=2&page_size=3")
+    assert len(ids) == asyncio.run(mock_db["books"].count_documents(
+        {"category": "Poetry", "price_excl_vat": {"$gte": 2}}))
+
+
+def test_bad_cursor_is_rejected(api, mock_db):
+    assert api.get("/books?cursor=not-a-cursor").status_code == 400
+
+
+def test_cursor_only_works_for_its_own_query(api, mock_db):
+    _insert_books(mock_db, 10)
+    cursor = api.get("/books?sort_by=name&page_size=3").headers["X-Next-Cursor"]
+    assert api.get(f"/books?sort_by=name&page_size=3&cursor={cursor}").status_code == 200
+    for other in ("sort_by=price_excl_vat", "sort_by=name&category=Poetry"):
+        r = api.get(f"/books?{other}&page_size=3&cursor={cursor}")
+        assert r.status_code == 400 and "different sort" in r.json()["detail"]
+
+
+def test_changes_since_polls_new_changes(api, mock_db):
+    start = datetime(2025, 1, 1)
+    changes = mock_db["changes"]
+    asyncio.run(changes.insert_many([{"book_id": ObjectId(), "change_type": "new",
+                                      "when": start + timedelta(minutes=i)} for i in range(5)]))
+
+    r = api.get("/changes?limit=2")
+    assert [c["when"] for c in r.json()] == [(start + timedelta(minutes=m)).isoformat() for m in (4, 3)]
+    older = api.get(f"/changes?limit=2&cursor={r.headers['X-Next-Cursor']}").json()
+    assert [c["when"][-5:] for c in older] == ["02:00", "01:00"]
+
+    since = r.headers["X-Since-Cursor"]
+    r = api.get(f"/changes?since={since}")
+    assert r.json() == []
+    assert r.headers["X-Since-Cursor"] == since
+
+    asyncio.run(changes.insert_many([{"book_id": ObjectId(), "change_type": "updated",
+                                      "when": start + timedelta(minutes=10 + i)} for i in range(2)]))
+    r = api.get(f"/changes?since={since}")
+    assert [c["change_type"] for c in r.json()] == ["updated", "updated"]
+    assert api.get(f"/changes?since={r.headers['X-Since-Cursor']}").json() == []
+
+
+def test_books_are_cached_until_the_crawler_bumps_the_generation(api, mock_db):
+    _insert_books(mock_db, 3)
+    assert len(api.get("/books").json()) == 3
+
+    _insert_books(mock_db, 2)  # written behind the cache's back
+    assert len(api.get("/books").json()) == 3
+
+    asyncio.run(cache.bump_generation())
+    assert len(api.get("/books").json()) == 5
+
+
+def test_etag_revalidation(api, mock_db):
+    _insert_books(mock_db, 3)
+    book_id = api.get("/books").json()[0]["id"]
+
+    for url in ("/books?category=Poetry", f"/books/{book_id}"):
+        first = api.get(url)
+        etag = first.headers["ETag"]
+        again = api.get(url, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert api.get(url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_cache_key_ignores_param_order_and_unset_values():
+    a = api_cache.cache_key("books", {"category": "Poetry", "rating": None, "page": 1}, 0)
+    b = api_cache.cache_key("books", {"page": 1, "category": "Poetry"}, 0)
+    assert a == b
+    assert a != api_cache.cache_key("books", {"page": 1, "category": "Poetry"}, 1)
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_evicts_and_expires():
+    lru = cache.LRUCache(maxsize=2, ttl=60)
+    await lru.set("a", 1)
+    await lru.set("b", 2)
+    await lru.get("a")
+    await lru.set("c", 3)
+    assert await lru.get("b") is None
+    assert await lru.get("a") == 1
+
+    short = cache.LRUCache(maxsize=2, ttl=-1)
+    await short.set("a", 1)
+    assert await short.get("a") is None
+
+
+def test_export_books_streams_ndjson_with_filters(api, mock_db, monkeypatch):
+    monkeypatch.setattr(routes.appsettings, "EXPORT_BATCH_SIZE", 4)
+    _insert_books(mock_db, 25)
+    r = api.get("/export/books?category=Poetry&min_price=2")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert len(rows) == asyncio.run(mock_db["books"].count_documents(
+        {"category": "Poetry", "price_excl_vat": {"$gte": 2}}))
+    assert list(rows[0]) == routes.EXPORT_BOOK_FIELDS
+    assert rows == sorted(rows, key=lambda b: b["id"])
+
+
+def test_export_books_since_counts_unchanged_recrawls(api, mock_db):
+    start = datetime(2025, 1, 1)
+    asyncio.run(mock_db["books"].insert_many([
+        {"name": "stale", "source_url": "u0", "crawl_timestamp": start, "last_seen": start},
+        {"name": "seen", "source_url": "u1", "crawl_timestamp": start,
+         "last_seen": start + timedelta(days=2)},
+    ]))
+    r = api.get(f"/export/books?since={(start + timedelta(days=1)).isoformat()}")
+    assert [json.loads(line)["name"] for line in r.text.splitlines()] == ["seen"]
+
+
+def test_export_changes_as_csv_since(api, mock_db):
+    start = datetime(2025, 1, 1)
+    asyncio.run(mock_db["changes"].insert_many([
+        {"book_id": ObjectId(), "change_type": "updated", "source_url": f"u{i}",
+         "when": start + timedelta(minutes=i), "details": {"price_incl_vat": {"old": 1, "new": i}}}
+        for i in range(5)]))
+    r = api.get(f"/export/changes?format=csv&since={(start + timedelta(minutes=2)).isoformat()}")
+    assert r.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row["source_url"] for row in rows] == ["u2", "u3", "u4"]
+    assert json.loads(rows[0]["details"]) == {"price_incl_vat": {"old": 1, "new": 2}}
+
+
+def test_stats_reads_the_summary(api, mock_db):
+    asyncio.run(mock_db["category_stats"].insert_many([
+        {"_id": "Travel", "count": 2, "price_sum": 30.0, "price_count": 2,
+         "price_min": 10.0, "price_max": 20.0, "ratings": {"5": 2, "1": 0}},
+        {"_id": "Poetry", "count": 1, "price_sum": 7.5, "price_count": 1,
+         "price_min": 7.5, "price_max": 7.5, "ratings": {"3": 1}},
+    ]))
+    body = api.get("/stats").json()
+    assert [c["category"] for c in body["categories"]] == ["Poetry", "Travel"]
+    assert body["total"] == 3
+    travel = body["categories"][1]
+    assert travel["price_avg"] == 15.0
+    assert travel["ratings"] == {"5": 2}
+    assert api.get("/stats?category=Poetry").json()["total"] == 1
+
+
+@pytest.fixture
+def memory_search(monkeypatch):
+    monkeypatch.setattr(routes.search.appsettings, "SEARCH_BACKEND", "memory")
+    monkeypatch.setattr(routes.search, "_memory_index", None)
+
+
+def test_search_ranks_name_matches_first(api, mock_db, memory_search):
+    asyncio.run(mock_db["books"].insert_many([
+        {"name": "Ocean Tales", "description": "Stories about ships.", "source_url": "a"},
+        {"name": "Mountain Walks", "description": "Not the ocean, the hills.", "source_url": "b"},
+        {"name": "Desert Roads", "description": "Sand.", "source_url": "c"},
+    ]))
+    hits = api.get("/books/search?q=ocean").json()
+    assert [h["name"] for h in hits] == ["Ocean Tales", "Mountain Walks"]
+    assert hits[0]["score"] > hits[1]["score"]
+    assert api.get("/books/search?q=the").json() == []
+
+
+def test_search_cursor_walk(api, mock_db, memory_search):
+    asyncio.run(mock_db["books"].insert_many([
+        {"name": f"Poems {'volume ' * (i % 4)}{i}", "description": "poems", "source_url": f"u{i}"}
+        for i in range(23)]))
+    seen, cursor = [], None
+    while True:
+        r = api.get("/books/search?q=poems&page_size=5" + (f"&cursor={cursor}" if cursor else ""))
+        seen += r.json()
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert len({h["id"] for h in seen}) == 23
+    assert [h["score"] for h in seen] == sorted((h["score"] for h in seen), reverse=True)
+
+
+def test_book_history_range(api, mock_db):
+    book = ObjectId()
+    asyncio.run(mock_db["price_history"].insert_many([
+        {"book_id": book, "month": datetime(2025, 1, 1), "count": 2,
+         "t": [datetime(2025, 1, 5), datetime(2025, 1, 20)],
+         "price_incl_vat": [10.0, 11.0], "price_excl_vat": [10.0, 11.0],
+         "availability": ["In stock", "In stock"], "num_reviews": [0, 1]},
+        {"book_id": book, "month": datetime(2025, 2, 1), "count": 1,
+         "t": [datetime(2025, 2, 3)], "price_incl_vat": [9.5], "price_excl_vat": [9.5],
+         "availability": ["Out of stock"], "num_reviews": [1]},
+    ]))
+    body = api.get(f"/books/{book}/history").json()
+    assert body["book_id"] == str(book)
+    assert [p["price_incl_vat"] for p in body["points"]] == [10.0, 11.0, 9.5]
+
+    body = api.get(f"/books/{book}/history?from=2025-01-10T00:00:00Z&to=2025-02-28").json()
+    assert [p["availability"] for p in body["points"]] == ["In stock", "Out of stock"]
+    assert api.get(f"/books/{book}/history?from=2025-03-01&to=2025-02-01").status_code == 400
+    assert api.get("/books/nope/history").status_code == 404
+
+
+def test_books_fields_projection(api, mock_db):
+    _insert_books(mock_db, 12)
+    first = api.get("/books?page_size=5").json()[0]
+    assert list(first) == ["id", "name", "category", "price_excl_vat", "price_incl_vat", "rating"]
+
+    ids = _walk(api, "/books?sort_by=rating&page_size=5&fields=name,source_url")
+    assert len(set(ids)) == 12
+    page = api.get("/books?sort_by=rating&fields=source_url,name").json()
+    assert all(list(b) == ["id", "source_url", "name"] for b in page)
+    assert api.get("/books?fields=raw_html").status_code == 400
+
+
+def test_book_fields_and_no_raw_html(api, mock_db):
+    book = ObjectId()
+    asyncio.run(mock_db["books"].insert_one({
+        "_id": book, "name": "A", "price_incl_vat": 3.0, "raw_html": "<html>",
+        "crawl_timestamp": datetime(2025, 1, 1)}))
+    full = api.get(f"/books/{book}").json()
+    assert "raw_html" not in full and full["crawl_timestamp"] == "2025-01-01T00:00:00"
+    assert api.get(f"/books/{book}?fields=price_incl_vat").json() == {
+        "_id": str(book), "price_incl_vat": 3.0}
+    assert api.get(f"/books/{book}?fields=id").json() == {"_id": str(book)}
+    assert api.get("/books/nothex").status_code == 404
+
+
+def test_books_batch(api, mock_db, monkeypatch):
+    _insert_books(mock_db, 5)
+    books = asyncio.run(mock_db["books"].find().sort("source_url", 1).to_list(None))
+    unknown = str(ObjectId())
+    r = api.post("/books/batch?fields=source_url", json={
+        "ids": [str(books[3]["_id"]), unknown, str(books[1]["_id"])],
+        "source_urls": ["u4", "nope"]})
+    assert r.status_code == 200
+    assert r.json() == {
+        "books": [{"id": str(books[3]["_id"]), "source_url": "u3"},
+                  {"id": str(books[1]["_id"]), "source_url": "u1"},
+                  {"id": str(books[4]["_id"]), "source_url": "u4"}],
+        "missing": [unknown, "nope"]}
+
+    assert api.post("/books/batch", json={"ids": ["bad"]}).status_code == 400
+    monkeypatch.setattr(routes.appsettings, "BOOKS_BATCH_MAX", 2)
+    assert api.post("/books/batch", json={"source_urls": ["a", "b", "c"]}).status_code == 400
+    assert api.post("/books/batch", json={}).json() == {"books": [], "missing": []}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_handles_mongo_values(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(api_cache, "orjson", None)
+    elif api_cache.orjson is None:
+        pytest.skip("orjson not installed")
+    _id = ObjectId()
+    payload = {"_id": _id, "when": datetime(2025, 1, 2, 3, 4, 5), "n": [1, 2.5, None], "s": "é"}
+    assert json.loads(api_cache.dumps(payload)) == {
+        "_id": str(_id), "when": "2025-01-02T03:04:05", "n": [1, 2.5, None], "s": "é"}
@@ -0,0 +1,76 @@
+import asyncio
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from api import auth
+from utils.config import appsettings
+
+KEY = appsettings.API_KEYS[0]
+
+
+def _request(key=KEY):
+    headers = [(b"x-api-key", key.encode())] if key else []
+    return Request({"type": "http", "headers": headers})
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(auth, "_redis_client", client)
+    monkeypatch.setattr(auth, "_bucket_script", None)
+    monkeypatch.setattr(auth, "_blocked_until", {})
+    monkeypatch.setattr(appsettings, "RATE_LIMIT_PER_HOUR", 5)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_unknown_key_is_rejected(redis_client):
+    with pytest.raises(HTTPException) as exc:
+        await auth.check_api_key(_request("nope"))
+    assert exc.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_bucket_runs_dry_then_sets_retry_after(redis_client):
+    for _ in range(5):
+        assert await auth.check_api_key(_request()) == KEY
+    with pytest.raises(HTTPException) as exc:
+        await auth.check_api_key(_request())
+    assert exc.value.status_code == 429
+    # one token every 720s at 5/hour
+    assert 700 <= int(exc.value.headers["Retry-After"]) <= 720
+    assert 0 < await redis_client.ttl(f"rate_limit:{KEY}") <= auth.BUCKET_TTL
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_cannot_overspend(redis_client):
+    results = await asyncio.gather(*(auth.check_api_key(_request()) for _ in range(20)),
+                                   return_exceptions=True)
+    assert sum(r == KEY for r in results) == 5
+    assert all(r.status_code == 429 for r in results if r != KEY)
+
+
+@pytest.mark.asyncio
+async def test_precheck_skips_redis_for_empty_bucket(redis_client, monkeypatch):
+    for _ in range(6):
+        try:
+            await auth.check_api_key(_request())
+        except HTTPException:
+            pass
+    calls = []
+    monkeypatch.setattr(auth, "take_token", lambda key: calls.append(key))
+    with pytest.raises(HTTPException) as exc:
+        await auth.check_api_key(_request())
+    assert exc.value.status_code == 429
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_redis_failure_is_503(redis_client, monkeypatch):
+    async def broken(key):
+        raise ConnectionError("down")
+    monkeypatch.setattr(auth, "take_token", broken)
+    with pytest.raises(HTTPException) as exc:
+        await auth.check_api_key(_request())
+    assert exc.value.status_code == 503
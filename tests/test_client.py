@@ -0,0 +1,33 @@
+import pytest
+from crawler import client as crawl_client
+from crawler.client import build_client, fetch, get_client, pool_stats
+from utils.config import appsettings
+
+
+def test_build_client_applies_limits_and_timeouts():
+    client = build_client()
+    pool = client._transport._pool
+    assert pool._max_connections == appsettings.HTTP_MAX_CONNECTIONS
+    assert pool._max_keepalive_connections == appsettings.HTTP_MAX_KEEPALIVE
+    assert client.timeout.connect == appsettings.CRAWL_CONNECT_TIMEOUT
+    assert client.timeout.read == appsettings.CRAWL_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_shared_client_is_reused_until_closed():
+    first = get_client()
+    assert get_client() is first
+    await crawl_client.close_client()
+    assert get_client() is not first
+    await crawl_client.close_client()
+
+
+@pytest.mark.asyncio
+async def test_keep_alive_connection_is_reused(stub_server):
+    async with build_client() as client:
+        for page in (1, 2, 1):
+            await fetch(f"{stub_server.base_url}/page-{page}.html", client)
+        stats = pool_stats(client)
+
+    assert stats["connections"] == 1
+    assert stats["idle"] == 1
@@ -0,0 +1,181 @@
+import asyncio
+import pytest
+from crawler import crawler_manager, executor
+from crawler.crawler_manager import Crawler
+from crawler.hash_index import HashIndex
+from tests.catalogue import CatalogueSite, BASE_URL
+from utils.config import appsettings
+
+
+@pytest.mark.asyncio
+async def test_crawl_inserts_every_book(mock_db):
+    site = CatalogueSite(pages=3, per_page=5)
+    async with site.client() as client:
+        await Crawler(BASE_URL, concurrency=4).crawl(site.start_url, client=client)
+
+    assert await mock_db["books"].count_documents({}) == 15
+    assert await mock_db["changes"].count_documents({"change_type": "new"}) == 15
+
+
+@pytest.mark.asyncio
+async def test_crawl_keeps_workers_busy_across_pages(mock_db):
+    # three books per listing page: the old page-by-page gather could never
+    # have more than three requests in flight here
+    site = CatalogueSite(pages=8, per_page=3, latency=0.02)
+    async with site.client() as client:
+        await Crawler(BASE_URL, concurrency=4).crawl(site.start_url, client=client)
+
+    assert await mock_db["books"].count_documents({}) == 24
+    assert site.max_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_queue(mock_db):
+    site = CatalogueSite(pages=5, per_page=10, latency=0.01)
+    crawler = Crawler(BASE_URL, concurrency=2, queue_size=5)
+
+    async def stop_soon():
+        while len(site.requests) < 4:
+            await asyncio.sleep(0.005)
+        await crawler.stop()
+
+    async with site.client() as client:
+        await asyncio.gather(crawler.crawl(site.start_url, client=client), stop_soon())
+
+    assert crawler.queue.empty()
+    assert await mock_db["books"].count_documents({}) < 50
+
+
+@pytest.mark.asyncio
+async def test_writes_are_batched(mock_db):
+    site = CatalogueSite(pages=2, per_page=10)
+    crawler = Crawler(BASE_URL, concurrency=4)
+    async with site.client() as client:
+        await crawler.crawl(site.start_url, client=client)
+
+    # 20 books, default batch size: a single flush at the end of the crawl
+    assert crawler.writer.flushes == 1
+    assert await mock_db["books"].count_documents({}) == 20
+    change = await mock_db["changes"].find_one({})
+    assert await mock_db["books"].find_one({"_id": change["book_id"]})
+
+
+class FlakyBooks:
+    """The books collection, with its first `bulk_write` failing."""
+
+    def __init__(self, col):
+        self.col = col
+        self.failed = 0
+
+    async def bulk_write(self, ops, **kwargs):
+        if not self.failed:
+            self.failed += 1
+            raise ConnectionError("primary stepped down")
+        return await self.col.bulk_write(ops, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.col, name)
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_its_batch(mock_db, monkeypatch):
+    books = FlakyBooks(mock_db["books"])
+    monkeypatch.setattr(crawler_manager, "books_col", books)
+    monkeypatch.setattr(appsettings, "CRAWL_WRITE_BATCH", 5)
+    site = CatalogueSite(pages=2, per_page=10)
+    crawler = Crawler(BASE_URL, concurrency=4)
+    async with site.client() as client:
+        await crawler.crawl(site.start_url, client=client)
+
+    assert books.failed == 1
+    assert await mock_db["books"].count_documents({}) == 20
+    assert await mock_db["changes"].count_documents({"change_type": "new"}) == 20
+    assert set(crawler.frontier.states.values()) == {crawler_manager.DONE}
+    stats = [s async for s in mock_db["category_stats"].find({})]
+    assert sum(s["count"] for s in stats) == 20
+
+
+@pytest.mark.asyncio
+async def test_update_records_one_change_with_all_diffs(mock_db):
+    site = CatalogueSite(pages=1, per_page=3)
+    async with site.client() as client:
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+        slug = next(iter(site.prices))
+        site.prices[slug] = 42.0
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+
+    changes = [c async for c in mock_db["changes"].find({"change_type": "updated"})]
+    assert len(changes) == 1
+    assert set(changes[0]["details"]) == {"price_incl_vat", "price_excl_vat"}
+    book = await mock_db["books"].find_one({"source_url": site.book_url(slug)})
+    assert book["price_excl_vat"] == 42.0
+
+
+@pytest.mark.asyncio
+async def test_unchanged_pages_are_not_parsed(mock_db, monkeypatch):
+    site = CatalogueSite(pages=2, per_page=5)
+    async with site.client() as client:
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+        parsed = []
+        real_parse_book = executor.parse_book
+        monkeypatch.setattr(executor, "parse_book",
+                            lambda html, base: parsed.append(1) or real_parse_book(html, base))
+        slug = next(iter(site.prices))
+        site.prices[slug] = 1.0
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+
+    assert len(parsed) == 1
+    assert await mock_db["changes"].count_documents({"change_type": "updated"}) == 1
+    assert await mock_db["books"].count_documents({"last_seen": {"$exists": True}}) == 10
+
+
+@pytest.mark.asyncio
+async def test_hash_index_load(mock_db):
+    await mock_db["books"].insert_one({
+        "source_url": "https://example.com/b", "content_hash": "ab" * 32,
+        "last_modified": "Thu, 01 Jan 1970 00:00:00 GMT", "raw_html": "<html/>"})
+    index = await HashIndex.load(mock_db["books"])
+
+    entry = index.get("https://example.com/b")
+    assert entry.digest == bytes.fromhex("ab" * 32)
+    assert index.validators("https://example.com/b") == (None, "Thu, 01 Jan 1970 00:00:00 GMT")
+    assert "https://example.com/other" not in index
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["thread", "process"])
+async def test_crawl_with_parse_pool(mock_db, mode):
+    site = CatalogueSite(pages=2, per_page=5)
+    pool = executor.ParseExecutor(mode, workers=2)
+    try:
+        async with site.client() as client:
+            await Crawler(BASE_URL, executor=pool).crawl(site.start_url, client=client)
+    finally:
+        pool.close()
+
+    assert await mock_db["books"].count_documents({}) == 10
+
+
+@pytest.mark.asyncio
+async def test_incremental_crawl_only_fetches_changed_entries(mock_db):
+    site = CatalogueSite(pages=3, per_page=5)
+    async with site.client() as client:
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+        slug = list(site.prices)[7]  # second listing page
+        site.prices[slug] = 77.0
+        site.requests.clear()
+        await Crawler(BASE_URL, incremental=True).crawl(site.start_url, client=client)
+
+    books_fetched = [u for u in site.requests if "page-" not in u]
+    assert books_fetched == [site.book_url(slug)]
+    assert await mock_db["changes"].count_documents({"change_type": "updated"}) == 1
+    assert await mock_db["listings"].count_documents({}) == 3
+
+
+@pytest.mark.asyncio
+async def test_incremental_crawl_fetches_everything_first_time(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    async with site.client() as client:
+        await Crawler(BASE_URL, incremental=True).crawl(site.start_url, client=client)
+
+    assert await mock_db["books"].count_documents({}) == 10
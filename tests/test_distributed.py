@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from crawler import distributed, runs
+from crawler.crawler_manager import Crawler
+from crawler.writer import BookWriter
+from crawler.distributed import LeasedFrontier
+from crawler.frontier import BOOK, DONE, LISTING, PENDING
+from db.history import PriceHistory
+from db.stats import CategoryStats
+from tests.catalogue import CatalogueSite, BASE_URL
+
+
+@pytest.mark.asyncio
+async def test_leases_are_exclusive_until_they_expire(mock_db):
+    col = mock_db["frontier"]
+    a = LeasedFrontier("run-1", col, owner="a", lease_seconds=60)
+    b = LeasedFrontier("run-1", col, owner="b", lease_seconds=60)
+    await a.add([f"b{i}" for i in range(5)], BOOK)
+
+    got_a = await a.lease(BOOK, 3)
+    got_b = await b.lease(BOOK, 10)
+    assert len(got_a) == 3 and len(got_b) == 2
+    assert not set(got_a) & set(got_b)
+    assert await b.lease(BOOK, 10) == []
+
+    # a dies: once its lease runs out b picks the work up
+    await col.update_many({"lease_owner": "a"},
+                          {"$set": {"lease_until": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert sorted(await b.lease(BOOK, 10)) == sorted(got_a)
+
+
+@pytest.mark.asyncio
+async def test_workers_share_a_run(mock_db):
+    site = CatalogueSite(pages=3, per_page=10, latency=0.002)
+    col = mock_db["frontier"]
+    coordinator = LeasedFrontier("run-1", col, owner="coordinator")
+    await coordinator.add([site.start_url], LISTING)
+
+    async with site.client() as client:
+        async def worker(owner):
+            crawler = Crawler(BASE_URL, concurrency=3)
+            await crawler.crawl_leased(LeasedFrontier("run-1", col, owner=owner),
+                                       client=client, poll=0.01)
+
+        published, *_ = await asyncio.gather(
+            distributed.publish_listings(coordinator, BASE_URL, client),
+            worker("w1"), worker("w2"))
+
+    assert published == 30
+    assert await mock_db["books"].count_documents({}) == 30
+    assert len([u for u in site.requests if "page-" not in u]) == 30
+    view = await distributed.progress("run-1", col)
+    assert view["books"] == {DONE: 30}
+    assert view["listings"] == {DONE: 3}
+    assert sum(view["done_by"].values()) == 30
+    assert view["leased"] == {}
+    assert await coordinator.exhausted()
+
+
+@pytest.mark.asyncio
+async def test_a_book_inserted_twice_counts_once(mock_db):
+    doc = {"name": "A", "category": "Poetry", "price_excl_vat": 3.0,
+           "source_url": "u1", "crawl_timestamp": datetime.now(timezone.utc)}
+    change = {"source_url": "u1", "change_type": "new", "when": doc["crawl_timestamp"]}
+
+    def writer():
+        return BookWriter(mock_db["books"], mock_db["changes"],
+                          stats=CategoryStats(mock_db["category_stats"]),
+                          history=PriceHistory(mock_db["price_history"]))
+
+    # two workers, one after the other, and twice within one batch
+    for _ in range(2):
+        async with writer() as w:
+            await w.insert(dict(doc), dict(change))
+    async with writer() as w:
+        await w.insert(dict(doc), dict(change))
+        await w.insert(dict(doc), dict(change))
+
+    book = await mock_db["books"].find_one({})
+    assert await mock_db["books"].count_documents({}) == 1
+    assert [c["book_id"] async for c in mock_db["changes"].find({})] == [book["_id"]]
+    assert [h["book_id"] async for h in mock_db["price_history"].find({})] == [book["_id"]]
+    assert (await mock_db["category_stats"].find_one({"_id": "Poetry"}))["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_workers_lease_no_more_than_they_can_work_and_renew(mock_db):
+    col = mock_db["frontier"]
+    frontier = LeasedFrontier("run-1", col, owner="w", lease_seconds=0.3)
+    await frontier.add([f"b{i}" for i in range(10)], BOOK)
+    crawler = Crawler(BASE_URL, concurrency=2)
+    seen, working = [], set()
+
+    async def slow_book(client, url):
+        working.add(url)
+        seen.append(await col.count_documents({"lease_owner": "w"}))
+        await asyncio.sleep(0.4)  # outlives the lease
+
+    crawler._fetch_parse_book = slow_book
+    task = asyncio.create_task(crawler.crawl_leased(frontier, client=object(), poll=0.01))
+    await asyncio.sleep(0.35)
+    # still ours, though the first lease is already over
+    other = LeasedFrontier("run-1", col, owner="other", lease_seconds=60)
+    leased = await other.lease(BOOK, 10)
+    await crawler.stop()
+    await task
+    assert max(seen) <= 2
+    assert working and not set(leased) & working
+
+
+class DeadProc:
+    returncode = 1
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+    def wait(self):
+        return self.returncode
+
+
+@pytest.mark.asyncio
+async def test_run_fails_once_every_local_worker_is_gone(mock_db, monkeypatch):
+    site = CatalogueSite(pages=1, per_page=5)
+    monkeypatch.setattr(distributed, "spawn_workers", lambda run_id, count: [DeadProc()] * count)
+    async with site.client() as client:
+        run_id = await asyncio.wait_for(
+            distributed.coordinate(BASE_URL, workers=2, report_every=0.01, client=client), 2)
+
+    run = await mock_db["crawl_runs"].find_one({"_id": run_id})
+    assert run["status"] == runs.FAILED
+    assert "exited with work left" in run["error"]
+    assert run["progress"]["books"] == {PENDING: 5}
@@ -0,0 +1,138 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import fakeredis
+import pytest
+from bson import ObjectId
+from api import routes
+from crawler.crawler_manager import Crawler
+from tests.catalogue import CatalogueSite, BASE_URL
+from utils import events
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = events.ChangeHub()
+    monkeypatch.setattr(events, "hub", hub)
+    monkeypatch.setattr(events, "_redis", None)
+    return hub
+
+
+def _change(category="Poetry", change_type="updated", minutes=0):
+    return {"_id": ObjectId(), "book_id": ObjectId(), "source_url": "u",
+            "category": category, "change_type": change_type,
+            "when": datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes),
+            "details": {"price_incl_vat": {"old": 1.0, "new": 2.0}}}
+
+
+def _data(frame: str) -> dict:
+    return json.loads(frame.split("data: ", 1)[1])
+
+
+async def _next_frames(body, n):
+    return [await asyncio.wait_for(anext(body), 1) for _ in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_hub_filters_and_cuts_off_slow_subscribers(hub):
+    poetry = hub.subscribe(categories=["Poetry"], maxsize=10)
+    new_only = hub.subscribe(change_types=["new"], maxsize=10)
+    slow = hub.subscribe(maxsize=2)
+
+    await events.publish([_change("Poetry"), _change("Travel", "new"), _change("Travel")])
+
+    assert poetry.queue.qsize() == 1
+    assert new_only.queue.qsize() == 1
+    assert slow.overflowed and slow.queue.get_nowait() is events.OVERFLOW
+    key, frame = poetry.queue.get_nowait()
+    assert frame.startswith(f"id: {key[1]}\nevent: change\n")
+    assert _data(frame)["category"] == "Poetry"
+
+
+@pytest.mark.asyncio
+async def test_stream_is_live_and_resumes_from_last_event_id(hub, mock_db):
+    stored = [_change(minutes=i) for i in range(3)] + [_change("Travel", minutes=3)]
+    await mock_db["changes"].insert_many([dict(c) for c in stored])
+
+    response = await routes.stream_changes(category=["Poetry"], change_type=None,
+                                           last_event_id=str(stored[0]["_id"]))
+    body = response.body_iterator
+    retry, *replayed = await _next_frames(body, 3)
+    assert retry.startswith("retry:")
+    assert [_data(f)["id"] for f in replayed] == [str(c["_id"]) for c in stored[1:3]]
+
+    # published again while replaying: not sent twice; new ones go out live
+    live = _change(minutes=10)
+    await events.publish([stored[2], _change("Travel", minutes=11), live])
+    [frame] = await _next_frames(body, 1)
+    assert _data(frame)["id"] == str(live["_id"])
+    assert len(hub.subscribers) == 1
+    await body.aclose()
+    assert not hub.subscribers
+
+
+@pytest.mark.asyncio
+async def test_overflowed_stream_ends(hub, mock_db, monkeypatch):
+    monkeypatch.setattr(events.appsettings, "CHANGE_STREAM_QUEUE", 1)
+    response = await routes.stream_changes(category=None, change_type=None, last_event_id=None)
+    body = response.body_iterator
+    await _next_frames(body, 1)
+    await events.publish([_change(minutes=i) for i in range(3)])
+    with pytest.raises(StopAsyncIteration):
+        await anext(body)
+    assert not hub.subscribers
+
+
+@pytest.mark.asyncio
+async def test_events_cross_processes_through_redis(hub, monkeypatch):
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    sub = hub.subscribe()
+    listener = asyncio.create_task(events.listen(redis))
+    try:
+        await asyncio.sleep(0.05)  # let it subscribe
+        monkeypatch.setattr(events, "_redis", redis)
+        change = _change()
+        await events.publish([change])
+        key, frame = await asyncio.wait_for(sub.queue.get(), 1)
+        assert key == (change["when"], change["_id"])
+    finally:
+        listener.cancel()
+
+
+@pytest.mark.asyncio
+async def test_crawl_finished_reaches_other_processes(hub, monkeypatch):
+    finished = []
+
+    async def handler(run_id):
+        finished.append(run_id)
+
+    monkeypatch.setattr(events, "_crawl_handlers", [handler])
+    await events.crawl_finished("local")
+    assert finished == ["local"]
+
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    listener = asyncio.create_task(events.listen(redis))
+    try:
+        await asyncio.sleep(0.05)
+        monkeypatch.setattr(events, "_redis", redis)
+        await events.crawl_finished("remote")
+        for _ in range(100):
+            if len(finished) > 1:
+                break
+            await asyncio.sleep(0.01)
+        assert finished == ["local", "remote"]
+    finally:
+        listener.cancel()
+
+
+@pytest.mark.asyncio
+async def test_crawl_publishes_its_changes(hub, mock_db):
+    sub = hub.subscribe(maxsize=100)
+    site = CatalogueSite(pages=2, per_page=5)
+    async with site.client() as client:
+        await Crawler(BASE_URL, concurrency=4).crawl(site.start_url, client=client)
+
+    sent = [_data(sub.queue.get_nowait()[1]) for _ in range(sub.queue.qsize())]
+    assert len(sent) == 10 == await mock_db["changes"].count_documents({})
+    assert {e["change_type"] for e in sent} == {"new"}
+    assert {e["category"] for e in sent} == {"Poetry"}
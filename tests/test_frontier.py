@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+import pytest
+from crawler import runs
+from crawler.crawler_manager import Crawler
+from crawler.frontier import CrawlFrontier, DONE, FAILED, LISTING, PENDING
+from tests.catalogue import CatalogueSite, BASE_URL
+
+
+@pytest.mark.asyncio
+async def test_frontier_checkpoints_and_reloads(mock_db):
+    frontier = CrawlFrontier("run-1", mock_db["frontier"])
+    await frontier.add(["l1"], LISTING)
+    await frontier.add(["b1", "b2", "b3"], "book")
+    await frontier.mark(["l1", "b1"], DONE)
+    await frontier.mark(["b2"], FAILED)
+
+    restored = CrawlFrontier("run-1", mock_db["frontier"])
+    books = await restored.load()
+
+    assert sorted(books) == ["b2", "b3"]
+    assert list(restored.listings) == []
+    assert restored.counts() == {PENDING: 1, DONE: 2, FAILED: 1}
+    failed = await mock_db["frontier"].find_one({"url": "b2"})
+    assert failed["attempts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_interrupted_crawl_resumes_without_refetching(mock_db):
+    site = CatalogueSite(pages=4, per_page=5, latency=0.005)
+    crawler = Crawler(BASE_URL, concurrency=2, queue_size=3)
+
+    async def interrupt():
+        while len(site.requests) < 8:
+            await asyncio.sleep(0.002)
+        await crawler.stop()
+
+    async with site.client() as client:
+        await asyncio.gather(
+            crawler.crawl(site.start_url, client=client,
+                          frontier=CrawlFrontier("run-1", mock_db["frontier"])),
+            interrupt())
+        fetched_books = {u for u in site.requests if "page-" not in u}
+        site.requests.clear()
+        assert await mock_db["books"].count_documents({}) < 20
+
+        await Crawler(BASE_URL, concurrency=2).crawl(
+            site.start_url, client=client,
+            frontier=CrawlFrontier("run-1", mock_db["frontier"]))
+
+    assert await mock_db["books"].count_documents({}) == 20
+    assert site.start_url not in site.requests
+    assert not fetched_books & set(site.requests)
+    assert await mock_db["frontier"].count_documents({"state": {"$ne": DONE}}) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_books_get_a_retry_pass(mock_db):
+    site = CatalogueSite(pages=1, per_page=3)
+    flaky = site.book_url(next(iter(site.prices)))
+    failures = []
+
+    async def handler(request):
+        if str(request.url) == flaky and not failures:
+            failures.append(request)
+            return httpx.Response(404)
+        return await site.handler(request)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        frontier = CrawlFrontier()
+        await Crawler(BASE_URL).crawl(site.start_url, client=client, frontier=frontier)
+
+    assert failures
+    assert await mock_db["books"].count_documents({}) == 3
+    assert frontier.counts()[FAILED] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_crawl_is_due_after_interval(mock_db):
+    assert await runs.choose_mode(7) == runs.FULL
+    run_id = await runs.start_run("start", mode=runs.FULL)
+    await runs.finish_run(run_id, runs.FINISHED)
+    assert await runs.choose_mode(7) == runs.INCREMENTAL
+
+    old = datetime.now(timezone.utc) - timedelta(days=8)
+    await mock_db["crawl_runs"].update_one({"_id": run_id}, {"$set": {"started": old}})
+    assert await runs.choose_mode(7) == runs.FULL
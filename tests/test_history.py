@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+import pytest
+from bson import ObjectId
+from crawler.crawler_manager import Crawler
+from db import history
+from tests.catalogue import CatalogueSite, BASE_URL
+
+
+def _at(month, day):
+    return datetime(2025, month, day, tzinfo=timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_points_land_in_monthly_buckets(mock_db):
+    col = mock_db["price_history"]
+    book = ObjectId()
+    h = history.PriceHistory(col)
+    for month, day, price in [(1, 5, 10.0), (1, 20, 11.0), (2, 3, 9.5)]:
+        h.record(book, _at(month, day), {"price_incl_vat": price, "price_excl_vat": price,
+                                         "availability": "In stock", "num_reviews": 0})
+    await h.flush()
+    h.record(book, _at(2, 10), {"price_incl_vat": 9.0})
+    await h.flush()
+
+    buckets = [b async for b in col.find({"book_id": book}).sort("month", 1)]
+    assert [b["count"] for b in buckets] == [2, 2]
+    assert buckets[1]["price_incl_vat"] == [9.5, 9.0]
+    assert buckets[1]["availability"] == ["In stock", None]
+
+    points = await history.read(col, book)
+    assert [p["price_incl_vat"] for p in points] == [10.0, 11.0, 9.5, 9.0]
+    points = await history.read(col, book, start=_at(1, 10), end=_at(2, 5))
+    assert [p["price_incl_vat"] for p in points] == [11.0, 9.5]
+    assert await history.read(col, ObjectId()) == []
+
+
+@pytest.mark.asyncio
+async def test_crawl_records_only_changes(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    for _ in range(2):
+        async with site.client() as client:
+            await Crawler(BASE_URL, concurrency=4).crawl(site.start_url, client=client)
+        site.prices[site.slugs[0]] += 5.0
+
+    book = await mock_db["books"].find_one({"source_url": site.book_url(site.slugs[0])})
+    points = await history.read(mock_db["price_history"], book["_id"])
+    assert [p["price_excl_vat"] for p in points] == [10.0, 15.0]
+    assert points[0]["availability"] == "In stock (5 available)"
+
+    other = await mock_db["books"].find_one({"source_url": site.book_url(site.slugs[1])})
+    assert len(await history.read(mock_db["price_history"], other["_id"])) == 1
@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import httpx
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from api import routes
+from api.auth import check_api_key
+from crawler import runs
+from scheduler import jobs
+from tests.catalogue import CatalogueSite
+from utils.config import appsettings
+
+
+class TaskProc:
+    """Stands in for the crawl's child process: runs the job on this loop."""
+
+    def __init__(self, run_id):
+        self.task = asyncio.create_task(jobs.run_crawl_job(run_id=run_id))
+
+    @property
+    def returncode(self):
+        if not self.task.done():
+            return None
+        return 1 if self.task.cancelled() or self.task.exception() else 0
+
+    def poll(self):
+        return self.returncode
+
+
+@pytest.fixture
+def crawl_api(mock_db, monkeypatch):
+    site = CatalogueSite(pages=3, per_page=10, latency=0.01)
+    runner = jobs.CrawlRunner()
+    monkeypatch.setattr(runner, "_spawn", TaskProc)
+    monkeypatch.setattr(routes, "runner", runner)
+    monkeypatch.setattr(jobs, "get_client", site.client)
+    monkeypatch.setattr(appsettings, "CRAWL_PROGRESS_INTERVAL", 0.02)
+    monkeypatch.setattr(appsettings, "CRAWL_INCREMENTAL", False)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[check_api_key] = lambda: "testkey"
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api")
+    return client, runner, site
+
+
+@pytest.mark.asyncio
+async def test_crawl_runs_in_the_background_one_at_a_time(crawl_api, mock_db):
+    api, runner, site = crawl_api
+    r = await api.post("/crawls")
+    assert r.status_code == 202
+    run_id = r.json()["id"]
+    assert (await api.post("/crawls")).status_code == 409
+
+    # the request returned before the crawl did; it reports progress as it goes
+    for _ in range(200):
+        run = (await api.get(f"/crawls/{run_id}")).json()
+        if run.get("progress", {}).get("pages"):
+            break
+        await asyncio.sleep(0.01)
+    assert run["status"] == runs.RUNNING
+    assert run["progress"]["pages"]
+
+    run = await runner.wait(ObjectId(run_id), poll=0.01)
+    assert run["status"] == runs.FINISHED
+    body = (await api.get(f"/crawls/{run_id}")).json()
+    assert body["status"] == runs.FINISHED
+    assert body["progress"]["books"] == 30
+    assert await mock_db["books"].count_documents({}) == 30
+    assert await mock_db["locks"].count_documents({}) == 0
+    # nothing will resume a finished run
+    assert await mock_db["frontier"].count_documents({}) == 0
+
+    # the lock is free again
+    r = await api.post("/crawls", json={"mode": "full", "resume": False})
+    assert r.status_code == 202
+    await runner.wait(ObjectId(r.json()["id"]), poll=0.01)
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_the_crawl(crawl_api, mock_db):
+    api, runner, site = crawl_api
+    site.latency = 0.05
+    run_id = (await api.post("/crawls")).json()["id"]
+    await asyncio.sleep(0.1)
+    r = await api.post(f"/crawls/{run_id}/cancel")
+    assert r.status_code == 202
+
+    run = await runner.wait(ObjectId(run_id), poll=0.01)
+    assert run["status"] == runs.CANCELLED
+    assert await mock_db["frontier"].count_documents({}) == 0
+    assert await mock_db["books"].count_documents({}) < 30
+    assert await mock_db["locks"].count_documents({}) == 0
+    assert (await api.post(f"/crawls/{run_id}/cancel")).status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_crawl_status_errors_and_staleness(crawl_api, mock_db):
+    api, runner, site = crawl_api
+    assert (await api.get("/crawls/nope")).status_code == 404
+    assert (await api.get(f"/crawls/{ObjectId()}")).status_code == 404
+    assert (await api.post(f"/crawls/{ObjectId()}/cancel")).status_code == 404
+    assert (await api.post("/crawls", json={"mode": "weekly"})).status_code == 422
+
+    # a run whose process died without a trace
+    old = datetime.now(timezone.utc) - timedelta(seconds=appsettings.CRAWL_LOCK_TTL + 1)
+    run_id = await runs.start_run(site.start_url, mode=runs.FULL, heartbeat=old)
+    assert (await api.get(f"/crawls/{run_id}")).json()["status"] == "stale"
+
+
+@pytest.mark.asyncio
+async def test_failed_run_keeps_its_frontier_to_resume(crawl_api, mock_db, monkeypatch):
+    api, runner, site = crawl_api
+
+    async def crash(self, start_url, client=None, frontier=None):
+        self.frontier = frontier
+        await frontier.add([start_url], "listing")
+        raise RuntimeError("mongo went away")
+
+    monkeypatch.setattr(jobs.Crawler, "crawl", crash)
+    run_id = (await api.post("/crawls")).json()["id"]
+    run = await runner.wait(ObjectId(run_id), poll=0.01)
+    assert run["status"] == runs.FAILED
+    assert await mock_db["frontier"].count_documents({"run_id": run_id}) == 1
@@ -0,0 +1,84 @@
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+from api import cache as api_cache
+from api.auth import check_api_key
+from api.main import app
+from crawler.crawler_manager import Crawler
+from utils import metrics
+from tests.catalogue import CatalogueSite, BASE_URL
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    metrics.REGISTRY.clear()
+    yield
+    metrics.REGISTRY.clear()
+
+
+def test_render_prometheus_text():
+    registry = metrics.Registry()
+    hist = registry.histogram("t_seconds", "Test.", ["op"], buckets=(0.1, 1))
+    hist.observe(0.05, op="a")
+    hist.observe(0.5, op="a")
+    registry.counter("t_total", "Test.", ["kind"]).inc(kind='say "hi"')
+
+    lines = registry.render().splitlines()
+    assert "# TYPE t_seconds histogram" in lines
+    assert 't_seconds_bucket{op="a",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{op="a",le="1"} 2' in lines
+    assert 't_seconds_bucket{op="a",le="+Inf"} 2' in lines
+    assert 't_seconds_count{op="a"} 2' in lines
+    assert 't_total{kind="say \\"hi\\""} 1' in lines
+
+
+@pytest.mark.asyncio
+async def test_crawler_metrics_come_from_the_crawl_process(monkeypatch):
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(metrics, "_redis", redis)
+    metrics.PAGES.inc(kind="book", outcome="new")
+    metrics.STREAM_DROPPED.inc()
+    await metrics.export_crawler()
+
+    # the API process: its own crawler_* metrics never moved
+    metrics.REGISTRY.clear()
+    metrics.STREAM_DROPPED.inc(2)
+    lines = (await metrics.render()).splitlines()
+    assert 'crawler_pages_total{kind="book",outcome="new"} 1' in lines
+    assert lines.count("# TYPE crawler_pages_total counter") == 1
+    assert "api_change_stream_dropped_total 2" in lines
+
+
+def test_labels_must_match():
+    with pytest.raises(ValueError):
+        metrics.PAGES.inc(kind="book")
+
+
+@pytest.mark.asyncio
+async def test_crawl_is_instrumented(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    crawler = Crawler(BASE_URL, concurrency=4)
+    async with site.client() as client:
+        await crawler.crawl(site.start_url, client=client)
+
+    assert metrics.PAGES.value(kind="book", outcome="new") == 10
+    assert metrics.PAGES.value(kind="listing", outcome="ok") == 2
+    assert metrics.FETCH_SECONDS.count(status=200) == 12
+    assert metrics.PARSE_SECONDS.count(kind="book") == 10
+    assert metrics.DB_SECONDS.count(op="bulk_write") >= 1
+    summary = crawler.run_stats.summary()
+    assert summary["pages"] == {"listing:ok": 2, "book:new": 10}
+    assert summary["fetch_p99"] >= summary["fetch_p50"] > 0
+    assert summary["books_per_sec"] > 0
+
+
+def test_metrics_endpoint_times_routes(mock_db):
+    api_cache.reset_backend()
+    app.dependency_overrides[check_api_key] = lambda: "testkey"
+    try:
+        client = TestClient(app)
+        assert client.get("/changes").status_code == 200
+        body = client.get("/metrics").text
+    finally:
+        app.dependency_overrides.clear()
+    assert 'api_request_seconds_count{method="GET",route="/changes",status="200"} 1' in body
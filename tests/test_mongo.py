@@ -15,6 +15,12 @@ def mock_motor_client(monkeypatch):
     monkeypatch.setattr(mongo, "db", mock_client["testdb"])
     monkeypatch.setattr(mongo, "books_col", mock_client["testdb"]["books"])
     monkeypatch.setattr(mongo, "changes_col", mock_client["testdb"]["changes"])
+    monkeypatch.setattr(mongo, "snapshots_col", mock_client["testdb"]["snapshots"])
+    monkeypatch.setattr(mongo, "frontier_col", mock_client["testdb"]["frontier"])
+    monkeypatch.setattr(mongo, "crawl_runs_col", mock_client["testdb"]["crawl_runs"])
+    monkeypatch.setattr(mongo, "listings_col", mock_client["testdb"]["listings"])
+    monkeypatch.setattr(mongo, "stats_col", mock_client["testdb"]["category_stats"])
+    monkeypatch.setattr(mongo, "history_col", mock_client["testdb"]["price_history"])
 
     return mock_client
 
@@ -27,6 +33,17 @@ async def test_index_creation(mock_motor_client):
 
     assert "source_url_1" in index_info
     assert "category_1_price_excl_vat_1" in index_info
+    assert "book_id_1" in await mongo.changes_col.index_information()
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_drops_the_misnamed_changes_index(mock_motor_client):
+    await mongo.changes_col.create_index("books_id")
+    await mongo.ensure_indexes()
+
+    index_info = await mongo.changes_col.index_information()
+    assert "books_id_1" not in index_info
+    assert "book_id_1" in index_info
 
 
 @pytest.mark.asyncio
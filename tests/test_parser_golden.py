@@ -0,0 +1,59 @@
+"""
+Golden-file tests: every page under tests/fixtures/golden must parse to
+exactly the output recorded next to it (<name>.json). Book pages go through
+`parse_book`, listing_*.html through `parse_page` and `parse_listing`; a
+recorded {"error": true} means the parser must raise.
+
+After an intentional change to the parser's output, re-record with
+
+    python -m tests.test_parser_golden
+"""
+import glob
+import json
+import os
+import pytest
+from crawler.parser import parse_book, parse_listing, parse_page
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "golden")
+BASE_URL = "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html"
+
+
+def pages() -> list[str]:
+    return sorted(os.path.basename(p)[:-len(".html")]
+                  for p in glob.glob(os.path.join(GOLDEN_DIR, "*.html")))
+
+
+def _call(fn, html):
+    try:
+        return fn(html, BASE_URL)
+    except Exception:
+        return {"error": True}
+
+
+def parse(name: str) -> dict:
+    with open(os.path.join(GOLDEN_DIR, f"{name}.html"), encoding="utf-8") as f:
+        html = f.read()
+    if name.startswith("listing_"):
+        return {"parse_page": _call(parse_page, html),
+                "parse_listing": _call(parse_listing, html)}
+    return {"parse_book": _call(parse_book, html)}
+
+
+def _normalize(value):
+    # tuples come back from json as lists
+    return json.loads(json.dumps(value))
+
+
+@pytest.mark.parametrize("name", pages())
+def test_golden(name):
+    with open(os.path.join(GOLDEN_DIR, f"{name}.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    assert _normalize(parse(name)) == expected
+
+
+if __name__ == "__main__":
+    for name in pages():
+        with open(os.path.join(GOLDEN_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(parse(name), f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(name)
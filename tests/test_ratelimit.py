@@ -0,0 +1,117 @@
+import asyncio
+import time
+import httpx
+import pytest
+from crawler.client import fetch
+from crawler.ratelimit import HostLimiter, HostLimiters, backoff_delay, parse_retry_after
+from utils.config import appsettings
+
+
+@pytest.mark.asyncio
+async def test_limit_grows_when_healthy_and_halves_on_trouble():
+    limiter = HostLimiter(initial=4, minimum=1, maximum=6, increase=1,
+                          decrease=0.5, latency_target=1.0)
+    # one request at a time never reaches the limit: nothing to learn
+    for _ in range(40):
+        await limiter.acquire()
+        await limiter.release(0.01, ok=True)
+    assert limiter.limit == 4
+
+    async def one():
+        await limiter.acquire()
+        await asyncio.sleep(0.001)
+        await limiter.release(0.01, ok=True)
+
+    await asyncio.gather(*(one() for _ in range(60)))
+    assert limiter.limit == 6
+
+    await limiter.acquire()
+    await limiter.release(0.01, ok=False)
+    assert limiter.limit == 3
+
+
+@pytest.mark.asyncio
+async def test_limit_never_exceeds_crawl_concurrency(monkeypatch):
+    monkeypatch.setattr(appsettings, "CRAWL_CONCURRENCY", 3)
+    assert HostLimiter(maximum=32).maximum == 3
+    assert HostLimiter(minimum=1).maximum == 3
+    assert HostLimiter(initial=10).limit == 3
+
+
+@pytest.mark.asyncio
+async def test_default_limit_can_grow():
+    limiter = HostLimiter()
+    assert limiter.limit < limiter.maximum == appsettings.CRAWL_CONCURRENCY
+
+
+@pytest.mark.asyncio
+async def test_limit_caps_in_flight():
+    limiter = HostLimiter(initial=2, minimum=1, maximum=2)
+    peak = 0
+
+    async def one():
+        nonlocal peak
+        await limiter.acquire()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.release(0.01, ok=True)
+
+    await asyncio.gather(*(one() for _ in range(10)))
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_honours_retry_after():
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.2"})
+        return httpx.Response(200, text="ok")
+
+    limiters = HostLimiters(initial=4, minimum=1, maximum=8)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        response = await fetch("https://example.com/a", client, limiters=limiters)
+
+    assert response.text == "ok"
+    assert calls[1] - calls[0] >= 0.2
+    assert limiters.get("https://example.com/").limit < 4
+
+
+@pytest.mark.asyncio
+async def test_fetch_does_not_retry_404():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(404)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            await fetch("https://example.com/missing", client, limiters=HostLimiters())
+    assert len(calls) == 1
+
+
+def test_backoff_and_retry_after_parsing():
+    assert all(0 <= backoff_delay(5, base=1, cap=4) <= 4 for _ in range(100))
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_fetch_gives_its_slot_back():
+    async def handler(request):
+        await asyncio.sleep(10)
+
+    limiters = HostLimiters(initial=2, minimum=1, maximum=2)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        task = asyncio.create_task(fetch("https://example.com/a", client, limiters=limiters))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    host = limiters.get("https://example.com/")
+    assert host.in_flight == 0 and host.limit == 2
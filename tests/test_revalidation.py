@@ -0,0 +1,54 @@
+import httpx
+import pytest
+from crawler.crawler_manager import Crawler
+from tests.conftest import LAST_MODIFIED
+
+
+async def _crawl(site):
+    async with httpx.AsyncClient() as client:
+        await Crawler(site.base_url, concurrency=4).crawl(
+            f"{site.base_url}/page-1.html", client=client)
+
+
+def _book_statuses(site):
+    return [status for path, status in site.statuses if "/index.html" in path]
+
+
+@pytest.mark.asyncio
+async def test_validators_are_stored(stub_server, mock_db):
+    await _crawl(stub_server)
+
+    doc = await mock_db["books"].find_one({})
+    assert doc["etag"].startswith('"')
+    assert doc["last_modified"] == LAST_MODIFIED
+    assert doc["last_seen"] is not None
+
+
+@pytest.mark.asyncio
+async def test_unchanged_catalogue_is_revalidated_with_304(stub_server, mock_db):
+    await _crawl(stub_server)
+    before = {d["source_url"]: d async for d in mock_db["books"].find({})}
+    stub_server.statuses.clear()
+
+    await _crawl(stub_server)
+
+    assert _book_statuses(stub_server) == [304] * 10
+    assert await mock_db["changes"].count_documents({}) == 10  # only the "new" ones
+    async for doc in mock_db["books"].find({}):
+        old = before[doc["source_url"]]
+        assert doc["crawl_timestamp"] == old["crawl_timestamp"]
+        assert doc["last_seen"] > old["last_seen"]
+
+
+@pytest.mark.asyncio
+async def test_changed_book_is_refetched(stub_server, mock_db):
+    await _crawl(stub_server)
+    stub_server.statuses.clear()
+    slug = next(iter(stub_server.prices))
+    stub_server.prices[slug] = 99.0
+
+    await _crawl(stub_server)
+
+    assert sorted(_book_statuses(stub_server)) == [200] + [304] * 9
+    change = await mock_db["changes"].find_one({"change_type": "updated"})
+    assert change["details"]["price_incl_vat"]["new"] == 99.0
@@ -0,0 +1,81 @@
+import os
+import httpx
+import pytest
+import mongomock_motor
+from fastapi import FastAPI
+from api import routes
+from api.auth import check_api_key
+from crawler.crawler_manager import Crawler
+from db.snapshots import FileSnapshotStore, MongoSnapshotStore
+from tests.catalogue import CatalogueSite, BASE_URL
+from utils.config import appsettings
+
+HTML = "<html><body>" + "same page " * 200 + "</body></html>"
+
+
+@pytest.mark.asyncio
+async def test_file_store_roundtrip_and_dedup(tmp_path):
+    store = FileSnapshotStore(str(tmp_path), codec="gzip")
+    await store.put_many({"ab12": HTML})
+    await store.put_many({"ab12": HTML})
+
+    files = [f for _, _, fs in os.walk(tmp_path) for f in fs]
+    assert files == ["ab12.gz"]
+    assert os.path.getsize(tmp_path / "ab" / "ab12.gz") < len(HTML)
+    assert await store.get("ab12") == HTML
+    assert await store.get("ffff") is None
+
+
+@pytest.mark.asyncio
+async def test_mongo_store_roundtrip_and_dedup():
+    col = mongomock_motor.AsyncMongoMockClient()["testdb"]["snapshots"]
+    store = MongoSnapshotStore(col, codec="gzip")
+    await store.put_many({"ab12": HTML, "cd34": "<html></html>"})
+    await store.put_many({"ab12": HTML})
+
+    assert await col.count_documents({}) == 2
+    assert await store.get("ab12") == HTML
+
+
+@pytest.mark.asyncio
+async def test_crawl_keeps_html_out_of_books(mock_db):
+    db = mock_db
+    store = MongoSnapshotStore(db["snapshots"], codec="gzip")
+    site = CatalogueSite(pages=1, per_page=4)
+    async with site.client() as client:
+        await Crawler(BASE_URL, snapshots=store).crawl(site.start_url, client=client)
+
+    assert await db["books"].count_documents({"raw_html": {"$exists": True}}) == 0
+    book = await db["books"].find_one({})
+    html = await store.get(book["content_hash"])
+    assert book["name"] in html
+
+
+@pytest.mark.asyncio
+async def test_recrawl_moves_inline_html_to_the_store(mock_db, monkeypatch):
+    db = mock_db
+    site = CatalogueSite(pages=1, per_page=2)
+    # books from before the snapshot store kept their page inline
+    monkeypatch.setattr(appsettings, "SNAPSHOT_BACKEND", "none")
+    async with site.client() as client:
+        await Crawler(BASE_URL).crawl(site.start_url, client=client)
+    assert await db["books"].count_documents({"raw_html": {"$exists": True}}) == 2
+
+    slug = site.slugs[0]
+    site.prices[slug] = 42.0
+    store = MongoSnapshotStore(db["snapshots"], codec="gzip")
+    async with site.client() as client:
+        await Crawler(BASE_URL, snapshots=store).crawl(site.start_url, client=client)
+
+    book = await db["books"].find_one({"source_url": site.book_url(slug)})
+    assert "raw_html" not in book
+    monkeypatch.setattr(routes, "snapshot_store", store)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[check_api_key] = lambda: "testkey"
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                 base_url="http://api") as api:
+        r = await api.get(f"/books/{book['_id']}/snapshot")
+        assert r.status_code == 200
+        assert "42.00" in r.text
+        assert (await api.get("/books/nope/snapshot")).status_code == 404
@@ -0,0 +1,85 @@
+import pytest
+from bson import ObjectId
+from crawler.crawler_manager import Crawler
+from db import stats
+from tests.catalogue import CatalogueSite, BASE_URL
+
+
+async def _crawl(site):
+    async with site.client() as client:
+        await Crawler(BASE_URL, concurrency=4).crawl(site.start_url, client=client)
+
+
+@pytest.mark.asyncio
+async def test_crawl_maintains_summary(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    await _crawl(site)
+
+    summary = await mock_db["category_stats"].find_one({"_id": "Poetry"})
+    assert summary["count"] == 10
+    assert summary["price_min"] == 10.0 and summary["price_max"] == 14.0
+    assert summary["ratings"] == {"3": 10}
+    assert await stats.rebuild(mock_db["books"], mock_db["category_stats"], dry_run=True) == {}
+
+
+@pytest.mark.asyncio
+async def test_changed_prices_move_bounds(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    await _crawl(site)
+    for slug, price in site.prices.items():
+        if price == 10.0:
+            site.prices[slug] = 50.0
+
+    await _crawl(site)
+
+    summary = await mock_db["category_stats"].find_one({"_id": "Poetry"})
+    assert summary["count"] == 10
+    assert summary["price_min"] == 11.0 and summary["price_max"] == 50.0
+    assert await stats.rebuild(mock_db["books"], mock_db["category_stats"], dry_run=True) == {}
+
+
+@pytest.mark.asyncio
+async def test_recategorized_book_moves_between_summaries(mock_db):
+    books, col = mock_db["books"], mock_db["category_stats"]
+    summary = stats.CategoryStats(col)
+    old = {"_id": ObjectId(), "category": "Travel", "price_excl_vat": 5.0, "rating": 2}
+    await books.insert_one(old)
+    summary.add(old)
+    await summary.flush(books)
+
+    new = {**old, "category": "Poetry", "rating": 4}
+    await books.replace_one({"_id": old["_id"]}, new)
+    summary.change(old, new)
+    await summary.flush(books)
+
+    assert await col.find_one({"_id": "Travel"}) is None
+    assert (await col.find_one({"_id": "Poetry"}))["ratings"] == {"4": 1}
+    assert await stats.rebuild(books, col, dry_run=True) == {}
+
+
+@pytest.mark.asyncio
+async def test_rebuild_repairs_drift(mock_db):
+    site = CatalogueSite(pages=1, per_page=5)
+    await _crawl(site)
+    col = mock_db["category_stats"]
+    await col.update_one({"_id": "Poetry"}, {"$inc": {"count": 3}})
+
+    assert await stats.rebuild(mock_db["books"], col) == {"Poetry": ["count"]}
+    assert (await col.find_one({"_id": "Poetry"}))["count"] == 5
+    assert await stats.rebuild(mock_db["books"], col, dry_run=True) == {}
+
+
+@pytest.mark.asyncio
+async def test_summary_is_seeded_from_books_stored_before_it(mock_db):
+    site = CatalogueSite(pages=2, per_page=5)
+    await _crawl(site)
+    # a database from before the summary existed
+    await mock_db["category_stats"].delete_many({})
+    site.prices[site.slugs[0]] = 99.0
+
+    await _crawl(site)
+
+    summary = await mock_db["category_stats"].find_one({"_id": "Poetry"})
+    assert summary["count"] == 10 and summary["price_max"] == 99.0
+    assert await stats.rebuild(mock_db["books"], mock_db["category_stats"], dry_run=True) == {}
+    assert not await stats.seed(mock_db["books"], mock_db["category_stats"])
@@ -0,0 +1,90 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from utils.logger import get_logger
+
+logger = get_logger("cache")
+
+GENERATION_KEY = "cache:books:generation"
+
+# bumped whenever the crawler writes books; part of every cache key, so a
+# bump makes all earlier entries unreachable
+_generation = 0
+_redis = None
+
+
+def configure(redis_client):
+    """Share the generation counter (and cached responses) through Redis."""
+    global _redis
+    _redis = redis_client
+
+
+async def bump_generation():
+    global _generation
+    _generation += 1
+    if _redis is not None:
+        try:
+            await _redis.incr(GENERATION_KEY)
+        except Exception as e:
+            logger.warning("could not bump cache generation in redis: %s", e)
+
+
+async def current_generation() -> int:
+    if _redis is not None:
+        try:
+            return int(await _redis.get(GENERATION_KEY) or 0)
+        except Exception as e:
+            logger.warning("could not read cache generation from redis: %s", e)
+    return _generation
+
+
+class LRUCache:
+    """In-process LRU with a per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class RedisCache:
+    """Same interface, stored in Redis so API workers share entries.
+
+    Values must be JSON-serialisable. Redis errors degrade to cache misses.
+    """
+
+    def __init__(self, ttl: float, prefix: str = "cache:books:"):
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await _redis.get(self.prefix + key)
+        except Exception as e:
+            logger.warning("redis cache get failed: %s", e)
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Any):
+        try:
+            await _redis.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+        except Exception as e:
+            logger.warning("redis cache set failed: %s", e)
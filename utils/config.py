@@ -9,10 +9,59 @@ class Settings(BaseSettings):
     BASE_URL: str = "https://books.toscrape.com/catalogue"
     API_KEYS: list[str] = ["devkey123"]  # production: load from secure store
     RATE_LIMIT_PER_HOUR: int = 100
+    RATE_LIMIT_PRECHECK: bool = True  # reject known-empty buckets without asking Redis
     CRAWL_CONCURRENCY: int = 10
     CRAWL_RETRY: int = 3
     CRAWL_TIMEOUT: int = 20
+    CRAWL_CONNECT_TIMEOUT: float = 5.0
+    CRAWL_READ_TIMEOUT: Optional[float] = None  # defaults to CRAWL_TIMEOUT
+    CRAWL_WRITE_TIMEOUT: float = 10.0
+    CRAWL_POOL_TIMEOUT: float = 10.0  # wait for a free pooled connection
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP2_ENABLED: bool = False  # needs the h2 package
+    # per-host adaptive limit: starts here and grows while the host keeps
+    # up, up to CRAWL_CONCURRENCY (the crawl's own ceiling)
+    CRAWL_HOST_INITIAL_CONCURRENCY: int = 4
+    CRAWL_HOST_MIN_CONCURRENCY: int = 1
+    CRAWL_AIMD_INCREASE: float = 1.0  # limit grows by ~this per healthy window
+    CRAWL_AIMD_DECREASE: float = 0.5  # limit is multiplied by this on trouble
+    CRAWL_LATENCY_TARGET: float = 2.0  # seconds; slower responses count as trouble
+    CRAWL_BACKOFF_BASE: float = 0.5
+    CRAWL_BACKOFF_MAX: float = 30.0
+    CRAWL_RETRY_PASSES: int = 1  # extra passes over urls that failed
+    CRAWL_QUEUE_SIZE: int = 200  # book urls buffered ahead of the workers
+    CRAWL_WRITE_BATCH: int = 500  # book ops per bulk_write
+    CRAWL_WRITE_INTERVAL: float = 2.0  # seconds before a partial batch is flushed
+    PARSE_MODE: str = "inline"  # "inline", "thread" or "process"
+    PARSE_WORKERS: Optional[int] = None  # pool size, defaults to the cpu count
     SCHEDULER_ENABLED: bool = True
+    CRAWL_INCREMENTAL: bool = True  # scheduled crawls skip unchanged listing pages
+    CRAWL_FULL_EVERY_DAYS: int = 7  # ...but do a full crawl at least this often
+    CRAWL_LEASE_SECONDS: float = 120.0  # distributed mode: a worker's hold on leased urls
+    CRAWL_LEASE_BATCH: int = 20  # urls leased per round trip
+    CRAWL_LEASE_POLL: float = 1.0  # idle workers re-check the queue this often
+    CRAWL_PROGRESS_INTERVAL: float = 5.0  # background crawls report progress this often
+    CRAWL_LOCK_TTL: float = 60.0  # a crashed crawl blocks the next one this long
+
+    # Raw HTML snapshots
+    SNAPSHOT_BACKEND: str = "mongo"  # "mongo", "file" or "none"
+    SNAPSHOT_DIR: str = "snapshots"  # used by the "file" backend
+    SNAPSHOT_CODEC: str = "zstd"  # falls back to gzip if zstandard isn't installed
+
+    # Response cache for /books and /books/{id}
+    RESPONSE_CACHE_BACKEND: str = "memory"  # "memory", "redis" or "none"
+    RESPONSE_CACHE_TTL: float = 300.0  # seconds
+    RESPONSE_CACHE_SIZE: int = 1024  # entries, memory backend only
+    SEARCH_BACKEND: str = "mongo"  # "memory": in-process index, for mongomock
+    EXPORT_BATCH_SIZE: int = 1000  # rows per cursor batch and per streamed chunk
+    BOOKS_BATCH_MAX: int = 500  # ids + source_urls per POST /books/batch
+
+    # /changes/stream
+    CHANGE_STREAM_QUEUE: int = 1000  # events a subscriber may lag before it's cut off
+    CHANGE_STREAM_KEEPALIVE: float = 15.0  # seconds between keepalive comments
+    CHANGE_STREAM_REPLAY_BATCH: int = 500  # changes read per query when resuming
 
     # Redis Configuration
     REDIS_HOST: str = "localhost"  # or "127.0.0.1" or your Redis server IP
@@ -0,0 +1,8 @@
+from datetime import datetime, timezone
+
+
+def as_utc(when: datetime) -> datetime:
+    """`when` as an aware UTC datetime; mongo hands datetimes back naive (UTC)."""
+    if when.tzinfo is None:
+        return when.replace(tzinfo=timezone.utc)
+    return when.astimezone(timezone.utc)
@@ -0,0 +1,188 @@
+"""
+Live change events behind GET /changes/stream.
+
+The crawler hands every batch of change records it writes to `publish`:
+one Redis PUBLISH per batch when Redis is configured (`configure`), so
+every API worker's `listen` task receives it, or a direct `hub.dispatch`
+when crawler and API share a process. Either way publishing costs the same
+whatever the number of subscribers.
+
+Each API process fans events out through its `ChangeHub`: every event is
+serialized to its SSE frame once, then offered to each subscriber's bounded
+queue. A subscriber that falls `CHANGE_STREAM_QUEUE` events behind is cut
+off rather than buffered without limit; its client reconnects with
+Last-Event-ID and catches up from the changes collection.
+
+The end of a crawl goes the same way (`crawl_finished`), so that an API
+process can refresh whatever it derives from the books, like the memory
+search index, after a crawl that ran in another process.
+"""
+import asyncio
+import json
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable, Optional
+from bson import ObjectId
+from utils import metrics
+from utils.config import appsettings
+from utils.dates import as_utc
+from utils.logger import get_logger
+
+logger = get_logger("events")
+
+CHANNEL = "changes:events"
+CRAWLS_CHANNEL = "crawls:finished"
+
+# put on a subscriber's queue when it was cut off
+OVERFLOW = object()
+
+_redis = None
+
+# awaited with the run id of every finished crawl
+_crawl_handlers: list[Callable[[str], Awaitable]] = []
+
+
+def configure(redis_client):
+    """Publish through Redis pub/sub, so other processes' hubs see events."""
+    global _redis
+    _redis = redis_client
+
+
+def to_event(change: dict) -> dict:
+    """The JSON-safe form of a change record, as sent to clients."""
+    when = change["when"]
+    return {
+        "id": str(change["_id"]),
+        "book_id": str(change["book_id"]),
+        "source_url": change.get("source_url"),
+        "category": change.get("category"),
+        "change_type": change.get("change_type"),
+        "when": when.isoformat() if isinstance(when, datetime) else when,
+        "details": change.get("details"),
+    }
+
+
+def event_key(event: dict) -> tuple[datetime, ObjectId]:
+    """(when, _id): the order of /changes and of a resumed stream."""
+    return as_utc(datetime.fromisoformat(event["when"])), ObjectId(event["id"])
+
+
+def frame(event: dict) -> str:
+    return f"id: {event['id']}\nevent: change\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+class Subscriber:
+    """One stream's queue of (key, frame) items and its filters."""
+
+    def __init__(self, categories: Optional[Iterable[str]] = None,
+                 change_types: Optional[Iterable[str]] = None,
+                 maxsize: Optional[int] = None):
+        self.categories = set(categories) if categories else None
+        self.change_types = set(change_types) if change_types else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize or appsettings.CHANGE_STREAM_QUEUE)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        return ((self.categories is None or event.get("category") in self.categories) and
+                (self.change_types is None or event.get("change_type") in self.change_types))
+
+    def offer(self, item):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            metrics.STREAM_DROPPED.inc()
+            # make room for the marker; the client resumes from the database
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class ChangeHub:
+    """In-process fan-out of change events to stream subscribers."""
+
+    def __init__(self):
+        self.subscribers: set[Subscriber] = set()
+
+    def subscribe(self, categories=None, change_types=None,
+                  maxsize: Optional[int] = None) -> Subscriber:
+        sub = Subscriber(categories, change_types, maxsize)
+        self.subscribers.add(sub)
+        metrics.STREAM_SUBSCRIBERS.set(len(self.subscribers))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self.subscribers.discard(sub)
+        metrics.STREAM_SUBSCRIBERS.set(len(self.subscribers))
+
+    def dispatch(self, events: list[dict]):
+        if not self.subscribers:
+            return
+        for event in events:
+            item = (event_key(event), frame(event))
+            for sub in self.subscribers:
+                if sub.wants(event):
+                    sub.offer(item)
+
+
+hub = ChangeHub()
+
+
+async def publish(changes: list[dict]):
+    """Announce change records that were just written (they carry their _id)."""
+    if not changes:
+        return
+    events = [to_event(c) for c in changes]
+    if _redis is not None:
+        try:
+            await _redis.publish(CHANNEL, json.dumps(events, separators=(",", ":")))
+            return
+        except Exception as e:
+            logger.warning("could not publish %d change events to redis: %s", len(events), e)
+    hub.dispatch(events)
+
+
+def on_crawl_finished(handler: Callable[[str], Awaitable]):
+    _crawl_handlers.append(handler)
+
+
+async def _crawl_finished(run_id: str):
+    for handler in _crawl_handlers:
+        try:
+            await handler(run_id)
+        except Exception as e:
+            logger.warning("crawl %s finished, but a handler failed: %s", run_id, e)
+
+
+async def crawl_finished(run_id: str):
+    """Announce the end of a crawl to every process's `on_crawl_finished` handlers."""
+    if _redis is not None:
+        try:
+            await _redis.publish(CRAWLS_CHANNEL, run_id)
+            return
+        except Exception as e:
+            logger.warning("could not publish the end of crawl %s to redis: %s", run_id, e)
+    await _crawl_finished(run_id)
+
+
+async def listen(redis_client, retry: float = 1.0):
+    """Feed `hub` and the crawl handlers from Redis until cancelled."""
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(CHANNEL, CRAWLS_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                if message["channel"] == CRAWLS_CHANNEL:
+                    await _crawl_finished(message["data"])
+                else:
+                    hub.dispatch(json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("change event subscription failed, retrying: %s", e)
+            await asyncio.sleep(retry)
+        finally:
+            await pubsub.aclose()
@@ -3,3 +3,8 @@ import hashlib
 
 def sha256_text(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_digest(text: str) -> bytes:
+    """Raw 32-byte form of `sha256_text`, for compact in-memory comparisons."""
+    return hashlib.sha256(text.encode("utf-8")).digest()
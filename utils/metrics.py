@@ -0,0 +1,231 @@
+"""
+A small in-process metrics registry rendered in the Prometheus text format.
+
+Counters, gauges and histograms with optional labels, rendered by
+`REGISTRY.render()`. Values live in the process that records them, so with
+several API workers each one reports its own. A crawl runs in a process of
+its own and exports its crawler_* metrics to Redis (`export_crawler`), and
+`render`, which /metrics serves, shows those in place of the API process's
+own. Counters restart with every crawl process, which Prometheus treats as
+a counter reset.
+"""
+from bisect import bisect_left
+from typing import Iterable, Optional
+from utils.logger import get_logger
+
+logger = get_logger("metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: tuple, extra: Optional[tuple] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{self._labels(key)} {_format(value)}"
+                for key, value in self._values.items()]
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}",
+                *self.samples()]
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # per-bucket (not cumulative) counts, sum, count
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> list[str]:
+        out = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                out.append(f"{self.name}_bucket{self._labels(key, ('le', _format(bound)))} "
+                           f"{cumulative}")
+            out.append(f"{self.name}_sum{self._labels(key)} {_format(total)}")
+            out.append(f"{self.name}_count{self._labels(key)} {count}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self, prefix: str = "", exclude: Optional[str] = None) -> str:
+        """Metrics whose name starts with `prefix` but not with `exclude`."""
+        lines = []
+        for metric in self.metrics.values():
+            if metric.name.startswith(prefix) and \
+                    not (exclude and metric.name.startswith(exclude)):
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+# crawler
+FETCH_SECONDS = REGISTRY.histogram(
+    "crawler_fetch_seconds", "Latency of single HTTP fetch attempts.", ["status"])
+FETCH_RETRIES = REGISTRY.counter(
+    "crawler_fetch_retries_total", "Fetch attempts that were retried.", ["reason"])
+FETCH_FAILURES = REGISTRY.counter(
+    "crawler_fetch_failures_total", "Fetches that ran out of retries.")
+PARSE_SECONDS = REGISTRY.histogram(
+    "crawler_parse_seconds", "Parse + hash time per page, executor wait included.", ["kind"])
+DB_SECONDS = REGISTRY.histogram(
+    "crawler_db_seconds", "Time spent in crawl database calls.", ["op"])
+PAGES = REGISTRY.counter(
+    "crawler_pages_total", "Pages crawled, by kind and outcome.", ["kind", "outcome"])
+SEMAPHORE_WAITING = REGISTRY.gauge(
+    "crawler_semaphore_waiting", "Fetches waiting for a crawl concurrency slot.")
+QUEUE_DEPTH = REGISTRY.gauge(
+    "crawler_queue_depth", "Book urls queued for the workers.")
+
+# api
+REQUEST_SECONDS = REGISTRY.histogram(
+    "api_request_seconds", "API request latency, streamed bodies included.",
+    ["method", "route", "status"])
+AUTH_SECONDS = REGISTRY.histogram(
+    "api_auth_seconds", "check_api_key latency, rate limiting included.", ["status"])
+STREAM_SUBSCRIBERS = REGISTRY.gauge(
+    "api_change_stream_subscribers", "Open /changes/stream connections.")
+STREAM_DROPPED = REGISTRY.counter(
+    "api_change_stream_dropped_total", "Stream subscribers cut off for falling behind.")
+
+
+CRAWLER_PREFIX = "crawler_"
+EXPORT_KEY = "metrics:crawler"
+
+_redis = None
+
+
+def configure(redis_client):
+    """Share crawler metrics between the crawl's process and the API's."""
+    global _redis
+    _redis = redis_client
+
+
+async def export_crawler():
+    """Leave this process's crawler_* metrics for the API's /metrics."""
+    if _redis is None:
+        return
+    try:
+        await _redis.set(EXPORT_KEY, REGISTRY.render(prefix=CRAWLER_PREFIX))
+    except Exception as e:
+        logger.warning("could not export crawler metrics to redis: %s", e)
+
+
+async def render() -> str:
+    """This process's metrics, with the crawler_* ones taken from the last
+    crawl process's export when there is one."""
+    exported = None
+    if _redis is not None:
+        try:
+            exported = await _redis.get(EXPORT_KEY)
+        except Exception as e:
+            logger.warning("could not read exported crawler metrics from redis: %s", e)
+    if not exported:
+        return REGISTRY.render()
+    return REGISTRY.render(exclude=CRAWLER_PREFIX) + exported